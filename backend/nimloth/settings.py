@@ -46,12 +46,14 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
+    "persons.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "persons.middleware.TreeRoutingMiddleware",
 ]
 
 ROOT_URLCONF = "nimloth.urls"
@@ -104,6 +106,26 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing (persons.hashers). Argon2 is preferred when the optional
+# argon2-cffi package is installed. Hashes made with other parameters or
+# hashers still verify and are re-hashed with these settings at login.
+PASSWORD_PBKDF2_ITERATIONS = 600000
+PASSWORD_ARGON2_TIME_COST = 2
+PASSWORD_ARGON2_MEMORY_COST = 102400  # KiB
+PASSWORD_ARGON2_PARALLELISM = 8
+
+PASSWORD_HASHERS = [
+    "persons.hashers.TunablePBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+try:
+    import argon2  # noqa: F401
+except ImportError:
+    pass
+else:
+    PASSWORD_HASHERS.insert(0, "persons.hashers.TunableArgon2PasswordHasher")
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
@@ -136,6 +158,17 @@ CORS_ALLOW_ALL_ORIGINS = True
 
 # REST Framework configuration
 REST_FRAMEWORK = {
+    "DEFAULT_RENDERER_CLASSES": [
+        "rest_framework.renderers.JSONRenderer",
+        "persons.renderers.MessagePackRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "rest_framework.parsers.JSONParser",
+        "persons.parsers.MessagePackParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework.authentication.SessionAuthentication",
     ],
@@ -144,6 +177,14 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Response compression (persons.middleware.CompressionMiddleware)
+# Responses smaller than this many bytes are sent uncompressed.
+RESPONSE_COMPRESSION_MIN_SIZE = 1024
+RESPONSE_COMPRESSION_BROTLI_QUALITY = 5
+RESPONSE_COMPRESSION_GZIP_LEVEL = 6
+# Seconds a compressed body of a cacheable response is kept.
+RESPONSE_COMPRESSION_CACHE_TIMEOUT = 3600
+
 # Session settings for authentication
 SESSION_COOKIE_SAMESITE = None
 SESSION_COOKIE_SECURE = False  # Set to True in production with HTTPS
@@ -154,3 +195,81 @@ CSRF_COOKIE_SECURE = False  # Set to True in production with HTTPS
 CSRF_TRUSTED_ORIGINS = [
     "http://localhost:4200",  # Angular frontend
 ]
+
+# Family tree
+# Seconds a computed tree layout stays cached. Layouts are keyed by the graph
+# revision, so edits to parents or birth dates invalidate them immediately.
+PERSON_LAYOUT_CACHE_TIMEOUT = 3600
+
+# Assumed maximum lifespan, used to estimate the missing end of a lifespan
+# for "alive on" and contemporaries queries.
+PERSON_MAX_LIFESPAN_YEARS = 110
+
+# Parent changes and deletions visiting more (ancestor, descendant) pairs of
+# the ancestry index than this are left to a background refresh_ancestry job
+# instead of being applied in the request.
+ANCESTRY_SYNC_LIMIT = 100000
+
+# Directory for the cached binary graph snapshots served by /api/person/graph/.
+GRAPH_SNAPSHOT_DIR = BASE_DIR / "var" / "graph"
+
+# Background jobs
+# Attempts before a failing job is marked as failed, and the delay in seconds
+# before the first retry (doubled for every further attempt).
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = 30
+# Seconds a running job keeps its claim without a heartbeat from its worker;
+# after that it is handed to another worker (or failed, if out of attempts).
+JOB_LEASE_TIMEOUT = 300
+
+# Sessions and authentication
+# Database sessions with a per-process LRU in front (persons.sessions). An
+# entry is trusted for SESSION_LRU_TIMEOUT seconds, which bounds how long a
+# logout handled by another process can go unnoticed here.
+SESSION_ENGINE = "persons.sessions"
+SESSION_LRU_SIZE = 10000
+SESSION_LRU_TIMEOUT = 30
+
+# Users and their linked persons can be cached for the auth check and
+# /api/person/me/, and are evicted whenever either is saved. ACCOUNT_CACHE
+# names the cache to use; it must be shared by all processes (Redis,
+# Memcached...), which a system check enforces, as an eviction has to reach
+# every process. None leaves them uncached. ModelBackend stays listed so
+# sessions created before CachedModelBackend keep working.
+AUTHENTICATION_BACKENDS = [
+    "persons.accounts.CachedModelBackend",
+    "django.contrib.auth.backends.ModelBackend",
+]
+ACCOUNT_CACHE = None
+ACCOUNT_CACHE_TIMEOUT = 300
+
+# Login (persons.auth_views). Password checks run in a pool of this many
+# threads, and attempts are throttled per client IP and per username:
+# (attempts allowed, window in seconds). A successful login resets the
+# username's count and is not counted against the IP.
+LOGIN_HASH_WORKERS = 4
+LOGIN_THROTTLE_IP = (20, 60)
+LOGIN_THROTTLE_USER = (5, 300)
+
+# Admin. Changelists are counted up to ADMIN_COUNT_LIMIT rows (unfiltered
+# lists use the table estimate), and bulk actions work in batches.
+ADMIN_COUNT_LIMIT = 10000
+ADMIN_BATCH_SIZE = 500
+ADMIN_DELETE_PREVIEW = 100
+
+# Family tree partitioning. Add "persons.routers.FamilyTreeRouter" to
+# DATABASE_ROUTERS and list database aliases (SQLite files or Postgres
+# schemas, each migrated with `migrate --database`) in TREE_DATABASES to
+# spread trees over them by id; `python manage.py move_tree` moves the rows
+# of existing trees.
+DATABASE_ROUTERS = []
+TREE_DATABASES = []
+
+# Bulk upsert (POST /api/person/upsert/): records accepted per request, and
+# ids looked up / rows written per query.
+UPSERT_MAX_RECORDS = 10000
+UPSERT_BATCH_SIZE = 500
+
+# Person history: a full snapshot is stored every this many versions, so a
+# past state is rebuilt from at most that many diffs.
+HISTORY_SNAPSHOT_INTERVAL = 20
@@ -18,14 +18,46 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 from persons.auth_views import check_auth, login_view, logout_view
-from persons.views import CurrentUserPersonView, PersonCreateView, PersonDetailView
+from persons.views import (
+    CurrentUserPersonView,
+    JobCancelView,
+    JobDetailView,
+    JobListView,
+    PersonAliveView,
+    PersonConsistencyView,
+    PersonContemporariesView,
+    PersonCreateView,
+    PersonDetailView,
+    PersonGraphView,
+    PersonHistoryView,
+    PersonLayoutView,
+    PersonMergeView,
+    PersonNearView,
+    PersonNeighborhoodView,
+    PersonStatsView,
+    PersonUpsertView,
+)
 from rest_framework.urlpatterns import format_suffix_patterns
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/person/", PersonCreateView.as_view()),
     path("api/person/me/", CurrentUserPersonView.as_view()),
+    path("api/person/graph/", PersonGraphView.as_view()),
+    path("api/person/stats/", PersonStatsView.as_view()),
+    path("api/person/alive/", PersonAliveView.as_view()),
+    path("api/person/near/", PersonNearView.as_view()),
+    path("api/person/consistency/", PersonConsistencyView.as_view()),
+    path("api/person/upsert/", PersonUpsertView.as_view()),
     path("api/person/<int:pk>/", PersonDetailView.as_view()),
+    path("api/person/<int:pk>/neighborhood/", PersonNeighborhoodView.as_view()),
+    path("api/person/<int:pk>/layout/", PersonLayoutView.as_view()),
+    path("api/person/<int:pk>/contemporaries/", PersonContemporariesView.as_view()),
+    path("api/person/<int:pk>/history/", PersonHistoryView.as_view()),
+    path("api/person/<int:pk>/merge/<int:source>/", PersonMergeView.as_view()),
+    path("api/jobs/", JobListView.as_view()),
+    path("api/jobs/<int:pk>/", JobDetailView.as_view()),
+    path("api/jobs/<int:pk>/cancel/", JobCancelView.as_view()),
     path("api/auth/login/", login_view, name="login"),
     path("api/auth/logout/", logout_view, name="logout"),
     path("api/auth/check/", check_auth, name="check_auth"),
@@ -0,0 +1,123 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core import checks
+from django.core.cache import caches
+
+from .models import Person
+from .serializers import PersonSerializer
+
+# Cache backends that keep their entries in each process: evictions done by
+# one process would not reach the others.
+PER_PROCESS_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+def _cache():
+    """Returns the cache configured in ACCOUNT_CACHE, or None."""
+    alias = getattr(settings, "ACCOUNT_CACHE", None)
+    return caches[alias] if alias else None
+
+
+def _timeout():
+    return getattr(settings, "ACCOUNT_CACHE_TIMEOUT", 300)
+
+
+@checks.register(checks.Tags.caches)
+def check_cache(app_configs=None, **kwargs):
+    """
+    ACCOUNT_CACHE must be shared by all processes: a user deactivated or
+    unlinked in one process would otherwise stay cached, and authorized, in
+    the others until the entry expires.
+    """
+    alias = getattr(settings, "ACCOUNT_CACHE", None)
+    if not alias:
+        return []
+    backend = settings.CACHES.get(alias, {}).get("BACKEND")
+    if backend is None:
+        return [
+            checks.Error(
+                f"ACCOUNT_CACHE refers to the unknown cache '{alias}'.",
+                id="persons.E001",
+            )
+        ]
+    if backend in PER_PROCESS_CACHES:
+        return [
+            checks.Error(
+                f"ACCOUNT_CACHE '{alias}' uses {backend}, which is not shared "
+                "between processes.",
+                hint="Use a shared backend such as Redis or Memcached, or set "
+                "ACCOUNT_CACHE = None to leave accounts uncached.",
+                id="persons.E002",
+            )
+        ]
+    return []
+
+
+def _user_key(user_id):
+    return f"persons:account:{user_id}:user"
+
+
+def _person_key(user_id):
+    return f"persons:account:{user_id}:person"
+
+
+def forget(*user_ids):
+    """
+    Drop the cached user and linked person of the given users. Called from
+    the User and Person signals.
+    """
+    cache = _cache()
+    keys = [
+        key(user_id)
+        for user_id in user_ids
+        if user_id
+        for key in (_user_key, _person_key)
+    ]
+    if cache is not None and keys:
+        cache.delete_many(keys)
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend that serves `get_user` from ACCOUNT_CACHE, if configured.
+
+    `get_user` runs for every request of a logged-in user (it is what
+    `request.user` resolves to), so caching it removes the User query from
+    the auth check. The session auth hash is still verified by Django against
+    the cached password hash.
+    """
+
+    def get_user(self, user_id):
+        cache = _cache()
+        if cache is None:
+            return super().get_user(user_id)
+        key = _user_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            cache.set(key, user, _timeout())
+        return user if self.user_can_authenticate(user) else None
+
+
+def linked_person(user):
+    """
+    Returns the serialized person linked to `user`, or None, from
+    ACCOUNT_CACHE if configured.
+    """
+    cache = _cache()
+    key = _person_key(user.pk)
+    cached = cache.get(key) if cache is not None else None
+    if cached is None:
+        person = (
+            Person.objects.filter(user_account=user)
+            .select_related("user_account")
+            .first()
+        )
+        cached = {"person": dict(PersonSerializer(person).data) if person else None}
+        if cache is not None:
+            cache.set(key, cached, _timeout())
+    return cached["person"]
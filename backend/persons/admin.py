@@ -1,7 +1,77 @@
 # admin.py
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils.functional import cached_property
 
-from .models import Person
+from .models import FamilyTree, Person
+
+
+def _estimated_rows(model):
+    """
+    Returns the planner's row estimate for the table of `model`, or the
+    highest primary key where the database keeps no such statistic.
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s", [table])
+        elif connection.vendor == "mysql":
+            cursor.execute(
+                "SELECT table_rows FROM information_schema.tables "
+                "WHERE table_schema = DATABASE() AND table_name = %s",
+                [table],
+            )
+        else:
+            return model._default_manager.aggregate(n=Max("pk"))["n"] or 0
+        row = cursor.fetchone()
+    # PostgreSQL reports -1 for tables that were never analyzed.
+    return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never counts a large table exactly.
+
+    The unfiltered changelist uses the database's row estimate; filtered
+    lists and small tables are counted, but at most up to ADMIN_COUNT_LIMIT
+    rows.
+    """
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_COUNT_LIMIT
+        queryset = self.object_list
+        if not queryset.query.has_filters():
+            estimate = _estimated_rows(queryset.model)
+            if estimate is not None and estimate > limit:
+                return estimate
+        return queryset.order_by()[:limit].count()
+
+
+def _batches(queryset):
+    """
+    Yields the primary keys of `queryset` in ascending batches of
+    ADMIN_BATCH_SIZE, reading each batch after the previous one was handled.
+    """
+    last = None
+    while True:
+        batch = queryset.order_by("pk")
+        if last is not None:
+            batch = batch.filter(pk__gt=last)
+        pks = list(batch.values_list("pk", flat=True)[: settings.ADMIN_BATCH_SIZE])
+        if not pks:
+            return
+        yield pks
+        last = pks[-1]
+
+
+@admin.register(FamilyTree)
+class FamilyTreeAdmin(admin.ModelAdmin):
+    list_display = ("id", "name", "owner", "created_on")
+    search_fields = ("name",)
 
 
 @admin.register(Person)
@@ -13,10 +83,17 @@ class PersonAdmin(admin.ModelAdmin):
         "last_name",
         "date_of_birth",
         "gender",
+        "mother",
+        "father",
     )
+    list_select_related = ("mother", "father")
     list_filter = ("gender", "created_on", "modified_on")
-    search_fields = ("first_name", "middle_name", "last_name", "birth_name")
+    # Matched by prefix through the name indexes, see get_search_results.
+    search_fields = ("first_name", "last_name", "birth_name")
+    autocomplete_fields = ("mother", "father", "created_by", "modified_by")
     readonly_fields = ("created_on", "modified_on")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     fieldsets = (
         (
             "Names",
@@ -49,3 +126,38 @@ class PersonAdmin(admin.ModelAdmin):
             },
         ),
     )
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Search names by prefix using the lower-case name indexes instead of
+        the default `icontains` scan. Also used by the autocomplete widgets.
+        """
+        if not search_term.strip():
+            return queryset, False
+        return queryset.search(search_term), False
+
+    def get_deleted_objects(self, objs, request):
+        """
+        Summarize a bulk deletion instead of collecting every related row,
+        which for thousands of persons takes longer than the deletion.
+        """
+        if isinstance(objs, list):
+            return super().get_deleted_objects(objs, request)
+        preview = settings.ADMIN_DELETE_PREVIEW
+        persons = [str(person) for person in objs.order_by("pk")[: preview + 1]]
+        count = len(persons) if len(persons) <= preview else objs.count()
+        if count > preview:
+            persons[preview:] = [f"... and {count - preview} more"]
+        perms_needed = set()
+        if not self.has_delete_permission(request):
+            perms_needed.add(Person._meta.verbose_name_plural)
+        return persons, {Person._meta.verbose_name_plural: count}, perms_needed, []
+
+    def delete_queryset(self, request, queryset):
+        """
+        Delete in batches of ADMIN_BATCH_SIZE, one transaction each, so large
+        selections neither hold long locks nor build one huge collector.
+        """
+        for pks in _batches(queryset):
+            with transaction.atomic():
+                Person.objects.filter(pk__in=pks).delete()
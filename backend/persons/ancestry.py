@@ -0,0 +1,393 @@
+from collections import Counter, deque
+
+from django.conf import settings
+from django.db import transaction
+
+from . import routers
+from .models import Job, Person, PersonAncestry
+
+# Person fields that define the parent links.
+FIELDS = ("mother_id", "father_id")
+# Job kind that rebuilds the index and then the lineage counts; queued
+# instead of updating both in place when a change is too large (see `defer`).
+REFRESH_JOB = "refresh_ancestry"
+
+
+def stale():
+    """
+    Whether a refresh job is queued or running for the current database, so
+    the index may miss the links changed since it was queued.
+    """
+    return Job.objects.filter(
+        kind=REFRESH_JOB,
+        database=routers.current(),
+        status__in=[Job.QUEUED, Job.RUNNING],
+    ).exists()
+
+
+def _count(**filters):
+    return PersonAncestry.objects.filter(**filters).count() + 1
+
+
+def relink_cost(person, old_parents):
+    """
+    Returns the number of pairs `update_person` visits for the same
+    arguments: the ancestors of each changed parent times the descendants
+    of the person, read with one COUNT per person.
+    """
+    old = Counter(pk for pk in old_parents if pk)
+    new = Counter(pk for pk in (person.mother_id, person.father_id) if pk)
+    changed = list(((old - new) + (new - old)).elements())
+    if not changed:
+        return 0
+    below = _count(ancestor_id=person.pk)
+    return below * sum(_count(descendant_id=pk) for pk in changed)
+
+
+def removal_cost(person):
+    """Returns the number of pairs `remove_person` visits for `person`."""
+    return _count(descendant_id=person.pk) * _count(ancestor_id=person.pk)
+
+
+def defer(cost):
+    """
+    Whether to leave an update visiting `cost` pairs to a refresh job
+    rather than doing it in the request: when it exceeds
+    ANCESTRY_SYNC_LIMIT, or when a refresh is pending anyway, as updating a
+    stale index in place could be overwritten by that refresh.
+    """
+    return cost > settings.ANCESTRY_SYNC_LIMIT or stale()
+
+
+def _walked_pairs(nodes):
+    """
+    Returns the (ancestor, descendant) pairs among `nodes`, found by walking
+    the parent links up from every node, one query per generation. Used for
+    the cycle checks while the index is stale.
+    """
+    reached = {}
+    frontier = {pk: {pk} for pk in nodes}
+    pairs = set()
+    while frontier:
+        parents = {}
+        for pk, mother_id, father_id in Person.objects.filter(
+            pk__in=frontier
+        ).values_list("pk", "mother_id", "father_id"):
+            for parent in (mother_id, father_id):
+                if parent:
+                    parents.setdefault(parent, set()).update(frontier[pk])
+        frontier = {}
+        for parent, below in parents.items():
+            below -= reached.setdefault(parent, set())
+            if below:
+                reached[parent] |= below
+                frontier[parent] = below
+                if parent in nodes:
+                    pairs.update((parent, pk) for pk in below if pk != parent)
+    return pairs
+
+
+def cyclic_parents(person_pk, parent_ids):
+    """
+    Returns the ids among `parent_ids` that cannot become parents of the
+    person `person_pk` because they are the person or one of their
+    descendants.
+
+    This costs one indexed lookup on the ancestry index, however deep the
+    tree is, and none for unsaved persons (which have no descendants yet).
+    While the index is stale, the parent links are walked instead.
+    """
+    parent_ids = {pk for pk in parent_ids if pk}
+    if person_pk is None or not parent_ids:
+        return set()
+    cyclic = parent_ids & {person_pk}
+    others = parent_ids - cyclic
+    if others and stale():
+        pairs = _walked_pairs(others | {person_pk})
+        cyclic.update(pk for ancestor, pk in pairs if ancestor == person_pk)
+    elif others:
+        cyclic.update(
+            PersonAncestry.objects.filter(
+                ancestor_id=person_pk, descendant_id__in=others
+            ).values_list("descendant_id", flat=True)
+        )
+    return cyclic
+
+
+def cyclic_assignments(assignments):
+    """
+    Check several parent assignments that are written together.
+
+    Parameters:
+    -----------
+    assignments : dict
+        person id -> iterable of the new parent ids of that person.
+
+    Returns:
+    --------
+    set
+        The ids of the assigned persons that would end up on (or below) a
+        cycle, formed with the existing tree or with other assignments of
+        the batch.
+
+    One query loads the existing reachability between the persons involved;
+    the new links are then checked in memory with a topological sort. The
+    existing links of the reassigned persons are still taken into account,
+    which can only reject more, never less. While the index is stale, the
+    reachability is found by walking the parent links instead.
+    """
+    links = {pk: {p for p in parents if p} for pk, parents in assignments.items()}
+    nodes = set(links).union(*links.values()) if links else set()
+    if not nodes:
+        return set()
+
+    children = {pk: set() for pk in nodes}
+    for pk, parents in links.items():
+        for parent in parents:
+            children[parent].add(pk)
+    if stale():
+        pairs = _walked_pairs(nodes)
+    else:
+        pairs = PersonAncestry.objects.filter(
+            ancestor_id__in=nodes, descendant_id__in=nodes
+        ).values_list("ancestor_id", "descendant_id")
+    for ancestor, descendant in pairs:
+        children[ancestor].add(descendant)
+
+    pending = Counter(child for linked in children.values() for child in linked)
+    queue = deque(pk for pk in nodes if not pending[pk])
+    while queue:
+        for child in children[queue.popleft()]:
+            pending[child] -= 1
+            if not pending[child]:
+                queue.append(child)
+    return {pk for pk in links if pending[pk]}
+
+
+def _ancestors(pk):
+    paths = dict(
+        PersonAncestry.objects.filter(descendant_id=pk).values_list(
+            "ancestor_id", "paths"
+        )
+    )
+    paths[pk] = 1
+    return paths
+
+
+def _descendants(pk):
+    paths = dict(
+        PersonAncestry.objects.filter(ancestor_id=pk).values_list(
+            "descendant_id", "paths"
+        )
+    )
+    paths[pk] = 1
+    return paths
+
+
+def _apply(above, below, sign):
+    """
+    Add (sign 1) or remove (sign -1) the paths running from every ancestor in
+    `above` to every descendant in `below`, given as {id: path count}.
+    """
+    rows = {
+        (row.ancestor_id, row.descendant_id): row
+        for row in PersonAncestry.objects.filter(
+            ancestor_id__in=above, descendant_id__in=below
+        )
+    }
+    created, updated, emptied = [], [], []
+    for ancestor, up in above.items():
+        for descendant, down in below.items():
+            if ancestor == descendant:
+                continue
+            change = sign * up * down
+            row = rows.get((ancestor, descendant))
+            if row is None:
+                if change > 0:
+                    created.append(
+                        PersonAncestry(
+                            ancestor_id=ancestor, descendant_id=descendant, paths=change
+                        )
+                    )
+                continue
+            row.paths += change
+            if row.paths > 0:
+                updated.append(row)
+            else:
+                emptied.append(row.pk)
+    PersonAncestry.objects.bulk_create(created)
+    PersonAncestry.objects.bulk_update(updated, ["paths"])
+    PersonAncestry.objects.filter(pk__in=emptied).delete()
+
+
+def _change_link(parent_pk, child_pk, sign):
+    _apply(_ancestors(parent_pk), _descendants(child_pk), sign)
+
+
+@transaction.atomic
+def update_person(person, old_parents):
+    """
+    Bring the index up to date after the parents of `person` changed from
+    `old_parents` (a sequence of ids, empty for new persons).
+
+    Only the pairs running through the changed links are touched: the
+    ancestors of the parent times the descendants of the person (see
+    `relink_cost`).
+    """
+    old = Counter(pk for pk in old_parents if pk)
+    new = Counter(pk for pk in (person.mother_id, person.father_id) if pk)
+    for parent_pk in (old - new).elements():
+        _change_link(parent_pk, person.pk, -1)
+    for parent_pk in (new - old).elements():
+        _change_link(parent_pk, person.pk, 1)
+
+
+@transaction.atomic
+def add_persons(persons, chunk_size=10000):
+    """
+    Index persons that have no descendants yet, such as the ones just
+    created by a bulk insert, in one pass instead of one update per link.
+
+    Parents among `persons` are visited before their children; the paths of
+    a person are the sums over its parents, read from the index for parents
+    outside the batch. Persons on cycles are skipped (reject those first).
+    """
+    parents = {
+        person.pk: [pk for pk in (person.mother_id, person.father_id) if pk]
+        for person in persons
+    }
+    closure = {pk: Counter() for linked in parents.values() for pk in linked}
+    outside = set(closure) - set(parents)
+    for ancestor, descendant, count in PersonAncestry.objects.filter(
+        descendant_id__in=outside
+    ).values_list("ancestor_id", "descendant_id", "paths"):
+        closure[descendant][ancestor] = count
+
+    children = {}
+    for pk, linked in parents.items():
+        for parent in linked:
+            children.setdefault(parent, []).append(pk)
+    waiting = {
+        pk: sum(1 for parent in linked if parent in parents)
+        for pk, linked in parents.items()
+    }
+    queue = deque(pk for pk, count in waiting.items() if not count)
+    batch = []
+    while queue:
+        pk = queue.popleft()
+        paths = Counter()
+        for parent in parents[pk]:
+            paths[parent] += 1
+            paths.update(closure[parent])
+        closure[pk] = paths
+        batch.extend(
+            PersonAncestry(ancestor_id=ancestor, descendant_id=pk, paths=count)
+            for ancestor, count in paths.items()
+        )
+        for child in children.get(pk, ()):
+            waiting[child] -= 1
+            if not waiting[child]:
+                queue.append(child)
+    PersonAncestry.objects.bulk_create(batch, batch_size=chunk_size)
+    return len(batch)
+
+
+@transaction.atomic
+def remove_person(person):
+    """
+    Remove every path running through `person` before it is deleted. The
+    rows of the person itself go with it (on_delete=CASCADE).
+    """
+    above = _ancestors(person.pk)
+    below = _descendants(person.pk)
+    del above[person.pk], below[person.pk]
+    through = {
+        (row.ancestor_id, row.descendant_id): row
+        for row in PersonAncestry.objects.filter(
+            ancestor_id__in=above, descendant_id__in=below
+        )
+    }
+    updated, emptied = [], []
+    for (ancestor, descendant), row in through.items():
+        row.paths -= above[ancestor] * below[descendant]
+        if row.paths > 0:
+            updated.append(row)
+        else:
+            emptied.append(row.pk)
+    PersonAncestry.objects.bulk_update(updated, ["paths"])
+    PersonAncestry.objects.filter(pk__in=emptied).delete()
+
+
+def _replace(descendants, rows):
+    """
+    Replace the rows of the persons `descendants` by `rows`, in one
+    transaction, so each person has either all its old or all its new rows.
+    """
+    with transaction.atomic():
+        PersonAncestry.objects.filter(descendant_id__in=descendants).delete()
+        PersonAncestry.objects.bulk_create(rows)
+
+
+def rebuild(chunk_size=10000, progress=None):
+    """
+    Recompute the whole index from the parent links.
+
+    Persons are visited in topological order (parents before children); the
+    path counts of a person are the sums over its parents, and are dropped
+    from memory as soon as all children of that person have been visited.
+    Persons on ancestry cycles are skipped and lose their rows. Returns the
+    number of rows.
+
+    The rows are replaced about `chunk_size` at a time, one transaction per
+    chunk, so a rebuild of a large index neither locks the database for the
+    whole run nor hides its progress; `progress` is called after every
+    chunk, between the transactions. Parent links changed while it runs may
+    be overwritten with the state read at the start: rebuild again then.
+    """
+    parents, children = {}, {}
+    rows = Person.objects.values_list("pk", "mother_id", "father_id")
+    for pk, mother_id, father_id in rows.iterator(chunk_size=chunk_size):
+        parents[pk] = [p for p in (mother_id, father_id) if p]
+        for parent in parents[pk]:
+            children.setdefault(parent, []).append(pk)
+
+    waiting = {pk: len(linked) for pk, linked in parents.items()}
+    unvisited_children = {pk: len(linked) for pk, linked in children.items()}
+    queue = deque(pk for pk, count in waiting.items() if not count)
+    closure, batch, descendants, written, visited = {}, [], [], 0, 0
+    while queue:
+        pk = queue.popleft()
+        visited += 1
+        paths = Counter()
+        for parent in parents[pk]:
+            paths[parent] += 1
+            for ancestor, count in closure[parent].items():
+                paths[ancestor] += count
+            unvisited_children[parent] -= 1
+            if not unvisited_children[parent]:
+                del closure[parent]
+        if pk in children:
+            closure[pk] = paths
+        del waiting[pk]
+        descendants.append(pk)
+        batch.extend(
+            PersonAncestry(ancestor_id=ancestor, descendant_id=pk, paths=count)
+            for ancestor, count in paths.items()
+        )
+        if len(batch) >= chunk_size or len(descendants) >= chunk_size:
+            _replace(descendants, batch)
+            written += len(batch)
+            batch, descendants = [], []
+            if progress:
+                progress(visited / len(parents))
+        for child in children.get(pk, ()):
+            waiting[child] -= 1
+            if not waiting[child]:
+                queue.append(child)
+    _replace(descendants, batch)
+    # What was never visited lies on or below a cycle.
+    cyclic = list(waiting)
+    while cyclic:
+        _replace(cyclic[-chunk_size:], [])
+        del cyclic[-chunk_size:]
+    return written + len(batch)
@@ -1,10 +1,19 @@
-from django.contrib.auth import authenticate, login, logout
-from django.http import JsonResponse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model, login, logout
+from django.contrib.auth.hashers import check_password, make_password
+from django.contrib.auth.signals import user_login_failed
+from django.http import HttpResponseNotAllowed, JsonResponse
 from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
 from django.views.decorators.http import require_http_methods
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
+from . import throttling
+
 
 @ensure_csrf_cookie
 @api_view(["GET"])
@@ -13,12 +22,64 @@ def get_csrf_token(request):
     return Response({"detail": "CSRF cookie set"})
 
 
-@csrf_exempt
-@require_http_methods(["POST"])
-def login_view(request):
+# Password checks are CPU bound. Running them in a bounded pool keeps the
+# event loop free for other requests and caps the cores a login spike takes.
+_hash_pool = None
+
+
+def _pool():
+    global _hash_pool
+    if _hash_pool is None:
+        _hash_pool = ThreadPoolExecutor(
+            max_workers=settings.LOGIN_HASH_WORKERS, thread_name_prefix="login-hash"
+        )
+    return _hash_pool
+
+
+async def _in_pool(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_pool(), func, *args)
+
+
+def _get_user(username):
+    UserModel = get_user_model()
+    try:
+        return UserModel._default_manager.get_by_natural_key(username)
+    except UserModel.DoesNotExist:
+        return None
+
+
+async def _authenticate(request, username, password):
+    """
+    Async counterpart of `authenticate` for the model backend.
+
+    The user is loaded on the sync thread; the password is verified, and
+    re-hashed if it was made with other hasher settings, in the hash pool.
+    """
+    user = await sync_to_async(_get_user)(username)
+    if user is None:
+        # Hash anyway, so response times do not reveal which users exist.
+        await _in_pool(make_password, password)
+    else:
+        outdated = []
+        if await _in_pool(check_password, password, user.password, outdated.append):
+            if outdated:
+                await _in_pool(user.set_password, password)
+                await sync_to_async(user.save)(update_fields=["password"])
+            if user.is_active:
+                return user
+    await sync_to_async(user_login_failed.send)(
+        sender=__name__, credentials={"username": username}, request=request
+    )
+    return None
+
+
+async def login_view(request):
     """Handle user login."""
     import json
 
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
     try:
         data = json.loads(request.body)
         username = data.get("username")
@@ -29,10 +90,21 @@ def login_view(request):
                 {"error": "Username and password are required"}, status=400
             )
 
-        user = authenticate(request, username=username, password=password)
+        wait = await sync_to_async(throttling.attempt)(request, username)
+        if wait:
+            response = JsonResponse(
+                {"error": "Too many login attempts, try again later"}, status=429
+            )
+            response["Retry-After"] = str(wait)
+            return response
+
+        user = await _authenticate(request, username, password)
 
         if user is not None:
-            login(request, user)
+            await sync_to_async(throttling.reset)(request, username)
+            await sync_to_async(login)(
+                request, user, backend=settings.AUTHENTICATION_BACKENDS[0]
+            )
             return JsonResponse(
                 {
                     "success": True,
@@ -55,6 +127,10 @@ def login_view(request):
         return JsonResponse({"error": str(e)}, status=500)
 
 
+# csrf_exempt only wraps sync views in Django 4.2; mark the view directly.
+login_view.csrf_exempt = True
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def logout_view(request):
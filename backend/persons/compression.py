@@ -0,0 +1,45 @@
+import gzip
+import re
+
+import brotli
+from django.conf import settings
+
+# Preferred encodings, best first.
+ENCODINGS = ("br", "gzip")
+
+_accept_encoding = re.compile(r"([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?")
+
+
+def choose_encoding(request):
+    """
+    Returns the best content encoding the client accepts, or None.
+    """
+    accepted = {}
+    for token, quality in _accept_encoding.findall(
+        request.META.get("HTTP_ACCEPT_ENCODING", "")
+    ):
+        try:
+            accepted[token.lower()] = float(quality) if quality else 1.0
+        except ValueError:
+            continue
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+def compress(data, encoding, static=False):
+    """
+    Compress `data` with the given encoding.
+
+    Dynamic responses use a moderate level to keep CPU per request low;
+    `static` payloads that are compressed once and then reused get the
+    highest level.
+    """
+    if encoding == "br":
+        quality = 11 if static else settings.RESPONSE_COMPRESSION_BROTLI_QUALITY
+        return brotli.compress(data, quality=quality)
+    if encoding == "gzip":
+        level = 9 if static else settings.RESPONSE_COMPRESSION_GZIP_LEVEL
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
@@ -0,0 +1,169 @@
+from array import array
+from collections import Counter, deque
+
+from . import revisions
+from .models import Person
+from .parent_index import NO_PARENT, index_parents
+
+# Kinds of inconsistencies reported by `check`.
+DEATH_BEFORE_BIRTH = "death_before_birth"
+CHILD_BORN_BEFORE_PARENT = "child_born_before_parent"
+MOTHER_IS_MALE = "mother_is_male"
+FATHER_IS_FEMALE = "father_is_female"
+ANCESTRY_CYCLE = "ancestry_cycle"
+
+# Date ordinal stored for persons without a date.
+NO_DATE = 0
+# Issues kept in the result of a `check_consistency` job.
+MAX_STORED_ISSUES = 10000
+
+
+def _issue(kind, person, related=None):
+    return {"kind": kind, "person": person, "related": related}
+
+
+def _load(persons, chunk_size, progress=None):
+    """
+    Stream the graph into parallel integer arrays indexed by row, one chunk
+    of persons per query; `progress`, if given, is called with the fraction
+    loaded after every chunk.
+
+    Parent links are kept as person ids here and turned into row indices by
+    `index_parents`, once every id is known.
+    """
+    ids, mothers, fathers = array("q"), array("q"), array("q")
+    births, deaths, genders = array("l"), array("l"), bytearray()
+    total = persons.count() if progress else 0
+    rows = persons.order_by("pk").values_list(
+        "pk", "mother_id", "father_id", "gender", "date_of_birth", "date_of_death"
+    )
+    last_pk = 0
+    while True:
+        chunk = list(rows.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            break
+        for pk, mother_id, father_id, gender, birth, death in chunk:
+            ids.append(pk)
+            mothers.append(mother_id or 0)
+            fathers.append(father_id or 0)
+            genders.append(ord(gender or "U"))
+            births.append(birth.toordinal() if birth else NO_DATE)
+            deaths.append(death.toordinal() if death else NO_DATE)
+        last_pk = chunk[-1][0]
+        if progress:
+            progress(len(ids) / total)
+    return ids, mothers, fathers, genders, births, deaths
+
+
+def _cycles(mothers, fathers):
+    """
+    Returns the row indices on ancestry cycles.
+
+    Kahn's algorithm is run over the child -> parent edges: persons without
+    children are peeled off first, then every parent whose children have all
+    been peeled. What cannot be peeled lies on a cycle or above one; a second
+    pass in the opposite direction (peeling persons without remaining
+    parents) leaves only the rows on cycles.
+    """
+    n = len(mothers)
+    children = array("l", [0]) * n
+    for parents in (mothers, fathers):
+        for parent in parents:
+            if parent != NO_PARENT:
+                children[parent] += 1
+
+    queue = deque(i for i in range(n) if not children[i])
+    while queue:
+        i = queue.popleft()
+        for parent in (mothers[i], fathers[i]):
+            if parent != NO_PARENT:
+                children[parent] -= 1
+                if not children[parent]:
+                    queue.append(parent)
+    remaining = {i for i in range(n) if children[i]}
+    if not remaining:
+        return []
+
+    # The remaining rows are few; trim the ones merely above a cycle.
+    parent_count = {}
+    below = {i: [] for i in remaining}
+    for i in remaining:
+        parents = [p for p in (mothers[i], fathers[i]) if p in remaining]
+        parent_count[i] = len(parents)
+        for parent in parents:
+            below[parent].append(i)
+    queue = deque(i for i, count in parent_count.items() if not count)
+    while queue:
+        i = queue.popleft()
+        remaining.discard(i)
+        for child in below[i]:
+            parent_count[child] -= 1
+            if not parent_count[child]:
+                queue.append(child)
+    return sorted(remaining)
+
+
+def check(chunk_size=10000, tree=None, progress=None):
+    """
+    Validate the whole person graph, or the persons of one family tree.
+
+    Persons are streamed as plain tuples and kept in integer arrays, so no
+    model instance is built and memory stays proportional to a few machine
+    words per person. `progress`, if given, is called with the fraction of
+    persons read after every chunk.
+
+    Returns:
+    --------
+    list
+        One {"kind", "person", "related"} dict per violation, ordered by
+        person id. `related` is the parent involved, if any.
+    """
+    persons = Person.objects.all() if tree is None else Person.objects.for_tree(tree)
+    ids, mothers, fathers, genders, births, deaths = _load(
+        persons, chunk_size, progress
+    )
+    index_parents(ids, mothers)
+    index_parents(ids, fathers)
+
+    issues = []
+    male, female = ord("M"), ord("F")
+    for i, pk in enumerate(ids):
+        birth = births[i]
+        if birth != NO_DATE and deaths[i] != NO_DATE and deaths[i] < birth:
+            issues.append(_issue(DEATH_BEFORE_BIRTH, pk))
+        for parent, wrong_gender, kind in (
+            (mothers[i], male, MOTHER_IS_MALE),
+            (fathers[i], female, FATHER_IS_FEMALE),
+        ):
+            if parent == NO_PARENT:
+                continue
+            if genders[parent] == wrong_gender:
+                issues.append(_issue(kind, pk, ids[parent]))
+            if (
+                birth != NO_DATE
+                and births[parent] != NO_DATE
+                and births[parent] > birth
+            ):
+                issues.append(_issue(CHILD_BORN_BEFORE_PARENT, pk, ids[parent]))
+
+    for i in _cycles(mothers, fathers):
+        issues.append(_issue(ANCESTRY_CYCLE, ids[i]))
+    issues.sort(key=lambda issue: issue["person"])
+    return issues
+
+
+def report(tree=None, chunk_size=10000, progress=None):
+    """
+    Run `check` for the `check_consistency` job and return what it stores:
+    the tree, the persons revision read before the scan, the number of
+    issues in total and by kind, and the first MAX_STORED_ISSUES issues.
+    """
+    revision = revisions.current(revisions.PERSONS, tree=tree)
+    issues = check(chunk_size=chunk_size, tree=tree, progress=progress)
+    return {
+        "tree": tree,
+        "revision": revision,
+        "count": len(issues),
+        "kinds": dict(Counter(issue["kind"] for issue in issues)),
+        "issues": issues[:MAX_STORED_ISSUES],
+    }
@@ -0,0 +1,214 @@
+import re
+from datetime import date, timedelta
+from functools import partial
+
+from django.db.models import Exists, F, OuterRef
+from django.utils.dateparse import parse_date
+
+from .models import Person
+
+# Comparisons of ordered values; "exact" is the one without a suffix.
+COMPARISONS = ("exact", "gt", "gte", "lt", "lte")
+# Query parameters of the list that are not filters.
+RESERVED = ("tree", "as_of", "format", "explain", "ordering")
+
+
+def _integer(raw):
+    try:
+        return int(raw)
+    except ValueError:
+        raise ValueError("must be an integer")
+
+
+def _days(raw):
+    try:
+        return timedelta(days=_integer(raw))
+    except OverflowError:
+        raise ValueError("is out of range")
+
+
+def _day_range(raw):
+    """
+    A date, or a year standing for all its days, as (first, last) day.
+    """
+    if re.fullmatch(r"\d{4}", raw):
+        return date(int(raw), 1, 1), date(int(raw), 12, 31)
+    try:
+        day = parse_date(raw)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValueError("must be a date (YYYY-MM-DD) or a year")
+    return day, day
+
+
+def _gender(raw):
+    choices = dict(Person._meta.get_field("gender").choices)
+    if raw not in choices:
+        raise ValueError(f"must be one of {', '.join(choices)}")
+    return raw
+
+
+def _text(raw):
+    return raw
+
+
+def _boolean(raw):
+    value = raw.lower()
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+    raise ValueError("must be true or false")
+
+
+# Filterable fields: name -> (ORM path, value parser, operators). Each of
+# them is backed by an index, except the ages (computed per row), the
+# lineage counts (one joined row per person) and exact name matches (the
+# name indexes hold the lower-cased names, for the prefixes).
+FIELDS = {
+    "id": ("id", _integer, (*COMPARISONS, "in")),
+    "first_name": ("first_name", _text, ("exact", "prefix")),
+    "last_name": ("last_name", _text, ("exact", "prefix")),
+    "birth_name": ("birth_name", _text, ("exact", "prefix")),
+    "gender": ("gender", _gender, ("exact", "in")),
+    "date_of_birth": ("date_of_birth", _day_range, (*COMPARISONS, "isnull")),
+    "date_of_death": ("date_of_death", _day_range, (*COMPARISONS, "isnull")),
+    "mother": ("mother_id", _integer, ("exact", "in", "isnull")),
+    "father": ("father_id", _integer, ("exact", "in", "isnull")),
+    "age": ("age", _integer, COMPARISONS),
+    "age_at_death": ("age_at_death", _integer, COMPARISONS),
+    "lifespan_days": ("lifespan", _days, COMPARISONS),
+    "ancestors": ("lineage__ancestors", _integer, COMPARISONS),
+    "descendants": ("lineage__descendants", _integer, COMPARISONS),
+}
+# Shorthands, and the filters the list took before this syntax.
+ALIASES = {
+    "born_after": "date_of_birth__gt",
+    "born_before": "date_of_birth__lt",
+    "died_after": "date_of_death__gt",
+    "died_before": "date_of_death__lt",
+    "min_age": "age__gte",
+    "max_age": "age__lte",
+    "min_age_at_death": "age_at_death__gte",
+    "max_age_at_death": "age_at_death__lte",
+    "min_lifespan_days": "lifespan_days__gte",
+    "max_lifespan_days": "lifespan_days__lte",
+}
+# Orderings, with or without a leading "-": name -> ORM path.
+ORDERING = {
+    "id": "id",
+    "first_name": "first_name",
+    "last_name": "last_name",
+    "date_of_birth": "date_of_birth",
+    "date_of_death": "date_of_death",
+    "age": "age",
+    "age_at_death": "age_at_death",
+    "lifespan": "lifespan",
+    "ancestors": "lineage__ancestors",
+    "descendants": "lineage__descendants",
+}
+
+
+def _has_children(persons, raw):
+    condition = Exists(Person.objects.filter(mother=OuterRef("pk"))) | Exists(
+        Person.objects.filter(father=OuterRef("pk"))
+    )
+    return persons.filter(condition if _boolean(raw) else ~condition)
+
+
+def _search(persons, raw):
+    return persons.search(raw)
+
+
+# Filters that are not a comparison on one field: name -> function.
+SPECIAL = {"has_children": _has_children, "search": _search}
+
+
+def _compare(path, parse, operator, persons, raw):
+    if operator == "isnull":
+        return persons.filter(**{f"{path}__isnull": _boolean(raw)})
+    if operator == "in":
+        return persons.filter(**{f"{path}__in": [parse(v) for v in raw.split(",")]})
+    if operator == "prefix":
+        return persons.prefix(path, raw)
+    value = parse(raw)
+    first, last = value if isinstance(value, tuple) else (value, value)
+    if operator == "exact" and first != last:
+        return persons.filter(**{f"{path}__gte": first, f"{path}__lte": last})
+    if operator == "exact":
+        return persons.filter(**{path: first})
+    bound = first if operator in ("gte", "lt") else last
+    return persons.filter(**{f"{path}__{operator}": bound})
+
+
+def _filter(name):
+    """
+    Returns the function applying the filter `name` to a queryset and a raw
+    value; raises ValueError for unknown filters and operators.
+    """
+    if name in SPECIAL:
+        return SPECIAL[name]
+    field, _, operator = ALIASES.get(name, name).partition("__")
+    if field not in FIELDS:
+        raise ValueError(f"Unknown filter '{name}'")
+    path, parse, operators = FIELDS[field]
+    operator = operator or "exact"
+    if operator not in operators:
+        raise ValueError(f"'{field}' cannot be filtered with '{operator}'")
+    return partial(_compare, path, parse, operator)
+
+
+def _ordering(raw):
+    """Turn "-date_of_birth,last_name" into order_by() expressions."""
+    expressions, names = [], set()
+    for item in raw.split(","):
+        name = item.strip().lstrip("-")
+        if name not in ORDERING:
+            raise ValueError(f"Cannot order by '{name}'")
+        expression = F(ORDERING[name])
+        expressions.append(
+            expression.desc(nulls_last=True)
+            if item.strip().startswith("-")
+            else expression.asc(nulls_last=True)
+        )
+        names.add(name)
+    if "id" not in names:
+        expressions.append("id")
+    return expressions
+
+
+def filter_persons(persons, params):
+    """
+    Apply the filters and the ordering of a list query string.
+
+    Filters are `field=value` or `field__operator=value` with a field of
+    FIELDS and one of its operators (`gt`, `gte`, `lt`, `lte`, `in` with
+    comma-separated values, `prefix` on the name indexes, `isnull`), one of
+    the ALIASES, or `has_children` and `search`. A year compares as all its
+    days: `born_after=1900` means born in 1901 or later. `ordering` takes
+    comma-separated ORDERING names, "-" for descending, unknown values
+    last; the default is by id. Empty values are ignored and parameters in
+    RESERVED left to the caller; anything else invalid raises ValueError
+    naming the parameter.
+
+    `persons` must be annotated by `PersonQuerySet.with_ages` for the age
+    filters and orderings.
+    """
+    for name, raw in params.items():
+        if name in RESERVED:
+            continue
+        apply = _filter(name)
+        if raw == "":
+            continue
+        try:
+            persons = apply(persons, raw)
+        except ValueError as e:
+            raise ValueError(f"'{name}' {e}")
+    ordering = params.get("ordering")
+    return persons.order_by(*_ordering(ordering or "id"))
+
+
+def is_filtered(params):
+    """Whether a list query string uses filters or an ordering."""
+    return any(name not in RESERVED or name == "ordering" for name in params)
@@ -0,0 +1,60 @@
+import csv
+import re
+import unicodedata
+from collections import namedtuple
+from functools import lru_cache
+from pathlib import Path
+
+GAZETTEER_FILE = Path(__file__).resolve().parent / "data" / "gazetteer.tsv"
+
+Entry = namedtuple("Entry", ["key", "name", "country", "latitude", "longitude"])
+
+
+def normalize(text):
+    """
+    Returns a comparison key for a place name: accents removed, case folded
+    and whitespace collapsed, e.g. " Görlitz " -> "gorlitz".
+    """
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+@lru_cache(maxsize=1)
+def _index():
+    """
+    Load the gazetteer file into {normalized name: Entry}, including
+    alternate names. The first entry wins for ambiguous names.
+    """
+    index = {}
+    with open(GAZETTEER_FILE, encoding="utf-8") as f:
+        rows = csv.reader(
+            (line for line in f if not line.startswith("#")), delimiter="\t"
+        )
+        for row in rows:
+            name, country, latitude, longitude = row[:4]
+            entry = Entry(
+                key=normalize(f"{name}, {country}"),
+                name=name,
+                country=country,
+                latitude=float(latitude),
+                longitude=float(longitude),
+            )
+            alternates = row[4].split("|") if len(row) > 4 and row[4] else []
+            for alias in [name, *alternates]:
+                index.setdefault(normalize(alias), entry)
+    return index
+
+
+def lookup(text):
+    """
+    Resolve free text such as "Leipzig, Sachsen" to a gazetteer Entry.
+
+    The whole text is tried first, then its first comma-separated part.
+    Returns None if neither is known.
+    """
+    index = _index()
+    key = normalize(text)
+    if key in index:
+        return index[key]
+    return index.get(normalize(key.split(",")[0]))
@@ -0,0 +1,201 @@
+import os
+import re
+import struct
+import sys
+import tempfile
+from array import array
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.functions import ExtractYear
+
+from . import revisions, routers
+from .compression import compress
+from .models import Person
+
+MAGIC = b"NIMGRAPH"
+FORMAT_VERSION = 1
+# magic, format version, flags, node count, edge count, graph revision
+HEADER = struct.Struct("<8sHHxxxxQQQ")
+
+FLAG_BIRTH_YEARS = 1
+FLAG_WIDE_IDS = 2
+
+# Bits of the per-node `parents` mask.
+HAS_MOTHER = 1
+HAS_FATHER = 2
+
+# Birth year stored for persons without a date of birth.
+NO_YEAR = -32768
+
+
+def build_snapshot(birth_years=False, chunk_size=10000, tree=None, revision=None):
+    """
+    Encode the whole parent graph as a compact binary snapshot.
+
+    Layout (little-endian, every section starts on an 8-byte boundary):
+
+    - header: magic ``NIMGRAPH``, format version, flags, node count `n`,
+      edge count `m` and the graph revision the snapshot was built from
+    - ids: person ids, sorted, ``uint32[n]`` (``int64[n]`` with FLAG_WIDE_IDS)
+    - indptr: ``uint32[n + 1]`` CSR row offsets into `indices`
+    - indices: ``uint32[m]`` node indices of the parents of each row,
+      mother first
+    - parents: ``uint8[n]`` mask of HAS_MOTHER / HAS_FATHER per row
+    - birth_year: ``int16[n]``, NO_YEAR if unknown (only with FLAG_BIRTH_YEARS)
+
+    Rows are streamed from the database in chunks without building model
+    instances, so memory stays proportional to the integer arrays. With
+    `tree`, only the persons of that family tree (and the links between
+    them) are included. `revision` is the graph revision to record, read
+    by the caller before the rows; by default the current one.
+    """
+    if revision is None:
+        revision = revisions.current(revisions.GRAPH, tree=tree)
+    rows = Person.objects.all() if tree is None else Person.objects.for_tree(tree)
+    rows = rows.order_by("pk")
+    if birth_years:
+        rows = rows.annotate(birth_year=ExtractYear("date_of_birth")).values_list(
+            "pk", "mother_id", "father_id", "birth_year"
+        )
+    else:
+        rows = rows.values_list("pk", "mother_id", "father_id")
+
+    ids, mothers, fathers, years = array("q"), array("q"), array("q"), array("h")
+    for row in rows.iterator(chunk_size=chunk_size):
+        ids.append(row[0])
+        mothers.append(row[1] or 0)
+        fathers.append(row[2] or 0)
+        if birth_years:
+            years.append(NO_YEAR if row[3] is None else row[3])
+
+    index = {pk: i for i, pk in enumerate(ids)}
+    indptr, indices, parents = array("I", [0]), array("I"), array("B")
+    for mother_id, father_id in zip(mothers, fathers):
+        mask = 0
+        if mother_id in index:
+            indices.append(index[mother_id])
+            mask |= HAS_MOTHER
+        if father_id in index:
+            indices.append(index[father_id])
+            mask |= HAS_FATHER
+        parents.append(mask)
+        indptr.append(len(indices))
+
+    flags = FLAG_BIRTH_YEARS if birth_years else 0
+    if ids and ids[-1] > 0xFFFFFFFF:
+        flags |= FLAG_WIDE_IDS
+    else:
+        ids = array("I", ids)
+
+    sections = [ids, indptr, indices, parents] + ([years] if birth_years else [])
+    chunks = [
+        HEADER.pack(MAGIC, FORMAT_VERSION, flags, len(ids), len(indices), revision)
+    ]
+    for section in sections:
+        if sys.byteorder == "big":
+            section.byteswap()
+        data = section.tobytes()
+        chunks.append(data + b"\0" * (-len(data) % 8))
+    return b"".join(chunks)
+
+
+def read_snapshot(buffer):
+    """
+    Decode a snapshot without copying it.
+
+    `buffer` may be bytes or an ``mmap``; the returned arrays are memoryviews
+    into it (on little-endian hosts, like the clients we ship to).
+
+    Returns:
+    --------
+    dict
+        revision, flags, ids, indptr, indices, parents and, if present,
+        birth_year.
+    """
+    view = memoryview(buffer)
+    magic, version, flags, n, m, revision = HEADER.unpack_from(view)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("Not a nimloth graph snapshot")
+
+    layout = [
+        ("ids", "q" if flags & FLAG_WIDE_IDS else "I", n),
+        ("indptr", "I", n + 1),
+        ("indices", "I", m),
+        ("parents", "B", n),
+    ]
+    if flags & FLAG_BIRTH_YEARS:
+        layout.append(("birth_year", "h", n))
+
+    snapshot = {"revision": revision, "flags": flags}
+    offset = HEADER.size
+    for name, typecode, count in layout:
+        end = offset + count * array(typecode).itemsize
+        snapshot[name] = view[offset:end].cast(typecode)
+        offset = end + (-end % 8)
+    return snapshot
+
+
+def snapshot_path(birth_years=False, tree=None):
+    """
+    Returns the path of an up-to-date snapshot file, building it if needed.
+
+    Snapshots are cached in GRAPH_SNAPSHOT_DIR under the graph revision and
+    only rebuilt after the revision changes. The revision is read once,
+    before the rows, so a file never claims a newer revision than its data.
+    Files are written to a temporary name and renamed into place, and only
+    the files of older revisions are removed afterwards, so builders racing
+    each other never delete a newer snapshot. Readers may still find a file
+    gone when they open it and should ask for the path again. Each family
+    tree and each tree database gets its own files.
+    """
+    directory = Path(settings.GRAPH_SNAPSHOT_DIR)
+    variant = "graph-years" if birth_years else "graph"
+    if tree is not None:
+        variant = f"{variant}-t{tree}"
+    if routers.current() != DEFAULT_DB_ALIAS:
+        variant = f"{routers.current()}-{variant}"
+    revision = revisions.current(revisions.GRAPH, tree=tree)
+    path = directory / f"{variant}-r{revision}.bin"
+    if path.exists():
+        return path
+
+    directory.mkdir(parents=True, exist_ok=True)
+    data = build_snapshot(birth_years=birth_years, tree=tree, revision=revision)
+    _write(path, data)
+
+    for old in directory.glob(f"{variant}-r*.bin*"):
+        match = re.fullmatch(rf"{re.escape(variant)}-r(\d+)\.bin.*", old.name)
+        if match and int(match.group(1)) < revision:
+            old.unlink(missing_ok=True)
+    return path
+
+
+def _write(path, data):
+    """Write `path` through a temporary file renamed over it."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def compressed_snapshot_path(path, encoding):
+    """
+    Returns a precompressed copy of the snapshot at `path`, building it once.
+
+    The copy lives next to the snapshot (``.br`` / ``.gz``) and is removed
+    together with it, so every revision is compressed at most once per
+    encoding, at the highest level.
+    """
+    suffix = {"br": ".br", "gzip": ".gz"}[encoding]
+    compressed = path.with_name(path.name + suffix)
+    if compressed.exists():
+        return compressed
+
+    _write(compressed, compress(path.read_bytes(), encoding, static=True))
+    return compressed
@@ -0,0 +1,240 @@
+from datetime import date, datetime, time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import F, Max, OuterRef, Q, Subquery
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Person, PersonChange
+
+# Person fields kept in the history.
+FIELDS = (
+    "tree_id",
+    "first_name",
+    "middle_name",
+    "last_name",
+    "birth_name",
+    "artist_name",
+    "date_of_birth",
+    "place_of_birth",
+    "date_of_death",
+    "place_of_death",
+    "cause_of_death",
+    "gender",
+    "mother_id",
+    "father_id",
+    "user_account_id",
+)
+
+
+def _encode(value):
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def _values(source):
+    """The tracked values of a person, or of a dict of loaded values."""
+    if isinstance(source, dict):
+        return {field: _encode(source.get(field)) for field in FIELDS}
+    return {field: _encode(getattr(source, field)) for field in FIELDS}
+
+
+def _last_snapshots(pks):
+    return dict(
+        PersonChange.objects.filter(person_id__in=pks, snapshot__isnull=False)
+        .values("person_id")
+        .annotate(version=Max("version"))
+        .values_list("person_id", "version")
+    )
+
+
+def changes(entries, now=None):
+    """
+    Build the history entries of several saves, without writing them.
+
+    Parameters:
+    -----------
+    entries : iterable
+        (person, version, old) tuples: the saved person, its new version and
+        the values it was loaded with (a dict, or None when unknown or new).
+
+    A save gets a full snapshot when it creates the person, when its old
+    values are unknown, or when the last snapshot is at least
+    HISTORY_SNAPSHOT_INTERVAL versions old. Saves that change no tracked
+    field are not recorded.
+    """
+    entries = list(entries)
+    now = now or timezone.now()
+    interval = settings.HISTORY_SNAPSHOT_INTERVAL
+    last = _last_snapshots([person.pk for person, _, old in entries if old])
+    rows = []
+    for person, version, old in entries:
+        new = _values(person)
+        before = _values(old) if old else {}
+        diff = {f: value for f, value in new.items() if before.get(f) != value}
+        snapshot = not old or version - last.get(person.pk, 0) >= interval
+        if not diff and not snapshot:
+            continue
+        rows.append(
+            PersonChange(
+                person_id=person.pk,
+                version=version,
+                kind=PersonChange.CREATED if version == 1 else PersonChange.UPDATED,
+                changed_on=now,
+                diff=diff,
+                snapshot=new if snapshot else None,
+                mother_id=person.mother_id,
+                father_id=person.father_id,
+            )
+        )
+    return rows
+
+
+def record(person, old):
+    """Record a save of `person`, which was loaded with the values `old`."""
+    PersonChange.objects.bulk_create(changes([(person, person.version, old)]))
+
+
+def record_delete(person):
+    PersonChange.objects.create(
+        person_id=person.pk, version=person.version + 1, kind=PersonChange.DELETED
+    )
+
+
+def parse_as_of(raw):
+    """
+    Parse an `as_of` parameter: an ISO datetime, or a date meaning the end
+    of that day. Returns None for an empty value; raises ValueError.
+    """
+    if not raw:
+        return None
+    moment = parse_datetime(raw)
+    if moment is None:
+        day = parse_date(raw)
+        if day is None:
+            raise ValueError("'as_of' must be a date or datetime (ISO 8601)")
+        moment = datetime.combine(day, time.max)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def states_at(as_of, pks=None):
+    """
+    Returns {person id: tracked values} of the persons (all, or those in
+    `pks`) as they were at `as_of`, skipping the ones not created yet or
+    already deleted then.
+
+    One query reads, for every person, its latest snapshot before `as_of`
+    and the diffs after it: never more than HISTORY_SNAPSHOT_INTERVAL rows
+    per person, however long its history is.
+    """
+    rows = PersonChange.objects.filter(changed_on__lte=as_of)
+    if pks is not None:
+        rows = rows.filter(person_id__in=pks)
+    base = PersonChange.objects.filter(
+        person_id=OuterRef("person_id"), snapshot__isnull=False, changed_on__lte=as_of
+    ).order_by("-version")
+    rows = (
+        rows.annotate(base=Subquery(base.values("version")[:1]))
+        .filter(version__gte=F("base"))
+        .order_by("person_id", "version")
+        .values_list("person_id", "version", "kind", "diff", "snapshot")
+    )
+    states = {}
+    for pk, version, kind, diff, snapshot in rows.iterator():
+        if kind == PersonChange.DELETED:
+            states.pop(pk, None)
+            continue
+        if snapshot is not None:
+            states[pk] = dict(snapshot)
+        elif pk in states:
+            states[pk].update(diff)
+        if pk in states:
+            states[pk]["version"] = version
+    return states
+
+
+def _persons(states):
+    """Build unsaved Person instances from reconstructed states."""
+    persons = []
+    for pk, state in sorted(states.items()):
+        values = {
+            field: Person._meta.get_field(field).to_python(state.get(field))
+            for field in FIELDS
+        }
+        person = Person(pk=pk, version=state["version"], **values)
+        persons.append(person)
+    users = User.objects.in_bulk(
+        {person.user_account_id for person in persons if person.user_account_id}
+    )
+    for person in persons:
+        if person.user_account_id:
+            person.user_account = users.get(person.user_account_id)
+    return persons
+
+
+def persons_at(as_of, pks=None, tree=None):
+    """
+    Returns the persons (all, or those in `pks`) as they were at `as_of`,
+    ordered by id, optionally only the ones in family tree `tree` then (0
+    for the persons without a tree).
+    """
+    states = states_at(as_of, pks)
+    if tree is not None:
+        states = {pk: s for pk, s in states.items() if (s.get("tree_id") or 0) == tree}
+    return _persons(states)
+
+
+def tree_of(pk):
+    """
+    Returns the family tree id person `pk` was last recorded in, 0 for none;
+    also for deleted persons, whose history outlives them.
+    """
+    changes = PersonChange.objects.filter(person_id=pk).order_by("-version")
+    for diff, snapshot in changes.values_list("diff", "snapshot").iterator():
+        for values in (diff, snapshot or {}):
+            if "tree_id" in values:
+                return values["tree_id"] or 0
+    return 0
+
+
+def children_at(as_of, parent_ids):
+    """
+    Returns the persons that were children of any of `parent_ids` at
+    `as_of`: the ones ever linked to those parents before then, as found
+    through the indexed parent columns, whose state at `as_of` still is.
+    """
+    parent_ids = set(parent_ids)
+    candidates = (
+        PersonChange.objects.filter(changed_on__lte=as_of)
+        .filter(Q(mother_id__in=parent_ids) | Q(father_id__in=parent_ids))
+        .values_list("person_id", flat=True)
+        .distinct()
+    )
+    states = {
+        pk: state
+        for pk, state in states_at(as_of, set(candidates)).items()
+        if state.get("mother_id") in parent_ids or state.get("father_id") in parent_ids
+    }
+    return _persons(states)
+
+
+def baseline(chunk_size=1000):
+    """
+    Snapshot every person without history, so that the history (and
+    `as_of` requests) covers the persons created before it was kept.
+    Returns the number of snapshots written.
+    """
+    persons = Person.objects.exclude(
+        pk__in=PersonChange.objects.values("person_id")
+    ).order_by("pk")
+    written = 0
+    batch = []
+    for person in persons.iterator(chunk_size=chunk_size):
+        batch.append((person, person.version, None))
+        if len(batch) >= chunk_size:
+            written += len(PersonChange.objects.bulk_create(changes(batch)))
+            batch = []
+    written += len(PersonChange.objects.bulk_create(changes(batch)))
+    return written
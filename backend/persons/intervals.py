@@ -0,0 +1,153 @@
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from .models import LifeSpanBucket, Person
+
+# Person fields the lifespan index depends on.
+FIELDS = ("date_of_birth", "date_of_death")
+
+
+def _shift(day, years):
+    """`day` moved by `years`, clamped to the dates Python can represent."""
+    try:
+        return day + relativedelta(years=years)
+    except (ValueError, OverflowError):
+        return date.max if years > 0 else date.min
+
+
+def lifespan(date_of_birth, date_of_death):
+    """
+    Returns the (start, end, estimated) interval a person was alive in, or
+    None if neither date is known.
+
+    A missing date is estimated from the other one with
+    PERSON_MAX_LIFESPAN_YEARS, so a person without a recorded death counts
+    as alive until that many years after their birth (at most until
+    date.max, and from date.min the other way).
+    """
+    max_lifespan = settings.PERSON_MAX_LIFESPAN_YEARS
+    if date_of_birth and date_of_death:
+        return date_of_birth, date_of_death, False
+    if date_of_birth:
+        return date_of_birth, _shift(date_of_birth, max_lifespan), True
+    if date_of_death:
+        return _shift(date_of_death, -max_lifespan), date_of_death, True
+    return None
+
+
+def _buckets(person_id, date_of_birth, date_of_death):
+    interval = lifespan(date_of_birth, date_of_death)
+    if interval is None:
+        return []
+    start, end, estimated = interval
+    return [
+        LifeSpanBucket(
+            person_id=person_id,
+            bucket=bucket,
+            start=start,
+            end=end,
+            estimated=estimated,
+        )
+        for bucket in range(start.year // 10, end.year // 10 + 1)
+    ]
+
+
+def update_person(person):
+    """
+    Replace the index rows of one person.
+    """
+    update_persons([person])
+
+
+@transaction.atomic
+def update_persons(persons):
+    """
+    Replace the index rows of several persons with one DELETE and one INSERT.
+    """
+    rows = []
+    for person in persons:
+        dates = [
+            Person._meta.get_field(f).to_python(getattr(person, f)) for f in FIELDS
+        ]
+        rows.extend(_buckets(person.pk, *dates))
+    LifeSpanBucket.objects.filter(person_id__in=[p.pk for p in persons]).delete()
+    LifeSpanBucket.objects.bulk_create(rows)
+
+
+def rebuild(chunk_size=2000, progress=None):
+    """
+    Rebuild the whole index, one chunk of persons per transaction: the rows
+    of each chunk are replaced together, so readers see every person with
+    either its old or its new rows, and the database is not locked for the
+    whole run. Returns the number of rows written.
+
+    `progress`, if given, is called with the fraction of persons processed
+    after every chunk, between the transactions.
+    """
+    persons = Person.objects.order_by("pk").values_list(
+        "pk", "date_of_birth", "date_of_death"
+    )
+    total = Person.objects.count() if progress else 0
+    last_pk, seen, written = 0, 0, 0
+    while True:
+        with transaction.atomic():
+            chunk = list(persons.filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk:
+                return written
+            rows = [row for values in chunk for row in _buckets(*values)]
+            LifeSpanBucket.objects.filter(
+                person_id__gt=last_pk, person_id__lte=chunk[-1][0]
+            ).delete()
+            LifeSpanBucket.objects.bulk_create(rows)
+        written += len(rows)
+        seen += len(chunk)
+        last_pk = chunk[-1][0]
+        if progress:
+            progress(seen / total)
+
+
+def _matching(rows, persons):
+    """
+    The persons of `persons` with an index row among `rows`, annotated with
+    `lifespan_estimated`. The rows are matched in a subquery, so the scope
+    of `persons` (a family tree) and any pagination apply in the same query.
+    """
+    if persons is None:
+        persons = Person.objects.all()
+    estimated = rows.filter(person=OuterRef("pk")).values("estimated")[:1]
+    return persons.filter(pk__in=rows.values("person_id")).annotate(
+        lifespan_estimated=Subquery(estimated)
+    )
+
+
+def alive_on(day, persons=None):
+    """
+    Returns the persons of `persons` (all by default) alive on `day`, as a
+    queryset annotated with `lifespan_estimated`.
+    """
+    rows = LifeSpanBucket.objects.filter(
+        bucket=day.year // 10, start__lte=day, end__gte=day
+    )
+    return _matching(rows, persons)
+
+
+def contemporaries(person, persons=None):
+    """
+    Returns the persons of `persons` (all by default) whose lifespan
+    overlaps the one of `person`, excluding the person, as a queryset
+    annotated with `lifespan_estimated`; None if the lifespan is unknown.
+    """
+    interval = lifespan(person.date_of_birth, person.date_of_death)
+    if interval is None:
+        return None
+    start, end, _ = interval
+    rows = LifeSpanBucket.objects.filter(
+        bucket__in=range(start.year // 10, end.year // 10 + 1),
+        start__lte=end,
+        end__gte=start,
+    )
+    return _matching(rows, persons).exclude(pk=person.pk)
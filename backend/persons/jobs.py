@@ -0,0 +1,382 @@
+import inspect
+import logging
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import (
+    ancestry,
+    consistency,
+    graph,
+    history,
+    intervals,
+    lineage,
+    places,
+    routers,
+    stats,
+)
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Registered handlers by job kind, see `handler`.
+HANDLERS = {}
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler when its job was cancelled."""
+
+
+def handler(kind):
+    """
+    Register a function as the handler for jobs of the given kind.
+
+    The function is called with a `JobContext` and the job payload as
+    keyword arguments; its return value (JSON-serializable) is stored as the
+    job result.
+    """
+
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+
+    return register
+
+
+class JobContext:
+    """
+    Lets a running handler report progress and notice cancellation.
+
+    Both go through the handler's own connection, so handlers must call
+    them outside of a transaction, between the transactions of their
+    chunks: inside one, the progress stays invisible until the commit, and
+    on SQLite the whole database stays locked for the cancel request.
+    """
+
+    def __init__(self, job):
+        self.job = job
+
+    def progress(self, fraction, message=""):
+        """
+        Store the progress (0..1) of the job and raise JobCancelled if the
+        job has been cancelled in the meantime.
+        """
+        Job.objects.filter(pk=self.job.pk).update(
+            progress=max(0.0, min(1.0, fraction)), message=message[:200]
+        )
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        if Job.objects.filter(pk=self.job.pk, cancel_requested=True).exists():
+            raise JobCancelled()
+
+
+def validate(kind, payload):
+    """
+    Check that `payload` holds keyword arguments the handler of `kind`
+    accepts. Raises ValueError for unknown kinds and unknown arguments.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind '{kind}'")
+    if not isinstance(payload, dict):
+        raise ValueError("The payload must be an object")
+    parameters = list(inspect.signature(HANDLERS[kind]).parameters.values())[1:]
+    if any(p.kind == p.VAR_KEYWORD for p in parameters):
+        return
+    unknown = set(payload) - {p.name for p in parameters}
+    if unknown:
+        raise ValueError(
+            f"Unknown payload keys for '{kind}': {', '.join(sorted(unknown))}"
+        )
+
+
+def submit(kind, payload=None, user=None, max_attempts=None):
+    """
+    Queue a job, to run routed to the database person data is currently
+    routed to. Raises ValueError for unknown kinds and for payloads the
+    handler does not accept, so they fail here rather than in the worker.
+    """
+    payload = payload or {}
+    validate(kind, payload)
+    return Job.objects.create(
+        kind=kind,
+        payload=payload,
+        database=routers.current(),
+        created_by=user if user is not None and user.is_authenticated else None,
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+    )
+
+
+def submit_once(kind, payload=None):
+    """
+    Queue a job unless one of the same kind and payload is still queued, for
+    jobs that catch up on everything changed before they start. Returns the
+    queued job.
+    """
+    queued = Job.objects.filter(
+        kind=kind,
+        payload=payload or {},
+        database=routers.current(),
+        status=Job.QUEUED,
+    )
+    return queued.order_by("pk").first() or submit(kind, payload)
+
+
+def cancel(job):
+    """
+    Cancel a job. Queued jobs are cancelled at once; running jobs stop at
+    their next progress report. Returns False if the job already finished.
+    """
+    now = timezone.now()
+    if Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(
+        status=Job.CANCELLED, cancel_requested=True, finished_on=now
+    ):
+        return True
+    return bool(
+        Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(cancel_requested=True)
+    )
+
+
+def claim():
+    """
+    Atomically take the next due job off the queue and mark it running.
+
+    The status check in the UPDATE makes sure that, with several workers,
+    each job is claimed exactly once. Jobs whose worker stopped sending
+    heartbeats are put back first (see `requeue_stale`). Returns the job id
+    or None.
+    """
+    requeue_stale()
+    now = timezone.now()
+    candidates = (
+        Job.objects.filter(status=Job.QUEUED, run_after__lte=now)
+        .order_by("run_after", "pk")
+        .values_list("pk", flat=True)[:10]
+    )
+    for pk in candidates:
+        if Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING,
+            attempts=F("attempts") + 1,
+            started_on=now,
+            heartbeat_on=now,
+        ):
+            return pk
+    return None
+
+
+def heartbeat(pks):
+    """Renew the claim of the running jobs `pks`."""
+    if pks:
+        Job.objects.filter(pk__in=pks, status=Job.RUNNING).update(
+            heartbeat_on=timezone.now()
+        )
+
+
+def _last_seen(jobs):
+    # Jobs claimed before heartbeats were recorded only have started_on.
+    return jobs.alias(last_seen=Coalesce("heartbeat_on", "started_on"))
+
+
+def requeue_stale():
+    """
+    Release the running jobs without a heartbeat for JOB_LEASE_TIMEOUT
+    seconds, whose worker crashed or was killed: they are retried like a
+    failed attempt, or cancelled if that was requested. Returns their ids.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_LEASE_TIMEOUT)
+    stale = list(
+        _last_seen(Job.objects.filter(status=Job.RUNNING))
+        .filter(last_seen__lt=cutoff)
+        .values_list("pk", flat=True)
+    )
+    for pk in stale:
+        release(pk, "The worker running the job stopped responding.", cutoff)
+    return stale
+
+
+def release(pk, error, heartbeat_before=None):
+    """
+    End a running attempt of job `pk` that did not finish on its own: queue
+    the job again with backoff, or mark it failed once out of attempts, or
+    cancelled if that was requested. With `heartbeat_before`, only a job
+    whose last heartbeat is older is released, so a job renewed meanwhile
+    keeps running.
+    """
+    rows = Job.objects.filter(pk=pk, status=Job.RUNNING)
+    if heartbeat_before is not None:
+        rows = rows.filter(
+            pk__in=_last_seen(rows).filter(last_seen__lt=heartbeat_before).values("pk")
+        )
+    job = rows.first()
+    if job is None:
+        return
+    now = timezone.now()
+    if job.cancel_requested:
+        fields = {"status": Job.CANCELLED, "finished_on": now}
+    elif job.attempts < job.max_attempts:
+        delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        fields = {"status": Job.QUEUED, "run_after": now + timedelta(seconds=delay)}
+    else:
+        fields = {"status": Job.FAILED, "finished_on": now}
+    rows.filter(attempts=job.attempts).update(error=error, **fields)
+
+
+def run(pk):
+    """
+    Execute a claimed job, routed to the database it was queued for, and
+    record its outcome.
+
+    Failed attempts are retried with exponential backoff until
+    `max_attempts` is reached.
+    """
+    job = Job.objects.get(pk=pk)
+    try:
+        context = JobContext(job)
+        context.check_cancelled()
+        with routers.use_database(job.database):
+            result = HANDLERS[job.kind](context, **job.payload)
+    except JobCancelled:
+        _finish(job, status=Job.CANCELLED)
+    except Exception:
+        logger.exception("Job %s failed", job)
+        release(pk, traceback.format_exc())
+    else:
+        _finish(job, status=Job.SUCCEEDED, result=result, progress=1.0)
+    return pk
+
+
+def _finish(job, **fields):
+    Job.objects.filter(pk=job.pk).update(finished_on=timezone.now(), **fields)
+
+
+def _init_worker():
+    """Give every pool process its own database connections."""
+    import django
+
+    django.setup()
+    connections.close_all()
+
+
+def _pool(processes):
+    # Connections must not be shared with the forked pool processes.
+    connections.close_all()
+    return ProcessPoolExecutor(max_workers=processes, initializer=_init_worker)
+
+
+def run_worker(processes=2, poll_interval=1.0, once=False):
+    """
+    Feed queued jobs to a pool of `processes` worker processes.
+
+    The claims of the running jobs are renewed every `poll_interval`
+    seconds. When a pool process dies, the pool is replaced and the jobs it
+    was running are released for another attempt. With `once`, return as
+    soon as no job is due and all started jobs have finished; otherwise
+    poll for new jobs forever.
+    """
+    pool = _pool(processes)
+    running = {}
+    try:
+        while True:
+            while len(running) < processes:
+                pk = claim()
+                if pk is None:
+                    break
+                logger.info("Starting job %s", pk)
+                running[pool.submit(run, pk)] = pk
+            if not running:
+                if once:
+                    return
+                time.sleep(poll_interval)
+                continue
+            done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                pk = running.pop(future)
+                try:
+                    future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    release(pk, "The worker process running the job died.")
+                except Exception:
+                    logger.exception("Job %s could not be run", pk)
+                    release(pk, traceback.format_exc())
+            if broken:
+                logger.error("A worker process died, restarting the pool")
+                for pk in running.values():
+                    release(pk, "The worker process running the job died.")
+                running = {}
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = _pool(processes)
+            try:
+                heartbeat(list(running.values()))
+            except DatabaseError:
+                # Retried at the next poll, well within the lease.
+                logger.warning("Could not renew the running jobs", exc_info=True)
+    finally:
+        pool.shutdown()
+
+
+# --- Handlers ---
+
+
+@handler("rebuild_stats")
+def _rebuild_stats(context):
+    return {"rows": stats.rebuild()}
+
+
+@handler("rebuild_life_index")
+def _rebuild_life_index(context, chunk_size=2000):
+    return {"rows": intervals.rebuild(chunk_size=chunk_size, progress=context.progress)}
+
+
+@handler("rebuild_ancestry")
+def _rebuild_ancestry(context, chunk_size=10000):
+    return {"rows": ancestry.rebuild(chunk_size=chunk_size, progress=context.progress)}
+
+
+@handler("rebuild_lineage")
+def _rebuild_lineage(context, chunk_size=10000):
+    return {"rows": lineage.rebuild(chunk_size=chunk_size, progress=context.progress)}
+
+
+@handler(ancestry.REFRESH_JOB)
+def _refresh_ancestry(context, chunk_size=10000):
+    # Queued by changes too large to apply in place (see ancestry.defer).
+    rows = ancestry.rebuild(
+        chunk_size=chunk_size, progress=lambda done: context.progress(done / 2)
+    )
+    lineage.rebuild(
+        chunk_size=chunk_size, progress=lambda done: context.progress(0.5 + done / 2)
+    )
+    return {"rows": rows}
+
+
+@handler("snapshot_history")
+def _snapshot_history(context, chunk_size=1000):
+    return {"rows": history.baseline(chunk_size=chunk_size)}
+
+
+@handler("normalize_places")
+def _normalize_places(context, chunk_size=1000):
+    updated = places.normalize_persons(chunk_size=chunk_size, progress=context.progress)
+    return {"persons": updated}
+
+
+@handler("check_consistency")
+def _check_consistency(context, chunk_size=10000, tree=None):
+    return consistency.report(
+        tree=tree, chunk_size=chunk_size, progress=context.progress
+    )
+
+
+@handler("export_graph")
+def _export_graph(context, birth_years=False):
+    return {"path": str(graph.snapshot_path(birth_years=birth_years))}
@@ -0,0 +1,181 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from . import revisions, routers
+from .traversal import neighborhood
+
+# Distance between the centres of two neighbouring cards, in pixels.
+X_SPACING = 220
+# Distance between two generations, in pixels.
+Y_SPACING = 160
+# Number of crossing-reduction and positioning sweeps.
+SWEEPS = 4
+
+
+def tree_layout(person, up=3, down=2, siblings=True, as_of=None):
+    """
+    Returns the layout of the neighborhood of `person`, using the cache.
+
+    Layouts are cached under the graph revision of the person's family
+    tree, which is bumped whenever a parent link or a birth date in that
+    tree changes, so a cached layout is never stale, edits to other trees
+    keep it, and re-rendering an unchanged tree costs two lookups. Layouts
+    of the tree at a past moment (`as_of`) are not cached.
+    """
+    if as_of is not None:
+        window = neighborhood(person, up=up, down=down, siblings=siblings, as_of=as_of)
+        layout = compute_layout(window)
+        layout.update({"focal": person.pk, "as_of": as_of})
+        return layout
+    # Parents always belong to the same tree, so the window does too.
+    version = revisions.current(revisions.GRAPH, tree=person.tree_id or 0)
+    key = (
+        f"persons:layout:{routers.current()}:{person.pk}:{up}:{down}:"
+        f"{int(siblings)}:{person.tree_id}:{version}"
+    )
+    layout = cache.get(key)
+    if layout is None:
+        window = neighborhood(person, up=up, down=down, siblings=siblings)
+        layout = compute_layout(window)
+        layout.update({"focal": person.pk, "version": version})
+        cache.set(key, layout, getattr(settings, "PERSON_LAYOUT_CACHE_TIMEOUT", 3600))
+    return layout
+
+
+def compute_layout(window):
+    """
+    Lay out a neighborhood as a layered (Sugiyama-style) drawing.
+
+    Parameters:
+    -----------
+    window : dict
+        The result of `traversal.neighborhood`.
+
+    Returns:
+    --------
+    dict
+        A dictionary containing:
+        - nodes: list of {"id", "generation", "x", "y"}
+        - edges: list of {"source", "target", "points"} from parent to child,
+          routed orthogonally through the gap between the two generations
+        - width, height: size of the drawing
+
+    Generations become layers, the order inside each layer is chosen by
+    barycenter sweeps to reduce edge crossings, and x coordinates are pulled
+    towards the connected cards of the neighbouring layers while keeping a
+    minimum distance. Persons reached over several paths appear only once.
+    """
+    persons = {p.pk: p for p in window["persons"]}
+    generation = window["generation"]
+
+    parents = {pk: [] for pk in persons}
+    children = {pk: [] for pk in persons}
+    edges = []
+    for pk, person in persons.items():
+        for parent_id in (person.mother_id, person.father_id):
+            if parent_id in persons and generation[parent_id] < generation[pk]:
+                parents[pk].append(parent_id)
+                children[parent_id].append(pk)
+                edges.append((parent_id, pk))
+
+    layers = {}
+    for pk in persons:
+        layers.setdefault(generation[pk], []).append(pk)
+    levels = sorted(layers)
+    for level in levels:
+        # Siblings from oldest to youngest, unknown birth dates last.
+        layers[level].sort(
+            key=lambda pk: (
+                persons[pk].date_of_birth is None,
+                persons[pk].date_of_birth,
+                pk,
+            )
+        )
+
+    # --- Crossing reduction ---
+    position = _positions(layers)
+    for _ in range(SWEEPS):
+        for level in levels[1:]:
+            _order_by_barycenter(layers[level], parents, position)
+            position.update(_positions({level: layers[level]}))
+        for level in reversed(levels[:-1]):
+            _order_by_barycenter(layers[level], children, position)
+            position.update(_positions({level: layers[level]}))
+
+    # --- Coordinates ---
+    x = {
+        pk: index * X_SPACING
+        for level in levels
+        for index, pk in enumerate(layers[level])
+    }
+    for _ in range(SWEEPS):
+        for level in levels[1:]:
+            _place(layers[level], parents, x)
+        for level in reversed(levels[:-1]):
+            _place(layers[level], children, x)
+
+    left = min(x.values())
+    top = levels[0]
+    coordinates = {
+        pk: (x[pk] - left, (generation[pk] - top) * Y_SPACING) for pk in persons
+    }
+
+    nodes = [
+        {"id": pk, "generation": generation[pk], "x": xy[0], "y": xy[1]}
+        for pk, xy in sorted(
+            coordinates.items(), key=lambda item: (item[1][1], item[1][0])
+        )
+    ]
+    routes = []
+    for parent_id, child_id in edges:
+        (px, py), (cx, cy) = coordinates[parent_id], coordinates[child_id]
+        middle = cy - Y_SPACING / 2
+        routes.append(
+            {
+                "source": parent_id,
+                "target": child_id,
+                "points": [[px, py], [px, middle], [cx, middle], [cx, cy]],
+            }
+        )
+
+    return {
+        "nodes": nodes,
+        "edges": routes,
+        "width": max(xy[0] for xy in coordinates.values()),
+        "height": (levels[-1] - top) * Y_SPACING,
+    }
+
+
+def _positions(layers):
+    return {pk: index for layer in layers.values() for index, pk in enumerate(layer)}
+
+
+def _order_by_barycenter(layer, neighbours, position):
+    """
+    Sort a layer by the mean position of each node's neighbours in the
+    adjacent layer. Nodes without neighbours keep their current position.
+    """
+    keys = {}
+    for index, pk in enumerate(layer):
+        linked = [position[n] for n in neighbours[pk]]
+        keys[pk] = sum(linked) / len(linked) if linked else index
+    layer.sort(key=lambda pk: keys[pk])
+
+
+def _place(layer, neighbours, x):
+    """
+    Move the nodes of a layer towards their neighbours while keeping them in
+    order and at least `X_SPACING` apart.
+    """
+    wanted = []
+    for pk in layer:
+        linked = [x[n] for n in neighbours[pk]]
+        wanted.append(sum(linked) / len(linked) if linked else x[pk])
+
+    placed = []
+    for target in wanted:
+        placed.append(target if not placed else max(target, placed[-1] + X_SPACING))
+    # Spread the displacement evenly instead of pushing everything right.
+    shift = (sum(wanted) - sum(placed)) / len(placed)
+    for pk, value in zip(layer, placed):
+        x[pk] = value + shift
@@ -0,0 +1,268 @@
+from array import array
+from bisect import bisect_left
+from collections import deque
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import Person, PersonAncestry, PersonLineage
+from .parent_index import NO_PARENT, index_parents
+
+# Values kept per person, all recomputed together.
+FIELDS = ("ancestors", "descendants", "ancestor_generations", "descendant_generations")
+# Number of ids per IN (...) list.
+CHUNK_SIZE = 1000
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        end = start + size
+        yield items[start:end]
+
+
+def _closure(pks, column, other):
+    """Returns `pks` with every id linked to them in the ancestry index."""
+    linked = set(pks)
+    for chunk in _chunks(linked):
+        linked.update(
+            PersonAncestry.objects.filter(**{f"{column}__in": chunk}).values_list(
+                other, flat=True
+            )
+        )
+    return linked
+
+
+def _below(pks):
+    """The persons `pks` and all their descendants."""
+    return _closure({pk for pk in pks if pk}, "ancestor_id", "descendant_id")
+
+
+def _above(pks):
+    """The persons `pks` and all their ancestors."""
+    return _closure({pk for pk in pks if pk}, "descendant_id", "ancestor_id")
+
+
+def _counts(pks, column):
+    """Returns {person id: number of ancestry rows with it in `column`}."""
+    counts = {}
+    for chunk in _chunks(pks):
+        counts.update(
+            PersonAncestry.objects.filter(**{f"{column}__in": chunk})
+            .values_list(column)
+            .annotate(count=Count("pk"))
+        )
+    return counts
+
+
+def _generations(nodes, links, outside):
+    """
+    Returns {node: length of the longest chain of links from it}.
+
+    `links` maps each node to the ids it links to (its parents, or its
+    children); chains leaving `nodes` continue with the stored value of the
+    id they reach, from `outside`. Nodes are visited once all their links
+    inside `nodes` are known; nodes on cycles are left out.
+    """
+    pending = {pk: 0 for pk in nodes}
+    waiting = {}
+    for pk in nodes:
+        for linked in links.get(pk, ()):
+            if linked in nodes:
+                pending[pk] += 1
+                waiting.setdefault(linked, []).append(pk)
+    generations = {}
+    queue = deque(pk for pk, count in pending.items() if not count)
+    while queue:
+        pk = queue.popleft()
+        generations[pk] = max(
+            (
+                (generations[linked] if linked in nodes else outside.get(linked, 0)) + 1
+                for linked in links.get(pk, ())
+            ),
+            default=0,
+        )
+        for other in waiting.get(pk, ()):
+            pending[other] -= 1
+            if not pending[other]:
+                queue.append(other)
+    return generations
+
+
+def _refresh(below, above):
+    """
+    Recompute the ancestor values of the persons in `below`, which must
+    hold all descendants of its members, and the descendant values of the
+    persons in `above`, which must hold all ancestors of its members.
+    Ids of persons that no longer exist are skipped.
+    """
+    parents, stored = {}, {}
+    for chunk in _chunks(below | above):
+        for pk, mother_id, father_id in Person.objects.filter(pk__in=chunk).values_list(
+            "pk", "mother_id", "father_id"
+        ):
+            parents[pk] = [p for p in (mother_id, father_id) if p]
+        stored.update(
+            (row.person_id, row) for row in PersonLineage.objects.filter(pk__in=chunk)
+        )
+    below = below & parents.keys()
+    above = above & parents.keys()
+
+    children = {}
+    for chunk in _chunks(above):
+        for pk, mother_id, father_id in Person.objects.filter(
+            Q(mother_id__in=chunk) | Q(father_id__in=chunk)
+        ).values_list("pk", "mother_id", "father_id"):
+            for parent in (mother_id, father_id):
+                if parent in above:
+                    children.setdefault(parent, []).append(pk)
+    outside = {pk for linked in parents.values() for pk in linked} - below
+    outside |= {pk for linked in children.values() for pk in linked} - above
+    for chunk in _chunks(outside - stored.keys()):
+        stored.update(
+            (row.person_id, row) for row in PersonLineage.objects.filter(pk__in=chunk)
+        )
+
+    rows = {pk: stored.get(pk) or PersonLineage(person_id=pk) for pk in below | above}
+    ancestors = _counts(below, "descendant_id")
+    depth = _generations(
+        below,
+        {pk: parents[pk] for pk in below},
+        {pk: row.ancestor_generations for pk, row in stored.items()},
+    )
+    for pk in below:
+        rows[pk].ancestors = ancestors.get(pk, 0)
+        rows[pk].ancestor_generations = depth.get(pk, 0)
+    descendants = _counts(above, "ancestor_id")
+    height = _generations(
+        above, children, {pk: row.descendant_generations for pk, row in stored.items()}
+    )
+    for pk in above:
+        rows[pk].descendants = descendants.get(pk, 0)
+        rows[pk].descendant_generations = height.get(pk, 0)
+    PersonLineage.objects.bulk_create(
+        rows.values(),
+        batch_size=CHUNK_SIZE,
+        update_conflicts=True,
+        unique_fields=["person"],
+        update_fields=FIELDS,
+    )
+
+
+@transaction.atomic
+def update_links(pks, parents):
+    """
+    Bring the values up to date after the parents of the persons `pks`
+    changed; `parents` holds both their old and their new parent ids.
+    Call it once the ancestry index is up to date.
+
+    Only the affected paths are visited: the persons and their descendants
+    gain or lose ancestors, the old and new parents and their ancestors
+    gain or lose descendants.
+    """
+    _refresh(_below(pks), _above(parents))
+
+
+def update_person(person, old_parents):
+    """Update the values after the parents of `person` were `old_parents`."""
+    update_links([person.pk], [*old_parents, person.mother_id, person.father_id])
+
+
+def affected(person):
+    """
+    Returns the persons whose values change when `person` is deleted, to
+    pass to `refresh` afterwards; read before, while the ancestry index
+    still links them.
+    """
+    return _below([person.pk]) - {person.pk}, _above([person.pk]) - {person.pk}
+
+
+@transaction.atomic
+def refresh(below, above):
+    """Recompute the values of the persons returned by `affected`."""
+    _refresh(below, above)
+
+
+def rebuild(chunk_size=10000, progress=None):
+    """
+    Recompute the values of every person.
+
+    The parent links are loaded into integer arrays and the persons peeled
+    generation by generation from the bottom up: first the ones without
+    children, then every parent whose children are all done, raising the
+    descendant generations of each parent on the way. Walking that order
+    backwards visits parents before children for the ancestor generations.
+    The counts are two GROUP BY queries on the ancestry index, so rebuild
+    that first. The rows are then upserted `chunk_size` at a time, one
+    transaction per chunk, so the database is not locked for the whole run.
+    Returns the number of rows written.
+    """
+    ids, mothers, fathers = array("q"), array("q"), array("q")
+    rows = Person.objects.order_by("pk").values_list("pk", "mother_id", "father_id")
+    for pk, mother_id, father_id in rows.iterator(chunk_size=chunk_size):
+        ids.append(pk)
+        mothers.append(mother_id or 0)
+        fathers.append(father_id or 0)
+    index_parents(ids, mothers)
+    index_parents(ids, fathers)
+
+    n = len(ids)
+    children = array("l", [0]) * n
+    for parents in (mothers, fathers):
+        for parent in parents:
+            if parent != NO_PARENT:
+                children[parent] += 1
+    height, depth = array("l", [0]) * n, array("l", [0]) * n
+    order = array("l")
+    queue = deque(i for i in range(n) if not children[i])
+    while queue:
+        i = queue.popleft()
+        order.append(i)
+        for parent in (mothers[i], fathers[i]):
+            if parent != NO_PARENT:
+                height[parent] = max(height[parent], height[i] + 1)
+                children[parent] -= 1
+                if not children[parent]:
+                    queue.append(parent)
+    for i in reversed(order):
+        for parent in (mothers[i], fathers[i]):
+            if parent != NO_PARENT:
+                depth[i] = max(depth[i], depth[parent] + 1)
+    if progress:
+        progress(0.5)
+
+    counts = {}
+    for column, values in (
+        ("descendant_id", "ancestors"),
+        ("ancestor_id", "descendants"),
+    ):
+        counts[values] = array("l", [0]) * n
+        grouped = PersonAncestry.objects.values_list(column).annotate(count=Count("pk"))
+        for pk, count in grouped.iterator(chunk_size=chunk_size):
+            i = bisect_left(ids, pk)
+            if i < n and ids[i] == pk:
+                counts[values][i] = count
+
+    # Rows of deleted persons go with them, so overwriting the rows of the
+    # persons read above leaves nothing stale behind.
+    for start in range(0, n, chunk_size):
+        with transaction.atomic():
+            PersonLineage.objects.bulk_create(
+                [
+                    PersonLineage(
+                        person_id=ids[i],
+                        ancestors=counts["ancestors"][i],
+                        descendants=counts["descendants"][i],
+                        ancestor_generations=depth[i],
+                        descendant_generations=height[i],
+                    )
+                    for i in range(start, min(start + chunk_size, n))
+                ],
+                batch_size=CHUNK_SIZE,
+                update_conflicts=True,
+                unique_fields=["person"],
+                update_fields=FIELDS,
+            )
+        if progress:
+            progress(0.5 + 0.5 * min(start + chunk_size, n) / n)
+    return n
@@ -0,0 +1,90 @@
+import time
+
+from django.conf import settings as django_settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from persons.models import Person
+from persons.sessions import sessions
+
+PATHS = ("/api/auth/check/", "/api/person/me/")
+
+CONFIGURATIONS = {
+    "database": {
+        "SESSION_ENGINE": "django.contrib.sessions.backends.db",
+        "AUTHENTICATION_BACKENDS": ["django.contrib.auth.backends.ModelBackend"],
+        # Without a cache the linked person is read from the database too.
+        "ACCOUNT_CACHE": None,
+    },
+    "cached": {
+        "SESSION_ENGINE": "persons.sessions",
+        "AUTHENTICATION_BACKENDS": ["persons.accounts.CachedModelBackend"],
+        # A private cache of this process, so the shared one is left alone.
+        "CACHES": {
+            "default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+            "benchmark-accounts": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "benchmark-auth",
+            },
+        },
+        "ACCOUNT_CACHE": "benchmark-accounts",
+    },
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the auth-check round trip with plain database sessions and "
+        "with the cached session engine and user lookup."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=200,
+            help="Number of warm requests per path and configuration.",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = User.objects.create_user(username="bench-auth", password="bench")
+            Person.objects.create(first_name="Bench", user_account=user)
+            results = [
+                (name, path, *self.measure(settings, path, options["requests"]))
+                for name, settings in CONFIGURATIONS.items()
+                for path in PATHS
+            ]
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"{'configuration':<15}{'path':<22}{'queries':>9}{'ms':>10}")
+        for name, path, queries, ms in results:
+            self.stdout.write(f"{name:<15}{path:<22}{queries:>9}{ms:>10.3f}")
+
+    def measure(self, settings, path, requests):
+        """
+        Returns (SQL queries per warm request, mean wall-clock ms per warm
+        request) for `path` as a logged-in user.
+        """
+        with override_settings(**settings):
+            if django_settings.ACCOUNT_CACHE:
+                caches[django_settings.ACCOUNT_CACHE].clear()
+            sessions.clear()
+            client = Client(HTTP_HOST="localhost")
+            client.login(username="bench-auth", password="bench")
+            client.get(path)
+
+            # Django resets connection.queries per request, so count with a
+            # wrapper instead.
+            queries = []
+            with connection.execute_wrapper(
+                lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)
+            ):
+                client.get(path)
+            start = time.perf_counter()
+            for _ in range(requests):
+                client.get(path)
+            elapsed = (time.perf_counter() - start) * 1000 / max(requests, 1)
+        return len(queries), elapsed
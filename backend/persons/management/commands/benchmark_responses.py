@@ -0,0 +1,85 @@
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client, override_settings
+from persons import revisions
+from persons.models import Person
+
+MEDIA_TYPES = ("application/json", "application/msgpack")
+ENCODINGS = ("identity", "gzip", "br")
+# A private in-process cache for the run.
+BENCHMARK_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "benchmark-responses",
+    }
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure bytes on the wire and CPU time per request for every "
+        "combination of media type and content encoding."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--persons",
+            type=int,
+            default=0,
+            help="Add this many synthetic persons for the run (rolled back afterwards).",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=20,
+            help="Number of warm requests per combination.",
+        )
+        parser.add_argument("--path", default="/api/person/", help="URL to request.")
+
+    def handle(self, *args, **options):
+        # The run clears the cache before every combination; give it a cache
+        # of its own instead of the shared one (sessions, accounts, layouts).
+        with override_settings(CACHES=BENCHMARK_CACHES), transaction.atomic():
+            Person.objects.bulk_create(
+                Person(first_name=f"Bench{i}", last_name="Person", gender="U")
+                for i in range(options["persons"])
+            )
+            # bulk_create sends no signals; new rows must not hit old caches.
+            revisions.bump(revisions.PERSONS)
+            results = [
+                self.measure(options["path"], media_type, encoding, options["requests"])
+                for media_type in MEDIA_TYPES
+                for encoding in ENCODINGS
+            ]
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            f"{'media type':<22}{'encoding':<10}{'bytes':>12}"
+            f"{'cold CPU ms':>14}{'warm CPU ms':>14}"
+        )
+        for media_type, encoding, size, cold, warm in results:
+            self.stdout.write(
+                f"{media_type:<22}{encoding:<10}{size:>12}{cold:>14.2f}{warm:>14.2f}"
+            )
+
+    def measure(self, path, media_type, encoding, requests):
+        """
+        Returns (media type, encoding, body size, CPU ms of the first request
+        with a cold compression cache, mean CPU ms of the following requests).
+        """
+        client = Client(HTTP_HOST="localhost")
+        headers = {"HTTP_ACCEPT": media_type, "HTTP_ACCEPT_ENCODING": encoding}
+        cache.clear()
+
+        start = time.process_time()
+        response = client.get(path, **headers)
+        cold = (time.process_time() - start) * 1000
+
+        start = time.process_time()
+        for _ in range(requests):
+            client.get(path, **headers)
+        warm = (time.process_time() - start) * 1000 / max(requests, 1)
+        return media_type, encoding, len(response.content), cold, warm
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from persons import consistency
+
+
+class Command(BaseCommand):
+    help = "Check the person graph for impossible dates, genders and cycles."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=10000,
+            help="Number of persons fetched per database round trip.",
+        )
+
+    def handle(self, *args, **options):
+        issues = consistency.check(chunk_size=options["chunk_size"])
+        for issue in issues:
+            related = f" (parent {issue['related']})" if issue["related"] else ""
+            self.stdout.write(f"{issue['person']}: {issue['kind']}{related}")
+        if issues:
+            raise CommandError(f"Found {len(issues)} inconsistencies.")
+        self.stdout.write(self.style.SUCCESS("The person graph is consistent."))
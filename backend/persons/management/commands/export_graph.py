@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from persons.graph import build_snapshot, snapshot_path
+
+
+class Command(BaseCommand):
+    help = "Export the parent graph as a compact binary CSR snapshot."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--birth-years",
+            action="store_true",
+            help="Include the birth year of every person.",
+        )
+        parser.add_argument(
+            "--output",
+            help="Write the snapshot to this file instead of the snapshot cache.",
+        )
+
+    def handle(self, *args, **options):
+        if options["output"]:
+            data = build_snapshot(birth_years=options["birth_years"])
+            with open(options["output"], "wb") as f:
+                f.write(data)
+            path, size = options["output"], len(data)
+        else:
+            path = snapshot_path(birth_years=options["birth_years"])
+            size = path.stat().st_size
+        self.stdout.write(self.style.SUCCESS(f"Wrote {size} bytes to {path}"))
@@ -0,0 +1,422 @@
+import json
+import logging
+import random
+import secrets
+import socket
+import threading
+import time
+from collections import Counter
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import (
+    ThreadedWSGIServer,
+    WSGIRequestHandler,
+    get_internal_wsgi_application,
+)
+from persons import routers, upsert
+from persons.models import FamilyTree, Person, PersonChange
+
+# Requests a virtual user can make, with their default weight in the mix.
+DEFAULT_MIX = {
+    "login": 2,
+    "check": 20,
+    "list": 5,
+    "detail": 35,
+    "neighborhood": 15,
+    "create": 8,
+    "edit": 15,
+}
+# Prefix of the accounts, family trees and external sources of a run.
+PREFIX = "load-test"
+PLACES = ("Leipzig", "Berlin", "Paris", "Wien", "Praha", "Amsterdam")
+
+
+def _parse_mix(raw):
+    """Parse "check=20,detail=35,..." into {endpoint: weight}."""
+    mix = {}
+    for part in raw.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in DEFAULT_MIX or not weight.strip().isdigit():
+            raise CommandError(
+                f"Invalid mix entry '{part}'; use name=weight with names "
+                f"{', '.join(DEFAULT_MIX)}."
+            )
+        mix[name] = int(weight)
+    if not any(mix.values()):
+        raise CommandError("The mix needs at least one positive weight.")
+    return mix
+
+
+def _percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_wsgi():
+    """Serve nimloth.wsgi from a thread; returns (base url, stop)."""
+    server = ThreadedWSGIServer(("127.0.0.1", 0), _QuietHandler)
+    server.set_app(get_internal_wsgi_application())
+    # Failed requests are counted in the report; their tracebacks would
+    # bury it. (Loading the application configures logging again.)
+    logging.getLogger("django.request").setLevel(logging.CRITICAL)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+
+def _start_asgi():
+    """Serve nimloth.asgi with uvicorn from a thread; returns (base url, stop)."""
+    try:
+        import uvicorn
+    except ImportError:
+        raise CommandError(
+            "Serving nimloth.asgi needs uvicorn; install it, or start the "
+            "server yourself and pass --url."
+        )
+    port = _free_port()
+    server = uvicorn.Server(
+        uvicorn.Config(
+            "nimloth.asgi:application", host="127.0.0.1", port=port, log_level="error"
+        )
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+
+    return f"http://127.0.0.1:{port}", stop
+
+
+class _VirtualUser:
+    """
+    One simulated user: its own cookie jar (session and CSRF cookies) and
+    its own latency samples, so threads share nothing while running.
+    """
+
+    def __init__(self, base_url, username, password, tree, person_ids, seed):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.tree = tree
+        self.person_ids = person_ids
+        self.random = random.Random(seed)
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies))
+        self.latencies = {name: [] for name in DEFAULT_MIX}
+        self.statuses = {name: Counter() for name in DEFAULT_MIX}
+
+    def _csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == "csrftoken":
+                return cookie.value
+        return ""
+
+    def call(self, name, method, path, body=None):
+        headers = {"Accept": "application/json", "Accept-Encoding": "gzip"}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        if method != "GET":
+            headers["X-CSRFToken"] = self._csrf_token()
+        request = Request(self.base_url + path, data, headers, method=method)
+        start = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                payload = response.read()
+                status = response.status
+        except HTTPError as e:
+            payload = e.read()
+            status = e.code
+        except (URLError, OSError):
+            payload, status = b"", 0
+        self.latencies[name].append((time.perf_counter() - start) * 1000)
+        self.statuses[name][status] += 1
+        return status, payload
+
+    def _person(self):
+        return self.random.choice(self.person_ids)
+
+    def login(self):
+        self.call(
+            "login",
+            "POST",
+            "/api/auth/login/",
+            {"username": self.username, "password": self.password},
+        )
+
+    def check(self):
+        self.call("check", "GET", "/api/auth/check/")
+
+    def list(self):
+        self.call("list", "GET", f"/api/person/?tree={self.tree}")
+
+    def detail(self):
+        self.call("detail", "GET", f"/api/person/{self._person()}/?tree={self.tree}")
+
+    def neighborhood(self):
+        self.call(
+            "neighborhood",
+            "GET",
+            f"/api/person/{self._person()}/neighborhood/?tree={self.tree}",
+        )
+
+    def create(self):
+        status, payload = self.call(
+            "create",
+            "POST",
+            f"/api/person/?tree={self.tree}",
+            {
+                "first_name": "Load",
+                "last_name": self.username,
+                "mother": self._person(),
+                "place_of_birth": self.random.choice(PLACES),
+            },
+        )
+        if status == 201:
+            self.person_ids.append(json.loads(payload)["id"])
+
+    def edit(self):
+        self.call(
+            "edit",
+            "PATCH",
+            f"/api/person/{self._person()}/?tree={self.tree}",
+            {"place_of_death": self.random.choice(PLACES)},
+        )
+
+    def run(self, mix, deadline, think_time):
+        self.login()
+        names, weights = list(mix), list(mix.values())
+        while time.monotonic() < deadline:
+            getattr(self, self.random.choices(names, weights)[0])()
+            if think_time:
+                time.sleep(think_time)
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a mix of API requests (login, auth check, list, detail, "
+        "neighborhood, create, edit) from concurrent virtual users and report "
+        "throughput and p50/p95/p99 latency per endpoint. Without --url the "
+        "project is served in process; for capacity numbers run the server "
+        "like in production (gunicorn, uvicorn, ...) on the same database and "
+        "pass --url."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url", help="Base URL of a running server, e.g. http://127.0.0.1:8000."
+        )
+        parser.add_argument(
+            "--asgi",
+            action="store_true",
+            help="Serve nimloth.asgi with uvicorn instead of nimloth.wsgi "
+            "(without --url).",
+        )
+        parser.add_argument(
+            "--users", type=int, default=10, help="Number of concurrent virtual users."
+        )
+        parser.add_argument(
+            "--duration", type=float, default=30, help="Seconds to run for."
+        )
+        parser.add_argument(
+            "--think-time",
+            type=float,
+            default=0,
+            help="Seconds each user waits between two requests.",
+        )
+        parser.add_argument(
+            "--mix",
+            default=",".join(f"{name}={w}" for name, w in DEFAULT_MIX.items()),
+            help="Relative weights of the requests, as name=weight pairs.",
+        )
+        parser.add_argument(
+            "--persons",
+            type=int,
+            default=500,
+            help="Size of the family tree of each virtual user.",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+        parser.add_argument("--json", help="Also write the results to this file.")
+        parser.add_argument(
+            "--cleanup",
+            action="store_true",
+            help="Delete the load-test trees afterwards.",
+        )
+        parser.add_argument(
+            "--allow-production",
+            action="store_true",
+            help="Run although DEBUG is off.",
+        )
+
+    def handle(self, *args, **options):
+        if options["users"] < 1 or options["duration"] <= 0:
+            raise CommandError("--users and --duration must be positive.")
+        if not settings.DEBUG and not options["allow_production"]:
+            raise CommandError(
+                "DEBUG is off: this creates accounts and writes test data; "
+                "pass --allow-production to run anyway."
+            )
+        mix = _parse_mix(options["mix"])
+        # Names and a password of this run only; its accounts are deleted
+        # afterwards, and nothing created before is touched.
+        run = secrets.token_hex(4)
+        password = secrets.token_urlsafe(32)
+        names = [f"{PREFIX}-{run}-{i}" for i in range(options["users"])]
+        taken = User.objects.filter(username__in=names).values_list(
+            "username", flat=True
+        )
+        if taken:
+            raise CommandError(f"Accounts already exist: {', '.join(taken)}.")
+        accounts, trees = [], []
+        try:
+            workload = self.setup(names, password, options["persons"], accounts, trees)
+            self.run(workload, password, mix, options)
+        finally:
+            if options["cleanup"]:
+                self.cleanup(trees)
+            User.objects.filter(pk__in=accounts).delete()
+            self.stdout.write(f"Deleted {len(accounts)} load-test accounts.")
+
+    def run(self, workload, password, mix, options):
+        stop = None
+        base_url = options["url"]
+        if base_url is None:
+            base_url, stop = _start_asgi() if options["asgi"] else _start_wsgi()
+        base_url = base_url.rstrip("/")
+
+        users = [
+            _VirtualUser(
+                base_url, name, password, tree, person_ids, options["seed"] + i
+            )
+            for i, (name, tree, person_ids) in enumerate(workload)
+        ]
+        self.stdout.write(
+            f"Running {len(users)} users against {base_url} for "
+            f"{options['duration']:g}s..."
+        )
+        start = time.monotonic()
+        deadline = start + options["duration"]
+        threads = [
+            threading.Thread(
+                target=user.run, args=(mix, deadline, options["think_time"])
+            )
+            for user in users
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+        if stop is not None:
+            stop()
+
+        results = self.report(users, elapsed)
+        if options["json"]:
+            with open(options["json"], "w") as f:
+                json.dump(
+                    {"users": len(users), "seconds": elapsed, "endpoints": results},
+                    f,
+                    indent=2,
+                )
+
+    def setup(self, names, password, persons, accounts, trees):
+        """
+        Create an account per virtual user, owning a new family tree with
+        an upsert of `persons` persons over a few generations. The ids of
+        the accounts and trees are appended to `accounts` and `trees` as
+        they are created. Returns (username, tree id, person ids) per user.
+        """
+        records = [
+            {
+                "external_id": str(i),
+                "first_name": f"Person {i}",
+                "last_name": "Load",
+                "gender": "F" if i % 2 == 0 else "M",
+                "place_of_birth": PLACES[i % len(PLACES)],
+                "mother": str(i // 2) if i > 1 and (i // 2) % 2 == 0 else None,
+            }
+            for i in range(1, persons + 1)
+        ]
+        workload = []
+        for name in names:
+            user = User.objects.create_user(username=name, password=password)
+            accounts.append(user.pk)
+            tree = FamilyTree.objects.create(name=name, owner=user)
+            trees.append(tree.pk)
+            with routers.use_tree(tree.pk):
+                ids = upsert.upsert(name, records, tree=tree.pk)["ids"]
+            workload.append((name, tree.pk, list(ids.values())))
+        return workload
+
+    def report(self, users, elapsed):
+        results = {}
+        self.stdout.write(
+            f"{'endpoint':<14}{'requests':>9}{'errors':>8}{'conflicts':>10}"
+            f"{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+        )
+        total = 0
+        for name in DEFAULT_MIX:
+            latencies = sorted(x for user in users for x in user.latencies[name])
+            if not latencies:
+                continue
+            statuses = Counter()
+            for user in users:
+                statuses.update(user.statuses[name])
+            errors = sum(n for code, n in statuses.items() if not 200 <= code < 400)
+            conflicts = statuses[409]
+            row = {
+                "requests": len(latencies),
+                "errors": errors - conflicts,
+                "conflicts": conflicts,
+                "per_second": len(latencies) / elapsed,
+                "p50": _percentile(latencies, 0.50),
+                "p95": _percentile(latencies, 0.95),
+                "p99": _percentile(latencies, 0.99),
+                "statuses": {str(code): n for code, n in sorted(statuses.items())},
+            }
+            results[name] = row
+            total += len(latencies)
+            self.stdout.write(
+                f"{name:<14}{row['requests']:>9}{row['errors']:>8}"
+                f"{row['conflicts']:>10}{row['per_second']:>9.1f}{row['p50']:>9.1f}"
+                f"{row['p95']:>9.1f}{row['p99']:>9.1f}"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)."
+            )
+        )
+        return results
+
+    def cleanup(self, trees):
+        deleted = 0
+        for tree in trees:
+            with routers.use_tree(tree):
+                pks = list(Person.objects.for_tree(tree).values_list("pk", flat=True))
+                Person.objects.filter(pk__in=pks).delete()
+                PersonChange.objects.filter(person_id__in=pks).delete()
+            FamilyTree.objects.filter(pk=tree).delete()
+            deleted += len(pks)
+        self.stdout.write(f"Deleted {deleted} load-test persons.")
@@ -0,0 +1,213 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Q
+from persons import ancestry, intervals, lineage, revisions, routers, stats, upsert
+from persons.models import (
+    ExternalId,
+    FamilyTree,
+    Person,
+    PersonAncestry,
+    PersonChange,
+    Place,
+)
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        end = start + size
+        yield items[start:end]
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the persons of a family tree to another database, by default "
+        "the one FamilyTreeRouter assigns to the tree. The tree is read-only "
+        "for the API while it moves; run the command again to resume an "
+        "interrupted move."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("tree", type=int, help="Id of the family tree.")
+        parser.add_argument(
+            "--from",
+            dest="source",
+            default=DEFAULT_DB_ALIAS,
+            help="Database alias the tree is in now.",
+        )
+        parser.add_argument("--to", dest="target", help="Database alias to move to.")
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of persons copied and deleted per batch.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            tree = FamilyTree.objects.get(pk=options["tree"])
+        except FamilyTree.DoesNotExist:
+            raise CommandError(f"Family tree {options['tree']} does not exist.")
+        source = options["source"]
+        target = options["target"] or routers.database_for(tree.pk)
+        if target == source:
+            raise CommandError(f"Tree {tree.pk} already lives in '{source}'.")
+        for alias in (source, target):
+            if alias not in connections:
+                raise CommandError(f"Unknown database '{alias}'.")
+
+        if tree.moving_to and tree.moving_to != target:
+            raise CommandError(
+                f"Tree {tree.pk} is being moved to '{tree.moving_to}'; "
+                "finish that move first."
+            )
+        resuming = bool(tree.moving_to)
+        # From here on the API refuses writes to the tree, so the persons
+        # read below are all there is to move.
+        FamilyTree.objects.filter(pk=tree.pk).update(moving_to=target)
+        try:
+            pks, copied = self.check(tree, source, target, resuming)
+        except CommandError:
+            if not resuming:
+                FamilyTree.objects.filter(pk=tree.pk).update(moving_to="")
+            raise
+
+        if copied:
+            self.stdout.write(f"Resuming: {len(pks)} persons already in '{target}'.")
+        else:
+            self.copy(tree, pks, source, target, options["chunk_size"])
+            self.stdout.write(f"Copied {len(pks)} persons to '{target}'.")
+        self.delete(tree, pks, source, options["chunk_size"])
+        FamilyTree.objects.filter(pk=tree.pk).update(moving_to="")
+        self.stdout.write(
+            self.style.SUCCESS(f"Moved tree {tree.pk} from '{source}' to '{target}'.")
+        )
+
+    def check(self, tree, source, target, resuming):
+        """
+        Returns the ids of the persons left to move, and whether they were
+        already copied by an interrupted run of the same move, which then
+        resumes with the deletion. Raises CommandError for persons linked
+        across the tree boundary, which the target cannot hold, and for ids
+        already used in the target otherwise.
+        """
+        with routers.use_database(source):
+            pks = list(
+                Person.objects.for_tree(tree)
+                .order_by("pk")
+                .values_list("pk", flat=True)
+            )
+            crossing = self.crossing_links(tree)
+        if crossing:
+            listed = ", ".join(str(pk) for pk in crossing[:10])
+            raise CommandError(
+                f"{len(crossing)} persons are linked to parents or children "
+                f"outside tree {tree.pk} ({listed}); unlink them first."
+            )
+        # Ids are kept, so they must be free in the target database.
+        with routers.use_database(target):
+            taken = Person.objects.filter(pk__in=pks).count()
+        copied = resuming and taken == len(pks)
+        if taken and not copied:
+            raise CommandError(
+                f"{taken} person ids of tree {tree.pk} are already used in '{target}'."
+            )
+        return pks, copied
+
+    def crossing_links(self, tree):
+        """
+        Returns the ids of the persons of the tree with a parent outside it,
+        and of the persons outside it with a parent inside.
+        """
+        leaving = Person.objects.for_tree(tree).filter(
+            Q(mother__isnull=False) & ~Q(mother__tree=tree)
+            | Q(father__isnull=False) & ~Q(father__tree=tree)
+        )
+        entering = Person.objects.filter(
+            Q(mother__tree=tree) | Q(father__tree=tree)
+        ).exclude(tree=tree)
+        return sorted(
+            {
+                *leaving.values_list("pk", flat=True),
+                *entering.values_list("pk", flat=True),
+            }
+        )
+
+    def copy(self, tree, pks, source, target, chunk_size):
+        """
+        Copy the persons in one transaction on the target (parent links
+        between batches are checked at commit), and index them there: only
+        the moved persons, so the other trees of the target are not walked.
+        """
+        moved = set(pks)
+        copied, resolved = [], {}
+        with routers.use_database(target), transaction.atomic(using=target):
+            routers.mirror_tree(tree, target)
+            for chunk in _chunks(pks, chunk_size):
+                with routers.use_database(source):
+                    batch = list(
+                        Person.objects.filter(pk__in=chunk).select_related(
+                            "user_account"
+                        )
+                    )
+                for person in batch:
+                    # Places are resolved again in the target; the audit
+                    # links may point into other trees.
+                    for text_field, place_field in upsert.PLACES:
+                        text = getattr(person, text_field)
+                        if text and text not in resolved:
+                            resolved[text] = Place.objects.resolve(text)
+                        setattr(person, place_field, resolved.get(text))
+                    if person.created_by_id not in moved:
+                        person.created_by = None
+                    if person.modified_by_id not in moved:
+                        person.modified_by = None
+                    if person.user_account_id:
+                        routers.mirror_user(person.user_account, target)
+                Person.objects.using(target).bulk_create(batch)
+                intervals.update_persons(batch)
+                copied.extend(batch)
+                with routers.use_database(source):
+                    external_ids = list(ExternalId.objects.filter(person__in=chunk))
+                ExternalId.objects.using(target).bulk_create(
+                    ExternalId(
+                        source=row.source,
+                        external_id=row.external_id,
+                        person_id=row.person_id,
+                    )
+                    for row in external_ids
+                )
+                with routers.use_database(source):
+                    changes = list(PersonChange.objects.filter(person__in=chunk))
+                for change in changes:
+                    change.pk = None
+                PersonChange.objects.using(target).bulk_create(changes)
+
+            connection = connections[target]
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [Person]):
+                    cursor.execute(sql)
+
+            ancestry.add_persons(copied, chunk_size=chunk_size)
+            lineage.update_links(
+                pks, [pk for p in copied for pk in (p.mother_id, p.father_id) if pk]
+            )
+            stats.rebuild(tree=tree.pk)
+            revisions.bump(revisions.PERSONS, tree.pk)
+            revisions.bump(revisions.GRAPH, tree.pk)
+
+    def delete(self, tree, pks, source, chunk_size):
+        """
+        Delete the moved persons from the source, in batches. The person
+        signals keep the derived data of the source up to date; dropping the
+        tree's ancestry rows first saves them walking it person by person.
+        Each batch commits on its own; an interrupted run resumes here.
+        """
+        with routers.use_database(source):
+            PersonAncestry.objects.filter(descendant__tree=tree).delete()
+            for chunk in _chunks(pks, chunk_size):
+                with transaction.atomic(using=source):
+                    Person.objects.filter(pk__in=chunk).delete()
+                    # The history moved along; drop it, with the entries
+                    # the deletion just recorded.
+                    PersonChange.objects.filter(person__in=chunk).delete()
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from persons.places import normalize_persons
+
+
+class Command(BaseCommand):
+    help = (
+        "Resolve place_of_birth / place_of_death of existing persons against "
+        "the offline gazetteer, in chunks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of persons updated per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        updated = normalize_persons(chunk_size=options["chunk_size"])
+        self.stdout.write(
+            self.style.SUCCESS(f"Normalized places of {updated} persons.")
+        )
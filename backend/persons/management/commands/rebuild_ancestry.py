@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from persons import ancestry
+
+
+class Command(BaseCommand):
+    help = "Rebuild the ancestry index used to reject cyclic parent assignments."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=10000,
+            help="Number of persons read and rows written per batch.",
+        )
+
+    def handle(self, *args, **options):
+        rows = ancestry.rebuild(chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {rows} ancestry index rows."))
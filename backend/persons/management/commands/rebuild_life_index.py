@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from persons import intervals
+
+
+class Command(BaseCommand):
+    help = "Rebuild the lifespan interval index used by alive-on and contemporaries."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=2000,
+            help="Number of persons read and rows written per batch.",
+        )
+
+    def handle(self, *args, **options):
+        rows = intervals.rebuild(chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {rows} lifespan index rows."))
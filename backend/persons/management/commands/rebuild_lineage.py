@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from persons import lineage
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the ancestor and descendant counts and generations of every "
+        "person. Run rebuild_ancestry first if the ancestry index is stale."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=10000,
+            help="Number of persons read and rows written per batch.",
+        )
+
+    def handle(self, *args, **options):
+        rows = lineage.rebuild(chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {rows} lineage rows."))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from persons import stats
+
+
+class Command(BaseCommand):
+    help = "Rebuild or check the incrementally maintained person statistics."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only compare the summaries with a full recomputation.",
+        )
+
+    def handle(self, *args, **options):
+        if options["check"]:
+            differences = stats.check()
+            for tree, dimension, bucket, gender, stored, expected in differences:
+                self.stdout.write(
+                    f"tree {tree} {dimension} {bucket!r} {gender}: "
+                    f"stored {stored}, expected {expected}"
+                )
+            if differences:
+                raise CommandError(
+                    f"{len(differences)} summary rows are inconsistent; "
+                    "run rebuild_person_stats to fix them."
+                )
+            self.stdout.write(self.style.SUCCESS("Person statistics are consistent."))
+            return
+
+        rows = stats.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} summary rows."))
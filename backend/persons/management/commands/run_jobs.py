@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from persons.jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs in a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes", type=int, default=2, help="Number of worker processes."
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds between checks for new jobs.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when no job is due instead of waiting for new jobs.",
+        )
+
+    def handle(self, *args, **options):
+        run_worker(
+            processes=options["processes"],
+            poll_interval=options["poll_interval"],
+            once=options["once"],
+        )
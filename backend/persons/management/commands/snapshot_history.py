@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from persons import history
+
+
+class Command(BaseCommand):
+    help = (
+        "Store a history snapshot of every person without history, so that "
+        "`as_of` requests cover the persons created before it was kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of persons read and snapshots written per batch.",
+        )
+
+    def handle(self, *args, **options):
+        written = history.baseline(chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} history snapshots."))
@@ -0,0 +1,381 @@
+from datetime import date
+from difflib import SequenceMatcher
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from . import accounts, ancestry, upsert
+from .gazetteer import normalize
+from .models import ExternalId, Person, PersonAncestry
+
+# Person fields compared between matched persons and merged into the target.
+FIELDS = (*upsert.FIELDS, "user_account_id")
+# Parent links, aligned by their position rather than compared as values.
+PARENTS = ("mother_id", "father_id")
+# Weights of the fields making up the similarity of two persons.
+NAME_WEIGHTS = (("first_name", 3), ("last_name", 2), ("birth_name", 1))
+DATE_WEIGHTS = (("date_of_birth", 2), ("date_of_death", 1))
+# Years apart at which two dates no longer count as similar at all.
+YEAR_TOLERANCE = 5
+# Default similarity two children must reach to be matched. Parents are
+# matched by their position, so half of it is enough for them.
+MIN_SIMILARITY = 0.75
+
+
+def _blank(field, value):
+    return value in (None, "") or (field == "gender" and value == "U")
+
+
+def similarity(a, b):
+    """
+    Returns how alike two persons look, from 0 to 1: the weighted average
+    of the name similarities (accents and case ignored) and of the year
+    distances of the dates known for both. Persons of different known
+    genders score 0, and so do persons with nothing to compare.
+    """
+    if not _blank("gender", a.gender) and not _blank("gender", b.gender):
+        if a.gender != b.gender:
+            return 0.0
+    score = weight = 0
+    for field, w in NAME_WEIGHTS:
+        x, y = normalize(getattr(a, field)), normalize(getattr(b, field))
+        if x and y:
+            weight += w
+            score += w * SequenceMatcher(None, x, y).ratio()
+    for field, w in DATE_WEIGHTS:
+        x, y = getattr(a, field), getattr(b, field)
+        if x and y:
+            weight += w
+            score += w * max(0.0, 1 - abs(x.year - y.year) / YEAR_TOLERANCE)
+    return score / weight if weight else 0.0
+
+
+def _load(scope, pks):
+    return {person.pk: person for person in scope.filter(pk__in=pks)}
+
+
+def _children(scope, pks):
+    """Returns {parent id: [children]} of the persons `pks` within `scope`."""
+    children = {}
+    for child in scope.filter(Q(mother_id__in=pks) | Q(father_id__in=pks)):
+        for parent in (child.mother_id, child.father_id):
+            if parent in pks:
+                children.setdefault(parent, []).append(child)
+    return children
+
+
+class _Alignment:
+    """The persons matched so far, and what differs between them."""
+
+    def __init__(self, target, source, min_similarity):
+        self.min_similarity = min_similarity
+        # Links leaving the family tree are not followed.
+        self.scope = Person.objects.for_tree(target.tree_id or 0)
+        self.persons = {target.pk: target, source.pk: source}
+        self.pairs = {target.pk: source.pk}
+        self.matched_sources = {source.pk}
+        self.scores = {target.pk: 1.0}
+        self.parents = {}
+        self.parent_conflicts = {}
+        self.added = []
+
+    def match(self, target, source, score):
+        self.persons[target.pk] = target
+        self.persons[source.pk] = source
+        self.pairs[target.pk] = source.pk
+        self.matched_sources.add(source.pk)
+        self.scores[target.pk] = score
+
+    def is_free(self, target, source):
+        return (
+            target.pk not in self.pairs
+            and source.pk not in self.matched_sources
+            and target.pk not in self.matched_sources
+            and source.pk not in self.pairs
+        )
+
+    def align_parents(self, frontier):
+        """
+        Align the parents of the matched pairs in `frontier`, mother with
+        mother and father with father. Returns the new pairs.
+        """
+        ids = {
+            getattr(person, field)
+            for pair in frontier
+            for person in pair
+            for field in PARENTS
+        } - {None}
+        parents = _load(self.scope, ids)
+        matched = []
+        for target, source in frontier:
+            for field in PARENTS:
+                t = parents.get(getattr(target, field))
+                s = parents.get(getattr(source, field))
+                if s is None or t == s:
+                    continue
+                if t is None:
+                    self.parents.setdefault(target.pk, {})[field] = s.pk
+                    self.added.append(
+                        {"person": s.pk, "relation": field[:-3], "of": target.pk}
+                    )
+                    continue
+                if self.pairs.get(t.pk) == s.pk:
+                    continue  # Reached over both lines (pedigree collapse).
+                score = similarity(t, s)
+                if score >= self.min_similarity / 2 and self.is_free(t, s):
+                    self.match(t, s, score)
+                    matched.append((t, s))
+                else:
+                    self.parent_conflicts.setdefault(target.pk, {})[field] = {
+                        "target": t.pk,
+                        "source": s.pk,
+                    }
+        return matched
+
+    def align_children(self, frontier):
+        """
+        Match the children of each pair in `frontier` with each other, best
+        scores first. Returns the new pairs.
+        """
+        children = _children(
+            self.scope, {person.pk for pair in frontier for person in pair}
+        )
+        matched = []
+        for target, source in frontier:
+            ours = children.get(target.pk, [])
+            theirs = children.get(source.pk, [])
+            candidates = sorted(
+                (
+                    (similarity(t, s), t, s)
+                    for t in ours
+                    for s in theirs
+                    if t != s and self.is_free(t, s)
+                ),
+                key=lambda c: (-c[0], c[1].pk, c[2].pk),
+            )
+            for score, t, s in candidates:
+                if score < self.min_similarity:
+                    break
+                if self.is_free(t, s):
+                    self.match(t, s, score)
+                    matched.append((t, s))
+            ours = {t.pk for t in ours}
+            for child in theirs:
+                if child.pk not in self.matched_sources and child.pk not in ours:
+                    self.added.append(
+                        {"person": child.pk, "relation": "child", "of": target.pk}
+                    )
+        return matched
+
+
+def _align(target, source, up, down, min_similarity):
+    if target.tree_id != source.tree_id:
+        raise ValueError("Both persons must belong to the same family tree")
+    if (
+        target.pk == source.pk
+        or PersonAncestry.objects.filter(
+            Q(ancestor=target, descendant=source)
+            | Q(ancestor=source, descendant=target)
+        ).exists()
+    ):
+        raise ValueError("A person cannot be merged with itself or a relative")
+    alignment = _Alignment(target, source, min_similarity)
+    frontier = [(target, source)]
+    for _ in range(up):
+        frontier = alignment.align_parents(frontier)
+        if not frontier:
+            break
+    frontier = [(target, source)]
+    for _ in range(down):
+        frontier = alignment.align_children(frontier)
+        if not frontier:
+            break
+    return alignment
+
+
+def _field_diff(target, source):
+    changes, conflicts = {}, {}
+    for field in FIELDS:
+        ours, theirs = getattr(target, field), getattr(source, field)
+        if _blank(field, theirs) or ours == theirs:
+            continue
+        if _blank(field, ours):
+            changes[field] = theirs
+        else:
+            conflicts[field] = {"target": ours, "source": theirs}
+    return changes, conflicts
+
+
+def diff(target, source, up=3, down=3, min_similarity=MIN_SIMILARITY):
+    """
+    Compare the subgraph around `source` with the one around `target`.
+
+    Both are walked from the chosen persons generation by generation, `up`
+    generations of ancestors and `down` of descendants, with one query per
+    generation and side. Parents are aligned by their position (mother with
+    mother) and children of matched persons by `similarity`, so the cost
+    grows with the size of the subgraphs, not with the number of pairs.
+
+    Returns:
+    --------
+    dict
+        - matched: {"target", "source", "similarity"} for every aligned pair
+        - changed: {"target", "source", "fields"} for the pairs where the
+          source knows values the target lacks (`fields` maps them)
+        - conflicting: {"target", "source", "fields"} for the pairs with
+          different known values, as {field: {"target", "source"}};
+          parents that did not match count as a conflicting mother/father
+        - added: {"person", "relation", "of"} for the source persons without
+          a counterpart, which the merge attaches to the target person
+          `of` as its "mother", "father" or "child"
+
+    Raises ValueError for persons of different family trees and for
+    persons related to each other.
+    """
+    alignment = _align(target, source, up, down, min_similarity)
+    result = {
+        "target": target.pk,
+        "source": source.pk,
+        "matched": [],
+        "changed": [],
+        "conflicting": [],
+        "added": alignment.added,
+    }
+    for t, s in alignment.pairs.items():
+        result["matched"].append(
+            {"target": t, "source": s, "similarity": round(alignment.scores[t], 3)}
+        )
+        changes, conflicts = _field_diff(alignment.persons[t], alignment.persons[s])
+        changes.update(
+            (field[:-3], pk) for field, pk in alignment.parents.get(t, {}).items()
+        )
+        conflicts.update(
+            (field[:-3], pks)
+            for field, pks in alignment.parent_conflicts.get(t, {}).items()
+        )
+        if changes:
+            result["changed"].append({"target": t, "source": s, "fields": changes})
+        if conflicts:
+            result["conflicting"].append(
+                {"target": t, "source": s, "fields": conflicts}
+            )
+    return result
+
+
+@transaction.atomic
+def merge(target, source, up=3, down=3, min_similarity=MIN_SIMILARITY, prefer=None):
+    """
+    Merge the subgraph around `source` into the one around `target`, as
+    `diff` aligns them, in one transaction.
+
+    Every matched target person gets the values only its source counterpart
+    knows, and the conflicting ones `prefer` asks for ({target id: [field,
+    ...]} of the fields, or "mother"/"father", to take from the source).
+    Mother and father links pointing at matched source persons, and their
+    external ids, are moved to the target counterparts with bulk updates;
+    the matched source persons are deleted afterwards. Unmatched source
+    persons stay, attached to the target persons.
+
+    Returns {"merged", "updated", "relinked"}. Raises ValueError like
+    `diff`, for unknown fields in `prefer`, when a preferred parent
+    would close an ancestry cycle and when both persons of a pair are
+    linked to user accounts and `prefer` does not pick the source's.
+    """
+    prefer = prefer or {}
+    unknown = {f for fields in prefer.values() for f in fields} - {
+        *FIELDS,
+        "mother",
+        "father",
+    }
+    if unknown:
+        raise ValueError(f"Cannot merge {', '.join(sorted(unknown))}")
+    alignment = _align(target, source, up, down, min_similarity)
+    mapping = {s: t for t, s in alignment.pairs.items()}
+    persons = alignment.persons
+
+    updates = {}
+    for t, s in alignment.pairs.items():
+        changes, conflicts = _field_diff(persons[t], persons[s])
+        preferred = prefer.get(t, ())
+        if "user_account_id" in conflicts and "user_account_id" not in preferred:
+            raise ValueError(
+                f"Persons {t} and {s} are both linked to a user account; "
+                "prefer one with 'user_account_id'"
+            )
+        fields = dict(changes)
+        fields.update(
+            (field, values["source"])
+            for field, values in conflicts.items()
+            if field in preferred
+        )
+        fields.update(alignment.parents.get(t, {}))
+        fields.update(
+            (field, pks["source"])
+            for field, pks in alignment.parent_conflicts.get(t, {}).items()
+            if field[:-3] in prefer.get(t, ())
+        )
+        # The places were resolved with the texts.
+        for text_field, place_field in upsert.PLACES:
+            if text_field in fields:
+                fields[f"{place_field}_id"] = getattr(persons[s], f"{place_field}_id")
+        if fields:
+            updates[t] = fields
+
+    # Children of the duplicates outside the aligned window move as well.
+    for child in alignment.scope.filter(
+        Q(mother_id__in=mapping) | Q(father_id__in=mapping)
+    ).exclude(pk__in=mapping):
+        persons.setdefault(child.pk, child)
+        for field in PARENTS:
+            if getattr(child, field) in mapping:
+                updates.setdefault(child.pk, {})[field] = mapping[getattr(child, field)]
+
+    written, written_fields, before, relinked = [], set(), {}, {}
+    for pk, fields in updates.items():
+        person = persons[pk]
+        before[pk] = {f: getattr(person, f) for f in upsert.TRACKED}
+        for field, value in fields.items():
+            setattr(
+                person, field, mapping.get(value, value) if field in PARENTS else value
+            )
+        if any(field in PARENTS for field in fields):
+            relinked[pk] = [getattr(person, field) for field in PARENTS]
+        written.append(person)
+        written_fields |= set(fields)
+    if ancestry.cyclic_assignments(relinked):
+        raise ValueError("The merge would make a person their own ancestor")
+
+    # The accounts moving to the targets can only be linked once, so they
+    # are unlinked from the duplicates first, as a recorded change of each.
+    # A target account the source's replaces is unlinked with the update.
+    replaced = []
+    for t, s in alignment.pairs.items():
+        if "user_account_id" in updates.get(t, {}):
+            persons[s].user_account = None
+            persons[s].save(update_fields=["user_account"])
+            replaced.append(before[t]["user_account_id"])
+    accounts.forget(*replaced)
+    ExternalId.objects.bulk_update(
+        [
+            ExternalId(pk=pk, person_id=mapping[person_id])
+            for pk, person_id in ExternalId.objects.filter(
+                person_id__in=mapping
+            ).values_list("pk", "person_id")
+        ],
+        ["person"],
+    )
+    for person in written:
+        person.modified_on = date.today()
+        person.version = F("version") + 1
+    if written:
+        Person.objects.bulk_update(written, written_fields | {"modified_on", "version"})
+        versions = dict(
+            Person.objects.filter(pk__in=[p.pk for p in written]).values_list(
+                "pk", "version"
+            )
+        )
+        for person in written:
+            person.version = versions[person.pk]
+    upsert.refresh_derived(set(), written, before)
+    Person.objects.filter(pk__in=mapping).delete()
+    return {"merged": len(mapping), "updated": len(written), "relinked": len(relinked)}
@@ -0,0 +1,79 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_vary_headers
+
+from . import routers
+from .compression import choose_encoding, compress
+
+
+class CompressionMiddleware:
+    """
+    Compress responses with brotli or gzip, depending on `Accept-Encoding`.
+
+    Responses smaller than RESPONSE_COMPRESSION_MIN_SIZE are sent as they
+    are. Views can set `response.compression_cache_key` to a key that
+    identifies the payload (e.g. including a data revision); the compressed
+    body is then cached under that key and the media type, so an unchanged
+    payload is only compressed once.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if (
+            response.streaming
+            or response.has_header("Content-Encoding")
+            or len(response.content) < settings.RESPONSE_COMPRESSION_MIN_SIZE
+        ):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = choose_encoding(request)
+        if encoding is None:
+            return response
+
+        cache_key = getattr(response, "compression_cache_key", None)
+        if cache_key is not None:
+            digest = hashlib.sha1(
+                f"{cache_key}:{response.get('Content-Type')}".encode()
+            ).hexdigest()
+            cache_key = f"persons:compressed:{encoding}:{digest}"
+            body = cache.get(cache_key)
+            if body is None:
+                body = compress(response.content, encoding)
+                cache.set(cache_key, body, settings.RESPONSE_COMPRESSION_CACHE_TIMEOUT)
+        else:
+            body = compress(response.content, encoding)
+
+        if len(body) >= len(response.content):
+            return response
+
+        response.content = body
+        response.headers["Content-Length"] = str(len(body))
+        response.headers["Content-Encoding"] = encoding
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        return response
+
+
+class TreeRoutingMiddleware:
+    """
+    Route the person data of a request to the database of the family tree
+    given as `?tree=`, when `persons.routers.FamilyTreeRouter` is enabled.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        tree = request.GET.get("tree", "")
+        if not tree.isdigit() or not routers.enabled():
+            return self.get_response(request)
+        with routers.use_tree(int(tree)):
+            return self.get_response(request)
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.27 on 2026-10-19 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("persons", "0004_revision"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PersonSummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "dimension",
+                    models.CharField(
+                        choices=[
+                            ("total", "Total"),
+                            ("birth_decade", "Birth decade"),
+                            ("lifespan", "Lifespan"),
+                            ("place_of_birth", "Place of birth"),
+                            ("place_of_death", "Place of death"),
+                            ("cause_of_death", "Cause of death"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("bucket", models.CharField(blank=True, max_length=100)),
+                ("gender", models.CharField(max_length=1)),
+                ("count", models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="personsummary",
+            constraint=models.UniqueConstraint(
+                fields=("dimension", "bucket", "gender"),
+                name="unique_person_summary_bucket",
+            ),
+        ),
+    ]
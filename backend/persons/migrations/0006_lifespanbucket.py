@@ -0,0 +1,53 @@
+# Generated by Django 4.2.27 on 2026-10-19 12:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("persons", "0005_personsummary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LifeSpanBucket",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bucket", models.SmallIntegerField(help_text="Decade, as year // 10")),
+                ("start", models.DateField()),
+                ("end", models.DateField()),
+                (
+                    "estimated",
+                    models.BooleanField(
+                        default=False,
+                        help_text="Start or end derived from the maximum lifespan",
+                    ),
+                ),
+                (
+                    "person",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="lifespan_buckets",
+                        to="persons.person",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["bucket", "start", "end"], name="lifespan_bucket_range"
+                    )
+                ],
+            },
+        ),
+    ]
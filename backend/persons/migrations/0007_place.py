@@ -0,0 +1,64 @@
+# Generated by Django 4.2.27 on 2026-10-19 12:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("persons", "0006_lifespanbucket"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Place",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=150, unique=True)),
+                ("name", models.CharField(max_length=100)),
+                ("country", models.CharField(blank=True, max_length=2)),
+                ("latitude", models.FloatField(blank=True, null=True)),
+                ("longitude", models.FloatField(blank=True, null=True)),
+                ("cell_lat", models.IntegerField(editable=False, null=True)),
+                ("cell_lon", models.IntegerField(editable=False, null=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["cell_lat", "cell_lon"], name="place_grid")
+                ],
+            },
+        ),
+        migrations.AddField(
+            model_name="person",
+            name="birth_place",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="births",
+                to="persons.place",
+            ),
+        ),
+        migrations.AddField(
+            model_name="person",
+            name="death_place",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="deaths",
+                to="persons.place",
+            ),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.27 on 2026-10-19 12:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("persons", "0008_job"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PersonAncestry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("paths", models.PositiveBigIntegerField(default=1)),
+                (
+                    "ancestor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="descendant_links",
+                        to="persons.person",
+                    ),
+                ),
+                (
+                    "descendant",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ancestor_links",
+                        to="persons.person",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="personancestry",
+            constraint=models.UniqueConstraint(
+                fields=("ancestor", "descendant"), name="unique_ancestry_pair"
+            ),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.27 on 2026-10-19 12:51
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("persons", "0009_personancestry"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="person",
+            index=models.Index(
+                django.db.models.functions.text.Lower("first_name"),
+                name="person_first_name_lower",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="person",
+            index=models.Index(
+                django.db.models.functions.text.Lower("last_name"),
+                name="person_last_name_lower",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="person",
+            index=models.Index(
+                django.db.models.functions.text.Lower("birth_name"),
+                name="person_birth_name_lower",
+            ),
+        ),
+    ]
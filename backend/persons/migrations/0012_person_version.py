@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-19 13:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("persons", "0011_familytree"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="person",
+            name="version",
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 4.2.27 on 2026-10-19 13:11
+
+import django.core.serializers.json
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("persons", "0013_externalid"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PersonChange",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.PositiveIntegerField()),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("created", "Created"),
+                            ("updated", "Updated"),
+                            ("deleted", "Deleted"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("changed_on", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "diff",
+                    models.JSONField(
+                        default=dict,
+                        encoder=django.core.serializers.json.DjangoJSONEncoder,
+                    ),
+                ),
+                (
+                    "snapshot",
+                    models.JSONField(
+                        blank=True,
+                        encoder=django.core.serializers.json.DjangoJSONEncoder,
+                        null=True,
+                    ),
+                ),
+                (
+                    "mother_id",
+                    models.IntegerField(blank=True, db_index=True, null=True),
+                ),
+                (
+                    "father_id",
+                    models.IntegerField(blank=True, db_index=True, null=True),
+                ),
+                (
+                    "person",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="changes",
+                        to="persons.person",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="personchange",
+            constraint=models.UniqueConstraint(
+                fields=("person", "version"), name="unique_person_version"
+            ),
+        ),
+    ]
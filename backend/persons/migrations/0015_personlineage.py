@@ -0,0 +1,33 @@
+# Generated by Django 4.2.27 on 2026-10-19 13:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("persons", "0014_personchange"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PersonLineage",
+            fields=[
+                (
+                    "person",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="lineage",
+                        serialize=False,
+                        to="persons.person",
+                    ),
+                ),
+                ("ancestors", models.PositiveIntegerField(default=0)),
+                ("descendants", models.PositiveIntegerField(default=0)),
+                ("ancestor_generations", models.PositiveIntegerField(default=0)),
+                ("descendant_generations", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
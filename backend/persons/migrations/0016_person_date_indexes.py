@@ -0,0 +1,21 @@
+# Generated by Django 4.2.27 on 2026-10-19 13:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("persons", "0015_personlineage"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="person",
+            index=models.Index(fields=["date_of_birth"], name="person_date_of_birth"),
+        ),
+        migrations.AddIndex(
+            model_name="person",
+            index=models.Index(fields=["date_of_death"], name="person_date_of_death"),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-19 13:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("persons", "0016_person_date_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="job",
+            name="heartbeat_on",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
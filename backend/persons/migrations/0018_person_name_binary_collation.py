@@ -0,0 +1,54 @@
+# Generated by Django 4.2.27 on 2026-10-19 14:02
+
+import django.db.models.functions.text
+import persons.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("persons", "0017_job_heartbeat_on"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="person",
+            name="person_first_name_lower",
+        ),
+        migrations.RemoveIndex(
+            model_name="person",
+            name="person_last_name_lower",
+        ),
+        migrations.RemoveIndex(
+            model_name="person",
+            name="person_birth_name_lower",
+        ),
+        migrations.AddIndex(
+            model_name="person",
+            index=models.Index(
+                persons.models.BinaryCollate(
+                    django.db.models.functions.text.Lower("first_name")
+                ),
+                name="person_first_name_lower",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="person",
+            index=models.Index(
+                persons.models.BinaryCollate(
+                    django.db.models.functions.text.Lower("last_name")
+                ),
+                name="person_last_name_lower",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="person",
+            index=models.Index(
+                persons.models.BinaryCollate(
+                    django.db.models.functions.text.Lower("birth_name")
+                ),
+                name="person_birth_name_lower",
+            ),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.27 on 2026-10-19 14:05
+
+from django.db import migrations, models
+
+
+def rebuild_summaries(apps, schema_editor):
+    # The existing rows all landed in tree 0; recount them per tree.
+    from persons import routers, stats
+
+    with routers.use_database(schema_editor.connection.alias):
+        stats.rebuild()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("persons", "0018_person_name_binary_collation"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="personsummary",
+            name="unique_person_summary_bucket",
+        ),
+        migrations.AddField(
+            model_name="familytree",
+            name="moving_to",
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name="personsummary",
+            name="tree",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name="personsummary",
+            constraint=models.UniqueConstraint(
+                fields=("tree", "dimension", "bucket", "gender"),
+                name="unique_person_summary_bucket",
+            ),
+        ),
+        migrations.RunPython(rebuild_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-19 14:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("persons", "0019_tree_scoping"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="job",
+            name="database",
+            field=models.CharField(default="default", editable=False, max_length=100),
+        ),
+    ]
@@ -1,11 +1,257 @@
+import math
+import sys
 from datetime import date, datetime
 
 from dateutil.relativedelta import relativedelta
 from django.contrib.auth.models import User
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, models
+from django.db.models import Case, ExpressionWrapper, F, Func, Q, Value, When
+from django.db.models.functions import ExtractDay, ExtractMonth, ExtractYear, Lower
+from django.utils import timezone
+
+from .gazetteer import lookup, normalize
+
+
+class PlaceManager(models.Manager):
+    def resolve(self, text):
+        """
+        Returns the Place for a free-text place name, creating it if needed.
+
+        Names found in the offline gazetteer share one Place per gazetteer
+        entry ("Leipzig" and "Leipzig, Sachsen" are the same place) and get
+        coordinates. Unknown names are de-duplicated by their normalized
+        spelling and stay without coordinates. Returns None for blank text.
+        """
+        entry = lookup(text)
+        key = entry.key if entry else normalize(text)
+        if not key:
+            return None
+        place = self.filter(key=key).first()
+        if place is not None:
+            return place
+        if entry:
+            defaults = {
+                "name": entry.name,
+                "country": entry.country,
+                "latitude": entry.latitude,
+                "longitude": entry.longitude,
+            }
+        else:
+            defaults = {"name": text.strip()[:100]}
+        return self.get_or_create(key=key, defaults=defaults)[0]
+
+
+class Place(models.Model):
+    """
+    A normalized place of birth or death.
+
+    Places with coordinates are also assigned to a cell of a regular
+    latitude/longitude grid, so radius and bounding-box queries only look at
+    the indexed cells around the search area (see `persons.places`).
+    """
+
+    # Size of a grid cell in degrees.
+    GRID_DEGREES = 0.5
+
+    key = models.CharField(max_length=150, unique=True)
+    name = models.CharField(max_length=100)
+    country = models.CharField(max_length=2, blank=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    cell_lat = models.IntegerField(null=True, editable=False)
+    cell_lon = models.IntegerField(null=True, editable=False)
+
+    objects = PlaceManager()
+
+    class Meta:
+        indexes = [models.Index(fields=["cell_lat", "cell_lon"], name="place_grid")]
+
+    def __str__(self):
+        return f"{self.name}, {self.country}" if self.country else self.name
+
+    def save(self, *args, **kwargs):
+        if self.latitude is None or self.longitude is None:
+            self.cell_lat = self.cell_lon = None
+        else:
+            self.cell_lat = math.floor(self.latitude / self.GRID_DEGREES)
+            self.cell_lon = math.floor(self.longitude / self.GRID_DEGREES)
+        super().save(*args, **kwargs)
+
+
+# Name fields with a lower-case index, searched by prefix in
+# `PersonQuerySet.search`.
+SEARCH_FIELDS = ("first_name", "last_name", "birth_name")
+
+
+class BinaryCollate(Func):
+    """
+    `expression` compared by code point (BINARY on SQLite, "C" on Postgres)
+    whatever the column or database collation. Only under such a collation
+    do all values starting with a prefix sort between the prefix and its
+    successor, as `_prefix_range` relies on; the name indexes are built on
+    the same expression, so the database can still answer from them.
+    """
+
+    arity = 1
+    template = "%(expressions)s COLLATE BINARY"
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='%(expressions)s COLLATE "C"')
+
+
+def _lower(field):
+    """The lower-cased name `field` as indexed, see `BinaryCollate`."""
+    return BinaryCollate(Lower(field))
+
+
+def _prefix_range(alias, word):
+    """
+    Values of `alias` (a `_lower` expression) starting with `word`: from
+    "ann" up to "ano".
+    """
+    if ord(word[-1]) == sys.maxunicode:
+        return Q(**{f"{alias}__startswith": word})
+    after = word[:-1] + chr(ord(word[-1]) + 1)
+    return Q(**{f"{alias}__gte": word, f"{alias}__lt": after})
+
+
+class PersonQuerySet(models.QuerySet):
+    def search(self, text):
+        """
+        Persons with a name starting with every word of `text`, ignoring case.
+
+        Each word becomes a range condition on the lower-cased name indexes
+        ("ann" matches names from "ann" up to, not including, "ano"), which
+        the database answers from the indexes instead of scanning the table
+        as `icontains` does.
+        """
+        persons = self.alias(
+            **{f"{field}_lower": _lower(field) for field in SEARCH_FIELDS}
+        )
+        for word in text.lower().split():
+            query = Q()
+            for field in SEARCH_FIELDS:
+                query |= _prefix_range(f"{field}_lower", word)
+            persons = persons.filter(query)
+        return persons
+
+    def prefix(self, field, text):
+        """
+        Persons whose `field` (one of SEARCH_FIELDS) starts with `text`,
+        ignoring case, as a range condition on the lower-cased index.
+        """
+        text = text.lower()
+        if not text:
+            return self
+        return self.alias(**{f"{field}_lower": _lower(field)}).filter(
+            _prefix_range(f"{field}_lower", text)
+        )
+
+    def for_tree(self, tree):
+        """
+        Persons of one family tree, given as a FamilyTree or its id; tree 0
+        stands for the persons without a tree, as in `persons.revisions`.
+        """
+        if tree == 0:
+            return self.filter(tree__isnull=True)
+        return self.filter(tree=tree)
+
+    def with_ages(self, today=None):
+        """
+        Annotate every person with ages computed by the database.
+
+        - age: completed years from birth until `today` (living persons only)
+        - age_at_death: completed years from birth until death
+        - lifespan: duration between birth and death (a timedelta)
+
+        Only date parts and arithmetic are used, so the annotations work on
+        SQLite and Postgres alike and can be used to filter and order.
+        Missing dates yield NULL.
+        """
+        today = today or date.today()
+        qs = self.alias(
+            _birth_year=ExtractYear("date_of_birth"),
+            _birth_month=ExtractMonth("date_of_birth"),
+            _birth_day=ExtractDay("date_of_birth"),
+            _death_year=ExtractYear("date_of_death"),
+            _death_month=ExtractMonth("date_of_death"),
+            _death_day=ExtractDay("date_of_death"),
+        )
+        before_birthday = Q(_birth_month__gt=today.month) | Q(
+            _birth_month=today.month, _birth_day__gt=today.day
+        )
+        died_before_birthday = Q(_death_month__lt=F("_birth_month")) | Q(
+            _death_month=F("_birth_month"), _death_day__lt=F("_birth_day")
+        )
+        return qs.annotate(
+            age=Case(
+                When(date_of_death__isnull=False, then=Value(None)),
+                default=Value(today.year)
+                - F("_birth_year")
+                - Case(When(before_birthday, then=1), default=0),
+                output_field=models.IntegerField(),
+            ),
+            age_at_death=ExpressionWrapper(
+                F("_death_year")
+                - F("_birth_year")
+                - Case(When(died_before_birthday, then=1), default=0),
+                output_field=models.IntegerField(),
+            ),
+            lifespan=ExpressionWrapper(
+                F("date_of_death") - F("date_of_birth"),
+                output_field=models.DurationField(),
+            ),
+        )
+
+
+class VersionConflict(Exception):
+    """
+    Raised when a person is saved from a stale copy: the row was updated by
+    someone else since the version the copy was loaded at.
+    """
+
+    def __init__(self, person, expected):
+        super().__init__(
+            f"Person {person.pk} was modified since version {expected} was read."
+        )
+        self.person = person
+        self.expected = expected
+
+
+class FamilyTree(models.Model):
+    """
+    A family tree owned by a user. Every person belongs to at most one tree;
+    the API scopes its queries to the tree given as `?tree=`.
+    """
+
+    name = models.CharField(max_length=100)
+    owner = models.ForeignKey(
+        User, models.SET_NULL, blank=True, null=True, related_name="family_trees"
+    )
+    created_on = models.DateTimeField(auto_now_add=True)
+    # Database alias the tree is being moved to by `move_tree`; the API
+    # refuses writes to the tree until the move is done.
+    moving_to = models.CharField(max_length=100, blank=True, editable=False)
+
+    def __str__(self):
+        return self.name
+
+
+class TreeMoving(Exception):
+    """Raised when writing to a family tree that is being moved."""
+
+    def __init__(self, tree):
+        super().__init__(f"Family tree {tree} is being moved, try again later.")
+        self.tree = tree
 
 
 class Person(models.Model):
+    # --- Tree ---
+    tree = models.ForeignKey(
+        FamilyTree, models.PROTECT, blank=True, null=True, related_name="persons"
+    )
     # --- Names ---
     first_name = models.CharField(max_length=50, blank=True)
     middle_name = models.CharField(max_length=50, blank=True)
@@ -19,6 +265,23 @@ class Person(models.Model):
     date_of_death = models.DateField(null=True)
     place_of_death = models.CharField(max_length=100, blank=True)
     cause_of_death = models.CharField(max_length=100, blank=True)
+    # --- Normalized places (resolved from the free-text fields on save) ---
+    birth_place = models.ForeignKey(
+        Place,
+        models.SET_NULL,
+        blank=True,
+        null=True,
+        editable=False,
+        related_name="births",
+    )
+    death_place = models.ForeignKey(
+        Place,
+        models.SET_NULL,
+        blank=True,
+        null=True,
+        editable=False,
+        related_name="deaths",
+    )
     # --- Relationship ---
     mother = models.ForeignKey(
         "self",
@@ -71,6 +334,21 @@ class Person(models.Model):
         null=True,
         related_name="modified_persons",
     )
+    # Bumped by every save; updates only apply to the version they were read at.
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = PersonQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            *(
+                models.Index(_lower(field), name=f"person_{field}_lower")
+                for field in SEARCH_FIELDS
+            ),
+            # Range filters and orderings of the person list.
+            models.Index(fields=["date_of_birth"], name="person_date_of_birth"),
+            models.Index(fields=["date_of_death"], name="person_date_of_death"),
+        ]
 
     def __str__(self):
         """
@@ -78,6 +356,123 @@ class Person(models.Model):
         """
         return self.full_name() or f"Person {self.id}"
 
+    def clean(self):
+        if not self.has_changed("mother_id", "father_id"):
+            return
+        from .ancestry import cyclic_parents
+
+        cyclic = cyclic_parents(self.pk, [self.mother_id, self.father_id])
+        errors = {
+            field: "A person cannot be their own ancestor."
+            for field in ("mother", "father")
+            if getattr(self, f"{field}_id") in cyclic
+        }
+        if errors:
+            raise ValidationError(errors)
+
+    def save(self, *args, **kwargs):
+        """
+        Save the person, resolving its places and bumping its version.
+
+        Updates are written with `UPDATE ... WHERE version = n`, n being the
+        version this copy was read at (or the one set by the caller), and
+        raise VersionConflict when another save got there first.
+        """
+        resolved = self.resolve_places()
+        if resolved and kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = [*kwargs["update_fields"], *resolved]
+        if not self._state.adding and self.pk is not None:
+            self._expected_version = self.version
+            self.version += 1
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = [*kwargs["update_fields"], "version"]
+        try:
+            super().save(*args, **kwargs)
+        except VersionConflict:
+            self.version = self._expected_version
+            raise
+        finally:
+            self._expected_version = None
+        fields = self._meta.concrete_fields
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            fields = [
+                field
+                for field in fields
+                if field.name in update_fields or field.attname in update_fields
+            ]
+        self._loaded_values = {
+            **getattr(self, "_loaded_values", {}),
+            **{field.attname: getattr(self, field.attname) for field in fields},
+        }
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        expected = getattr(self, "_expected_version", None)
+        if expected is None:
+            return super()._do_update(
+                base_qs, using, pk_val, values, update_fields, forced_update
+            )
+        updated = super()._do_update(
+            base_qs.filter(version=expected),
+            using,
+            pk_val,
+            values,
+            update_fields,
+            forced_update,
+        )
+        if not updated and base_qs.filter(pk=pk_val).exists():
+            raise VersionConflict(self, expected)
+        return updated
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        deferred = self.get_deferred_fields()
+        self._loaded_values = {
+            **getattr(self, "_loaded_values", {}),
+            **{
+                field.attname: getattr(self, field.attname)
+                for field in self._meta.concrete_fields
+                if field.attname not in deferred
+                and (fields is None or field.name in fields or field.attname in fields)
+            },
+        }
+
+    def has_changed(self, *fields):
+        """
+        Returns True if any of the given attributes differs from the value
+        last loaded from or saved to the database. Unsaved persons count as
+        changed.
+        """
+        loaded = getattr(self, "_loaded_values", None)
+        if loaded is None:
+            return True
+        return any(
+            field in loaded and loaded[field] != getattr(self, field)
+            for field in fields
+        )
+
+    def resolve_places(self):
+        """
+        Point birth_place/death_place at the Place of the free-text fields if
+        those changed. Returns the names of the fields that were updated.
+        """
+        resolved = []
+        for text_field, place_field in (
+            ("place_of_birth", "birth_place"),
+            ("place_of_death", "death_place"),
+        ):
+            if self.has_changed(text_field):
+                place = Place.objects.resolve(getattr(self, text_field))
+                setattr(self, place_field, place)
+                resolved.append(place_field)
+        return resolved
+
     def full_name(self):
         """
         Returns the full name of a person.
@@ -109,6 +504,319 @@ class Person(models.Model):
         return _time_difference(self.modified_on)
 
 
+class Revision(models.Model):
+    """
+    A named counter that is bumped whenever the data it describes changes.
+
+    Derived data (layouts, snapshots, ...) is cached under the current value,
+    so bumping the counter invalidates every cached copy at once.
+    """
+
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}@{self.value}"
+
+
+class PersonSummary(models.Model):
+    """
+    Pre-aggregated person counts for the statistics dashboard.
+
+    Each row counts the persons of one family tree and gender that fall into
+    one bucket of a dimension (e.g. birth decade "1950"), so the statistics
+    of a tree are read like the ones of the whole database. Rows are adjusted
+    incrementally whenever a person is saved or deleted (see
+    `persons.stats`).
+    """
+
+    TOTAL = "total"
+    BIRTH_DECADE = "birth_decade"
+    LIFESPAN = "lifespan"
+    PLACE_OF_BIRTH = "place_of_birth"
+    PLACE_OF_DEATH = "place_of_death"
+    CAUSE_OF_DEATH = "cause_of_death"
+
+    dimension = models.CharField(
+        max_length=20,
+        choices=[
+            (TOTAL, "Total"),
+            (BIRTH_DECADE, "Birth decade"),
+            (LIFESPAN, "Lifespan"),
+            (PLACE_OF_BIRTH, "Place of birth"),
+            (PLACE_OF_DEATH, "Place of death"),
+            (CAUSE_OF_DEATH, "Cause of death"),
+        ],
+    )
+    bucket = models.CharField(max_length=100, blank=True)
+    gender = models.CharField(max_length=1)
+    count = models.IntegerField(default=0)
+    # Family tree id of the counted persons, 0 for persons without a tree.
+    tree = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["tree", "dimension", "bucket", "gender"],
+                name="unique_person_summary_bucket",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.tree}:{self.dimension}:{self.bucket}:{self.gender}={self.count}"
+
+
+class LifeSpanBucket(models.Model):
+    """
+    Interval index over the (possibly estimated) lifespan of each person.
+
+    A person living from `start` to `end` gets one row per decade the
+    interval touches, so "alive on d" only looks at the rows of d's decade
+    through the (bucket, start, end) index instead of scanning all persons.
+    Maintained by `persons.intervals`.
+    """
+
+    person = models.ForeignKey(Person, models.CASCADE, related_name="lifespan_buckets")
+    bucket = models.SmallIntegerField(help_text="Decade, as year // 10")
+    start = models.DateField()
+    end = models.DateField()
+    estimated = models.BooleanField(
+        default=False, help_text="Start or end derived from the maximum lifespan"
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["bucket", "start", "end"], name="lifespan_bucket_range"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.person_id}@{self.bucket}: {self.start}..{self.end}"
+
+
+class Job(models.Model):
+    """
+    A long-running operation queued for the `run_jobs` worker.
+
+    Handlers are registered by kind in `persons.jobs`; the payload holds
+    their keyword arguments.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict, blank=True)
+    # Database alias the person data was routed to when the job was queued
+    # (see `persons.routers`); the handler runs routed there as well.
+    database = models.CharField(
+        max_length=100, default=DEFAULT_DB_ALIAS, editable=False
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=[
+            (QUEUED, "Queued"),
+            (RUNNING, "Running"),
+            (SUCCEEDED, "Succeeded"),
+            (FAILED, "Failed"),
+            (CANCELLED, "Cancelled"),
+        ],
+        default=QUEUED,
+    )
+    progress = models.FloatField(default=0)
+    message = models.CharField(max_length=200, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    cancel_requested = models.BooleanField(default=False)
+    created_by = models.ForeignKey(
+        User, models.SET_NULL, blank=True, null=True, related_name="jobs"
+    )
+    created_on = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    started_on = models.DateTimeField(null=True, blank=True)
+    # Renewed by the worker while the job runs; see `jobs.requeue_stale`.
+    heartbeat_on = models.DateTimeField(null=True, blank=True)
+    finished_on = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "run_after"], name="job_queue")]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+
+class PersonAncestry(models.Model):
+    """
+    Transitive closure of the parent links: one row per (ancestor,
+    descendant) pair, with the number of distinct paths between them.
+
+    Counting paths lets a removed parent link subtract exactly what it
+    contributed, so pairs still connected over another line of descent
+    (pedigree collapse) survive. Maintained by `persons.ancestry`.
+    """
+
+    ancestor = models.ForeignKey(
+        Person, models.CASCADE, related_name="descendant_links"
+    )
+    descendant = models.ForeignKey(
+        Person, models.CASCADE, related_name="ancestor_links"
+    )
+    paths = models.PositiveBigIntegerField(default=1)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["ancestor", "descendant"], name="unique_ancestry_pair"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.ancestor_id} -> {self.descendant_id} ({self.paths})"
+
+
+class PersonLineage(models.Model):
+    """
+    Denormalized counts for the tree cards and reports: the number of known
+    ancestors and descendants of a person, and how many generations they
+    span above and below it (0 without parents / children).
+
+    Updated along the affected ancestor and descendant paths whenever parent
+    links change or a person is deleted (see `persons.lineage`).
+    """
+
+    person = models.OneToOneField(
+        Person, models.CASCADE, primary_key=True, related_name="lineage"
+    )
+    ancestors = models.PositiveIntegerField(default=0)
+    descendants = models.PositiveIntegerField(default=0)
+    ancestor_generations = models.PositiveIntegerField(default=0)
+    descendant_generations = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return (
+            f"{self.person_id}: {self.ancestors} ancestors, "
+            f"{self.descendants} descendants"
+        )
+
+
+class ExternalId(models.Model):
+    """
+    The id of a person in an external archive, so records synced from there
+    map onto the same person on every run (see `persons.upsert`).
+    """
+
+    source = models.CharField(max_length=50)
+    external_id = models.CharField(max_length=100)
+    person = models.ForeignKey(Person, models.CASCADE, related_name="external_ids")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["source", "external_id"], name="unique_external_id"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.source}:{self.external_id} -> {self.person_id}"
+
+
+class PersonChange(models.Model):
+    """
+    One entry of the append-only history of a person.
+
+    Every save that changes a tracked field stores the changed values; every
+    HISTORY_SNAPSHOT_INTERVAL versions (and on creation) the entry also
+    holds the full state, so a past state is rebuilt from the nearest
+    snapshot plus the diffs after it. Written by `persons.history`.
+    """
+
+    CREATED = "created"
+    UPDATED = "updated"
+    DELETED = "deleted"
+
+    # The history outlives the person, so there is no database constraint.
+    person = models.ForeignKey(
+        Person, models.DO_NOTHING, db_constraint=False, related_name="changes"
+    )
+    version = models.PositiveIntegerField()
+    kind = models.CharField(
+        max_length=10,
+        choices=[(CREATED, "Created"), (UPDATED, "Updated"), (DELETED, "Deleted")],
+    )
+    changed_on = models.DateTimeField(default=timezone.now)
+    diff = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    snapshot = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    # The parents after the change, indexed to find the children of a person
+    # at a past date.
+    mother_id = models.IntegerField(null=True, blank=True, db_index=True)
+    father_id = models.IntegerField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["person", "version"], name="unique_person_version"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.person_id}@{self.version} ({self.kind})"
+
+
+def compute_ages(births, deaths, today=None) -> dict:
+    """
+    Column-wise Python counterpart of `PersonQuerySet.with_ages`.
+
+    Useful for bulk reports over rows that are already in memory (e.g. from
+    `values_list`), where another database round trip is not wanted.
+
+    Parameters:
+    -----------
+    births : sequence of datetime.date or None
+        Dates of birth.
+    deaths : sequence of datetime.date or None
+        Dates of death, aligned with `births`.
+    today : datetime.date, optional
+        Reference date for the age of living persons.
+
+    Returns:
+    --------
+    dict
+        Lists aligned with the input:
+        - age (living persons only)
+        - age_at_death
+        - lifespan_days
+    """
+    today = today or date.today()
+    today_key = (today.month, today.day)
+    ages, ages_at_death, lifespans = [], [], []
+    for birth, death in zip(births, deaths):
+        if birth is None:
+            ages.append(None)
+            ages_at_death.append(None)
+            lifespans.append(None)
+        elif death is None:
+            ages.append(
+                today.year - birth.year - (today_key < (birth.month, birth.day))
+            )
+            ages_at_death.append(None)
+            lifespans.append(None)
+        else:
+            ages.append(None)
+            ages_at_death.append(
+                death.year
+                - birth.year
+                - ((death.month, death.day) < (birth.month, birth.day))
+            )
+            lifespans.append((death - birth).days)
+    return {"age": ages, "age_at_death": ages_at_death, "lifespan_days": lifespans}
+
+
 def _time_difference(d) -> dict:
     """
     Calculate the precise difference between a given date/datetime and the current date/datetime.
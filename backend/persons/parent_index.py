@@ -0,0 +1,18 @@
+from bisect import bisect_left
+
+# Parent index stored for persons without a mother or father.
+NO_PARENT = -1
+
+
+def index_parents(ids, parents):
+    """
+    Replace parent ids by row indices in place, using a binary search over
+    the sorted ids instead of a dictionary of millions of entries. Parents
+    not among `ids` (or missing) become NO_PARENT.
+    """
+    for i, parent_id in enumerate(parents):
+        if parent_id:
+            j = bisect_left(ids, parent_id)
+            parents[i] = j if j < len(ids) and ids[j] == parent_id else NO_PARENT
+        else:
+            parents[i] = NO_PARENT
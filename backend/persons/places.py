@@ -0,0 +1,116 @@
+import math
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Person, Place
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance between two points, in kilometres (haversine).
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = (
+        math.sin(dphi / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def in_box(south, west, north, east):
+    """
+    Returns the places inside a bounding box.
+
+    The box is first mapped to the grid cells it covers, so the database
+    only reads the (cell_lat, cell_lon) index range, then refined on the
+    exact coordinates. Boxes crossing the antimeridian are not supported.
+    """
+    size = Place.GRID_DEGREES
+    return Place.objects.filter(
+        cell_lat__range=(math.floor(south / size), math.floor(north / size)),
+        cell_lon__range=(math.floor(west / size), math.floor(east / size)),
+        latitude__range=(south, north),
+        longitude__range=(west, east),
+    )
+
+
+def within(latitude, longitude, km):
+    """
+    Returns {place id: distance in km} for the places within `km` of a point.
+    """
+    dlat = km / KM_PER_DEGREE
+    dlon = min(km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 1e-6)), 180)
+    candidates = in_box(
+        max(latitude - dlat, -90),
+        max(longitude - dlon, -180),
+        min(latitude + dlat, 90),
+        min(longitude + dlon, 180),
+    ).values_list("pk", "latitude", "longitude")
+    matches = {}
+    for pk, lat, lon in candidates:
+        distance = distance_km(latitude, longitude, lat, lon)
+        if distance <= km:
+            matches[pk] = round(distance, 1)
+    return matches
+
+
+def persons_at(place_ids, event="any"):
+    """
+    Returns the persons born ("birth"), deceased ("death") or either
+    ("any") at one of the given places.
+    """
+    query = Q()
+    if event in ("birth", "any"):
+        query |= Q(birth_place__in=place_ids)
+    if event in ("death", "any"):
+        query |= Q(death_place__in=place_ids)
+    return Person.objects.filter(query)
+
+
+def normalize_persons(chunk_size=1000, progress=None):
+    """
+    Resolve the free-text places of persons that have no normalized place
+    yet, one chunk of persons per transaction. Resolved names are cached
+    for the run, so each distinct spelling costs at most one lookup.
+
+    `progress`, if given, is called with the fraction of pending persons
+    processed after every chunk.
+
+    Returns the number of persons updated.
+    """
+    pending = (
+        Person.objects.filter(
+            Q(birth_place__isnull=True) & ~Q(place_of_birth="")
+            | Q(death_place__isnull=True) & ~Q(place_of_death="")
+        )
+        .order_by("pk")
+        .only("pk", "place_of_birth", "place_of_death", "birth_place", "death_place")
+    )
+    total = pending.count() if progress else 0
+    resolved = {}
+
+    def _resolve(text):
+        if text not in resolved:
+            resolved[text] = Place.objects.resolve(text)
+        return resolved[text]
+
+    last_pk, updated = 0, 0
+    while True:
+        chunk = list(pending.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            return updated
+        for person in chunk:
+            person.birth_place = _resolve(person.place_of_birth)
+            person.death_place = _resolve(person.place_of_death)
+        with transaction.atomic():
+            Person.objects.bulk_update(chunk, ["birth_place", "death_place"])
+        updated += len(chunk)
+        last_pk = chunk[-1].pk
+        if progress:
+            progress(updated / total)
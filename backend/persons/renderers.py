@@ -0,0 +1,41 @@
+import datetime
+import decimal
+import uuid
+
+import msgpack
+from rest_framework.renderers import BaseRenderer
+
+
+def _encode(obj):
+    """
+    Converts the types msgpack does not know the same way DRF's JSON encoder
+    does, so both formats carry identical values.
+    """
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat().replace("+00:00", "Z")
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, datetime.timedelta):
+        return str(obj.total_seconds())
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    raise TypeError(f"Cannot serialize {type(obj).__name__} to MessagePack")
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Renders responses as MessagePack (`Accept: application/msgpack` or
+    `?format=msgpack`).
+    """
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, default=_encode, use_bin_type=True)
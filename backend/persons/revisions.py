@@ -0,0 +1,42 @@
+from django.db.models import F, Sum
+
+from .models import Revision
+
+# Bumped whenever the parent links or the birth dates of a person change.
+GRAPH = "graph"
+# Bumped whenever anything shown in the person list changes.
+PERSONS = "persons"
+
+# Counters are kept per family tree, so writers to different trees never
+# update the same row; persons without a tree share the counter of tree 0.
+
+
+def _row(name, tree):
+    return f"{name}:{tree or 0}"
+
+
+def current(name, tree=None):
+    """
+    Returns the current value of the named revision counter of one family
+    tree or, without `tree`, of the whole database: the sum of the counters
+    of every tree, which changes whenever any of them is bumped.
+    """
+    if tree is not None:
+        rows = Revision.objects.filter(name=_row(name, tree))
+        return rows.values_list("value", flat=True).first() or 0
+    rows = Revision.objects.filter(name__startswith=f"{name}:")
+    return rows.aggregate(total=Sum("value"))["total"] or 0
+
+
+def bump(name, *trees):
+    """
+    Increments the named revision counter of each given family tree id
+    (None for persons without a tree), creating it on first use.
+    """
+    for tree in set(trees) or {None}:
+        row = _row(name, tree)
+        if Revision.objects.filter(name=row).update(value=F("value") + 1):
+            continue
+        _, created = Revision.objects.get_or_create(name=row, defaults={"value": 1})
+        if not created:
+            Revision.objects.filter(name=row).update(value=F("value") + 1)
@@ -0,0 +1,111 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Database alias the person data of the current request or task lives in.
+_current = ContextVar("persons_database", default=None)
+
+# Models kept in the default database whatever the current tree.
+GLOBAL_MODELS = {"familytree", "job"}
+
+
+def enabled():
+    return "persons.routers.FamilyTreeRouter" in getattr(
+        settings, "DATABASE_ROUTERS", []
+    )
+
+
+def database_for(tree_id):
+    """
+    Returns the database alias of a family tree.
+
+    Trees are spread over the aliases in TREE_DATABASES by id, so a bucket
+    of trees shares one SQLite file or Postgres schema. Without the router
+    (or without a tree) everything lives in the default database.
+    """
+    aliases = getattr(settings, "TREE_DATABASES", [])
+    if not enabled() or not aliases or tree_id is None:
+        return DEFAULT_DB_ALIAS
+    return aliases[int(tree_id) % len(aliases)]
+
+
+def current():
+    """Returns the alias person data is currently routed to."""
+    return _current.get() or DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def use_database(alias):
+    """Route person data to `alias` inside the block."""
+    token = _current.set(alias)
+    try:
+        yield alias
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def use_tree(tree_id):
+    """Route person data to the database of the given tree inside the block."""
+    with use_database(database_for(tree_id)) as alias:
+        yield alias
+
+
+class FamilyTreeRouter:
+    """
+    Routes the person data (persons, places and every table derived from
+    them) to the database selected with `use_tree` / `use_database`, which
+    `TreeRoutingMiddleware` sets from the `?tree=` parameter of a request.
+
+    Family trees, jobs, users and sessions stay in the default database.
+    Every tree database carries the full schema (`migrate --database`), so
+    the foreign keys to users resolve; persons linked to a user account
+    need a copy of that user row there (see `mirror_user`).
+    """
+
+    def _route(self, model):
+        meta = model._meta
+        if meta.app_label != "persons" or meta.model_name in GLOBAL_MODELS:
+            return None
+        return _current.get()
+
+    def db_for_read(self, model, **hints):
+        return self._route(model)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        labels = {obj1._meta.app_label, obj2._meta.app_label}
+        if labels <= {"persons", "auth"}:
+            return True
+        return None
+
+
+def mirror_user(user, alias):
+    """
+    Make sure the tree database `alias` has a row for `user`, so persons
+    there can link to it. The copy only satisfies the foreign key: it has
+    no usable password, and logins always read the default database.
+    """
+    if alias == DEFAULT_DB_ALIAS:
+        return
+    model = type(user)
+    if model.objects.using(alias).filter(pk=user.pk).exists():
+        return
+    model.objects.using(alias).create(
+        pk=user.pk, username=user.username, password="!", is_active=False
+    )
+
+
+def mirror_tree(tree, alias):
+    """Copy a FamilyTree row into the tree database `alias`, if missing."""
+    if alias == DEFAULT_DB_ALIAS:
+        return
+    model = type(tree)
+    if not model.objects.using(alias).filter(pk=tree.pk).exists():
+        model.objects.using(alias).create(
+            pk=tree.pk, name=tree.name, owner_id=None, created_on=tree.created_on
+        )
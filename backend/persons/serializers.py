@@ -1,5 +1,7 @@
+from django.conf import settings
 from django.contrib.auth.models import User
-from persons.models import Person
+from persons import ancestry
+from persons.models import Job, Person, VersionConflict
 from rest_framework import serializers
 
 
@@ -16,6 +18,9 @@ class UserAccountSerializer(serializers.ModelSerializer):
 
 class PersonSerializer(serializers.ModelSerializer):
     user_account = UserAccountSerializer(required=False, allow_null=True)
+    # Read back as the current version; when written, the version the client
+    # edited, which an update must still match.
+    version = serializers.IntegerField(required=False, min_value=1)
 
     class Meta:
         model = Person
@@ -35,54 +40,242 @@ class PersonSerializer(serializers.ModelSerializer):
             "father",
             "gender",
             "user_account",
+            "tree",
+            "version",
         ]
+        read_only_fields = ["tree"]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Let the nested serializer know the linked user, so unchanged
+        # usernames do not trip the unique validator on update.
+        if isinstance(self.instance, Person) and self.instance.user_account_id:
+            self.fields["user_account"].instance = self.instance.user_account
+
+    def validate(self, attrs):
+        """
+        Reject parents from another family tree, and parents that would make
+        the person their own ancestor.
+
+        The tree of a new person is passed in the serializer context. New
+        persons cannot close a cycle; for existing ones the check is a single
+        lookup on the ancestry index.
+        """
+        tree_id = self.instance.tree_id if self.instance else self.context.get("tree")
+        parents = {
+            field: attrs[field]
+            for field in ("mother", "father")
+            if attrs.get(field) is not None
+        }
+        errors = {
+            field: "Parents must belong to the same family tree."
+            for field, parent in parents.items()
+            if parent.tree_id != tree_id
+        }
+        if errors:
+            raise serializers.ValidationError(errors)
+        if self.instance is None:
+            return attrs
+
+        cyclic = ancestry.cyclic_parents(
+            self.instance.pk, [parent.pk for parent in parents.values()]
+        )
+        errors = {
+            field: "A person cannot be their own ancestor."
+            for field, parent in parents.items()
+            if parent.pk in cyclic
+        }
+        if errors:
+            raise serializers.ValidationError(errors)
+        return attrs
 
     def create(self, validated_data):
         """Create a person with optional user account."""
         user_account_data = validated_data.pop("user_account", None)
+        validated_data.pop("version", None)
 
-        # Create the person instance
-        person = Person.objects.create(**validated_data)
-
-        # Create associated user account if provided
+        # Create the user account first, so the person is written only once
         if user_account_data:
-            password = user_account_data.pop("password", None)
-            user = User.objects.create(**user_account_data)
-            if password:
-                user.set_password(password)
-                user.save()
-            person.user_account = user
-            person.save()
+            validated_data["user_account"] = _create_user(user_account_data)
 
-        return person
+        return Person.objects.create(**validated_data)
 
     def update(self, instance, validated_data):
-        """Update a person and optionally their user account."""
+        """
+        Update a person and optionally their user account.
+
+        Only fields whose value actually changes are written, both for the
+        person and for the user account; a request that changes nothing
+        issues no UPDATE at all.
+
+        The version the client edited comes from the body or, as `If-Match`,
+        from the "version" context; a stale one raises VersionConflict before
+        anything is written, and the conditional UPDATE of `Person.save`
+        catches the edits that race with this one.
+        """
         user_account_data = validated_data.pop("user_account", None)
+        expected = validated_data.pop("version", self.context.get("version"))
+        if expected is not None and expected != instance.version:
+            raise VersionConflict(instance, expected)
 
-        # Update person fields
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
-        instance.save()
+        changed = _changed_fields(instance, validated_data)
+        for attr in changed:
+            setattr(instance, attr, validated_data[attr])
 
         # Update or create user account if provided
         if user_account_data is not None:
             if instance.user_account:
-                # Update existing user account
-                password = user_account_data.pop("password", None)
-                for attr, value in user_account_data.items():
-                    setattr(instance.user_account, attr, value)
-                if password:
-                    instance.user_account.set_password(password)
-                instance.user_account.save()
+                _update_user(instance.user_account, user_account_data)
             else:
-                # Create new user account
-                password = user_account_data.pop("password", None)
-                user = User.objects.create(**user_account_data)
-                if password:
-                    user.set_password(password)
-                    user.save()
-                instance.user_account = user
-                instance.save()
+                instance.user_account = _create_user(user_account_data)
+                changed.append("user_account")
+
+        if changed:
+            instance.save(update_fields=changed + ["modified_on"])
 
         return instance
+
+
+class PersonListSerializer(PersonSerializer):
+    """
+    Person list entries, including the ages annotated by
+    `PersonQuerySet.with_ages`.
+    """
+
+    age = serializers.IntegerField(read_only=True)
+    age_at_death = serializers.IntegerField(read_only=True)
+    lifespan_days = serializers.SerializerMethodField()
+
+    class Meta(PersonSerializer.Meta):
+        fields = PersonSerializer.Meta.fields + ["age", "age_at_death", "lifespan_days"]
+
+    def get_lifespan_days(self, obj):
+        lifespan = getattr(obj, "lifespan", None)
+        return lifespan.days if lifespan is not None else None
+
+
+class PersonRecordSerializer(serializers.ModelSerializer):
+    """
+    One record of a bulk upsert: person fields keyed by the id of the person
+    in the external source, with the parents given as ids of that source.
+    """
+
+    external_id = serializers.CharField(max_length=100)
+    mother = serializers.CharField(
+        max_length=100, required=False, allow_null=True, allow_blank=True
+    )
+    father = serializers.CharField(
+        max_length=100, required=False, allow_null=True, allow_blank=True
+    )
+
+    class Meta:
+        model = Person
+        fields = [
+            "external_id",
+            "first_name",
+            "middle_name",
+            "last_name",
+            "birth_name",
+            "artist_name",
+            "date_of_birth",
+            "place_of_birth",
+            "date_of_death",
+            "place_of_death",
+            "cause_of_death",
+            "gender",
+            "mother",
+            "father",
+        ]
+
+
+class PersonUpsertSerializer(serializers.Serializer):
+    source = serializers.CharField(max_length=50)
+    persons = PersonRecordSerializer(many=True)
+
+    def validate_persons(self, value):
+        if len(value) > settings.UPSERT_MAX_RECORDS:
+            raise serializers.ValidationError(
+                f"At most {settings.UPSERT_MAX_RECORDS} persons per request."
+            )
+        return value
+
+
+class PersonMergeSerializer(serializers.Serializer):
+    # Target person id -> conflicting fields (or "mother"/"father") to take
+    # from the source person.
+    prefer = serializers.DictField(
+        child=serializers.ListField(child=serializers.CharField()),
+        required=False,
+        default=dict,
+    )
+
+    def validate_prefer(self, value):
+        if not all(str(pk).isdigit() for pk in value):
+            raise serializers.ValidationError("Keys must be person ids.")
+        return {int(pk): fields for pk, fields in value.items()}
+
+
+def _changed_fields(instance, data):
+    """
+    Returns the names of the fields in `data` that differ from `instance`.
+    Relations are compared by primary key, without loading related rows.
+    """
+    changed = []
+    for attr, value in data.items():
+        field = instance._meta.get_field(attr)
+        if field.is_relation:
+            current = getattr(instance, field.attname)
+            value = value.pk if value is not None else None
+        else:
+            current = getattr(instance, attr)
+        if current != value:
+            changed.append(attr)
+    return changed
+
+
+def _create_user(data):
+    """Create a user account with a single INSERT."""
+    password = data.pop("password", None)
+    user = User(**data)
+    if password:
+        user.set_password(password)
+    user.save()
+    return user
+
+
+def _update_user(user, data):
+    """
+    Write the changed fields of a user account, if any. The password is only
+    hashed when a new one is given.
+    """
+    password = data.pop("password", None)
+    changed = _changed_fields(user, data)
+    for attr in changed:
+        setattr(user, attr, data[attr])
+    if password:
+        user.set_password(password)
+        changed.append("password")
+    if changed:
+        user.save(update_fields=changed)
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = [
+            "id",
+            "kind",
+            "payload",
+            "status",
+            "progress",
+            "message",
+            "result",
+            "error",
+            "attempts",
+            "max_attempts",
+            "cancel_requested",
+            "created_on",
+            "started_on",
+            "finished_on",
+        ]
+        read_only_fields = [f for f in fields if f not in ("kind", "payload")]
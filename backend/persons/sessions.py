@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.utils import timezone
+
+
+class LRUCache:
+    """
+    A small thread-safe least-recently-used cache whose entries also expire
+    after a number of seconds.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, deadline = entry
+            if deadline < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Encoded session data and expiry date by session key, for this process.
+sessions = LRUCache(getattr(settings, "SESSION_LRU_SIZE", 10000))
+
+
+class SessionStore(DBStore):
+    """
+    Database-backed sessions with a bounded per-process LRU in front.
+
+    Reading a session is served from memory while the entry is fresh; writes
+    go to the database and refresh the entry. As other processes cannot
+    evict it, an entry is trusted for at most SESSION_LRU_TIMEOUT seconds, so
+    a logout handled by another worker takes effect here after that delay.
+    """
+
+    def load(self):
+        key = self.session_key
+        cached = sessions.get(key) if key else None
+        if cached is not None:
+            session_data, expire_date = cached
+            if expire_date > timezone.now():
+                return self.decode(session_data)
+            sessions.pop(key)
+
+        s = self._get_session_from_db()
+        if s is None:
+            return {}
+        self._remember(s.session_data, s.expire_date)
+        return self.decode(s.session_data)
+
+    def create_model_instance(self, data):
+        obj = super().create_model_instance(data)
+        self._saved = obj
+        return obj
+
+    def save(self, must_create=False):
+        super().save(must_create=must_create)
+        saved = getattr(self, "_saved", None)
+        if saved is not None:
+            self._remember(saved.session_data, saved.expire_date)
+            self._saved = None
+
+    def delete(self, session_key=None):
+        key = session_key or self.session_key
+        super().delete(session_key)
+        if key:
+            sessions.pop(key)
+
+    def _remember(self, session_data, expire_date):
+        timeout = getattr(settings, "SESSION_LRU_TIMEOUT", 30)
+        sessions.set(self.session_key, (session_data, expire_date), timeout)
@@ -0,0 +1,118 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import (
+    accounts,
+    ancestry,
+    history,
+    intervals,
+    jobs,
+    lineage,
+    revisions,
+    routers,
+    stats,
+)
+from .models import FamilyTree, Person
+
+# Fields whose changes invalidate layouts and graph snapshots.
+GRAPH_FIELDS = ("mother_id", "father_id", "date_of_birth")
+
+
+def _loaded(instance):
+    """Returns the field values last loaded from or saved to the database."""
+    return getattr(instance, "_loaded_values", None)
+
+
+def _current(instance, fields):
+    return {field: getattr(instance, field) for field in fields}
+
+
+@receiver(pre_save, sender=Person)
+def person_saving(sender, instance, using, **kwargs):
+    # A tree database needs the user row for the user_account foreign key.
+    if instance.user_account_id and routers.enabled():
+        routers.mirror_user(instance.user_account, using)
+
+
+@receiver(post_save, sender=Person)
+def person_saved(sender, instance, created, **kwargs):
+    trees = {
+        instance.tree_id,
+        (_loaded(instance) or {}).get("tree_id", instance.tree_id),
+    }
+    revisions.bump(revisions.PERSONS, *trees)
+    accounts.forget(
+        instance.user_account_id, (_loaded(instance) or {}).get("user_account_id")
+    )
+    if created or instance.has_changed(*stats.FIELDS):
+        stats.record_change(_loaded(instance), _current(instance, stats.FIELDS))
+    if created or instance.has_changed(*intervals.FIELDS):
+        intervals.update_person(instance)
+    if created or instance.has_changed(*ancestry.FIELDS):
+        loaded = _loaded(instance) or {}
+        old_parents = [loaded.get(f) for f in ancestry.FIELDS]
+        if ancestry.defer(ancestry.relink_cost(instance, old_parents)):
+            jobs.submit_once(ancestry.REFRESH_JOB)
+        else:
+            ancestry.update_person(instance, old_parents)
+            lineage.update_person(instance, old_parents)
+    if created or instance.has_changed(*GRAPH_FIELDS):
+        revisions.bump(revisions.GRAPH, *trees)
+    history.record(instance, None if created else _loaded(instance))
+
+
+@receiver(pre_delete, sender=Person)
+def person_deleting(sender, instance, **kwargs):
+    # Children lose this parent through SET_NULL, which sends no signals.
+    instance._lineage_affected = None
+    if ancestry.defer(ancestry.removal_cost(instance)):
+        jobs.submit_once(ancestry.REFRESH_JOB)
+        return
+    ancestry.remove_person(instance)
+    instance._lineage_affected = lineage.affected(instance)
+
+
+@receiver(post_delete, sender=Person)
+def person_deleted(sender, instance, **kwargs):
+    revisions.bump(revisions.PERSONS, instance.tree_id)
+    accounts.forget(instance.user_account_id)
+    stats.record_change(_loaded(instance) or _current(instance, stats.FIELDS), None)
+    if instance._lineage_affected is not None:
+        lineage.refresh(*instance._lineage_affected)
+    revisions.bump(revisions.GRAPH, instance.tree_id)
+    history.record_delete(instance)
+
+
+@receiver(post_save, sender=FamilyTree)
+def tree_saved(sender, instance, created, **kwargs):
+    # Persons in a tree database reference the tree there.
+    if created and routers.enabled():
+        routers.mirror_tree(instance, routers.database_for(instance.pk))
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    # The person is unlinked before post_delete; remember its tree.
+    instance._person_trees = _person_trees(instance)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    accounts.forget(instance.pk)
+    # Logging in only touches last_login, which the person list does not show.
+    if update_fields is not None and set(update_fields) == {"last_login"}:
+        return
+    trees = getattr(instance, "_person_trees", None)
+    if trees is None:
+        trees = _person_trees(instance)
+    # Users without a person are not shown in the person list.
+    if trees:
+        revisions.bump(revisions.PERSONS, *trees)
+
+
+def _person_trees(user):
+    return set(
+        Person.objects.filter(user_account_id=user.pk).values_list("tree_id", flat=True)
+    )
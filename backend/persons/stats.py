@@ -0,0 +1,251 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce, ExtractYear
+
+from .models import Person, PersonSummary, compute_ages
+
+# Person fields the summaries depend on.
+FIELDS = (
+    "tree_id",
+    "gender",
+    "date_of_birth",
+    "date_of_death",
+    "place_of_birth",
+    "place_of_death",
+    "cause_of_death",
+)
+
+
+def _lifespan_bucket(age_at_death):
+    start = age_at_death // 10 * 10
+    return f"{start}-{start + 9}"
+
+
+def contributions(values):
+    """
+    Returns the summary rows a person with the given field values counts
+    towards, as (tree, dimension, bucket, gender) tuples.
+    """
+    if values is None:
+        return []
+    values = {
+        name: Person._meta.get_field(name).to_python(values.get(name))
+        for name in FIELDS
+    }
+    tree, gender = values["tree_id"] or 0, values["gender"]
+    rows = [(PersonSummary.TOTAL, "", gender)]
+    birth, death = values["date_of_birth"], values["date_of_death"]
+    if birth is not None:
+        rows.append((PersonSummary.BIRTH_DECADE, str(birth.year // 10 * 10), gender))
+        age_at_death = compute_ages([birth], [death])["age_at_death"][0]
+        if age_at_death is not None and age_at_death >= 0:
+            rows.append(
+                (PersonSummary.LIFESPAN, _lifespan_bucket(age_at_death), gender)
+            )
+    for dimension, field in (
+        (PersonSummary.PLACE_OF_BIRTH, "place_of_birth"),
+        (PersonSummary.PLACE_OF_DEATH, "place_of_death"),
+        (PersonSummary.CAUSE_OF_DEATH, "cause_of_death"),
+    ):
+        if values[field]:
+            rows.append((dimension, values[field], gender))
+    return [(tree, *row) for row in rows]
+
+
+def record_change(old, new):
+    """
+    Update the summaries for one person going from the field values `old`
+    to `new`. Either may be None for a created or deleted person. Only the
+    rows whose count actually changes are touched.
+    """
+    record_changes([(old, new)])
+
+
+def record_changes(changes):
+    """
+    Update the summaries for several (old, new) changes at once, as written
+    by a bulk operation. The deltas are summed first, so each summary row is
+    touched at most once however many persons count towards it.
+    """
+    delta = Counter()
+    for old, new in changes:
+        delta.update(contributions(new))
+        delta.subtract(contributions(old))
+    for (tree, dimension, bucket, gender), change in delta.items():
+        if change == 0:
+            continue
+        rows = PersonSummary.objects.filter(
+            tree=tree, dimension=dimension, bucket=bucket, gender=gender
+        )
+        if not rows.update(count=F("count") + change):
+            _, created = PersonSummary.objects.get_or_create(
+                tree=tree,
+                dimension=dimension,
+                bucket=bucket,
+                gender=gender,
+                defaults={"count": change},
+            )
+            if not created:
+                rows.update(count=F("count") + change)
+
+
+def summary(top=10, tree=None):
+    """
+    Returns the dashboard statistics read from the summary table: of one
+    family tree (0 for the persons without a tree), or of the whole
+    database, summed over the trees, without `tree`.
+    """
+    rows = PersonSummary.objects.filter(count__gt=0)
+    if tree is not None:
+        rows = rows.filter(tree=tree)
+
+    persons, decades, lifespans = {}, {}, {}
+    for dimension, bucket, gender, count in (
+        rows.filter(
+            dimension__in=[
+                PersonSummary.TOTAL,
+                PersonSummary.BIRTH_DECADE,
+                PersonSummary.LIFESPAN,
+            ]
+        )
+        .values_list("dimension", "bucket", "gender")
+        .annotate(total=Sum("count"))
+        .order_by()
+    ):
+        if dimension == PersonSummary.TOTAL:
+            persons[gender] = count
+        elif dimension == PersonSummary.BIRTH_DECADE:
+            decades.setdefault(bucket, {})[gender] = count
+        else:
+            lifespans.setdefault(gender, {})[bucket] = count
+
+    def _top(dimension):
+        return [
+            {"name": bucket, "count": total}
+            for bucket, total in rows.filter(dimension=dimension)
+            .values("bucket")
+            .annotate(total=Sum("count"))
+            .order_by("-total", "bucket")
+            .values_list("bucket", "total")[:top]
+        ]
+
+    return _format(persons, decades, lifespans, _top)
+
+
+def _format(persons, decades, lifespans, top):
+    return {
+        "persons": persons,
+        "birth_decades": dict(sorted(decades.items(), key=lambda i: int(i[0]))),
+        "lifespan": {
+            gender: dict(sorted(buckets.items(), key=lambda i: int(i[0].split("-")[0])))
+            for gender, buckets in lifespans.items()
+        },
+        "top_places_of_birth": top(PersonSummary.PLACE_OF_BIRTH),
+        "top_places_of_death": top(PersonSummary.PLACE_OF_DEATH),
+        "top_causes_of_death": top(PersonSummary.CAUSE_OF_DEATH),
+    }
+
+
+def expected_counts(persons=None):
+    """
+    Compute every summary row from scratch with GROUP BY queries over
+    `persons` (all persons by default), keyed by (tree, dimension, bucket,
+    gender). This is what the summary table avoids on every dashboard load;
+    it is used to rebuild and to check the table.
+    """
+    if persons is None:
+        persons = Person.objects.all()
+    persons = persons.annotate(summary_tree=Coalesce("tree_id", 0))
+    counts = Counter()
+    for tree, gender, count in persons.values_list("summary_tree", "gender").annotate(
+        n=Count("id")
+    ):
+        counts[(tree, PersonSummary.TOTAL, "", gender)] = count
+
+    # Group by year and age in SQL and bucket the (few) groups in Python, so
+    # the result does not depend on how each backend divides integers.
+    years = (
+        persons.filter(date_of_birth__isnull=False)
+        .annotate(year=ExtractYear("date_of_birth"))
+        .values_list("summary_tree", "year", "gender")
+        .annotate(n=Count("id"))
+    )
+    for tree, year, gender, count in years:
+        decade = str(int(year) // 10 * 10)
+        counts[(tree, PersonSummary.BIRTH_DECADE, decade, gender)] += count
+
+    ages = (
+        persons.with_ages()
+        .filter(age_at_death__gte=0)
+        .values_list("summary_tree", "age_at_death", "gender")
+        .annotate(n=Count("id"))
+    )
+    for tree, age_at_death, gender, count in ages:
+        bucket = _lifespan_bucket(int(age_at_death))
+        counts[(tree, PersonSummary.LIFESPAN, bucket, gender)] += count
+
+    for dimension, field in (
+        (PersonSummary.PLACE_OF_BIRTH, "place_of_birth"),
+        (PersonSummary.PLACE_OF_DEATH, "place_of_death"),
+        (PersonSummary.CAUSE_OF_DEATH, "cause_of_death"),
+    ):
+        rows = (
+            persons.exclude(**{field: ""})
+            .values_list("summary_tree", field, "gender")
+            .annotate(n=Count("id"))
+        )
+        for tree, bucket, gender, count in rows:
+            counts[(tree, dimension, bucket, gender)] = count
+    return counts
+
+
+def _stored(tree=None):
+    rows = PersonSummary.objects.all()
+    if tree is not None:
+        rows = rows.filter(tree=tree)
+    return rows
+
+
+def check(tree=None):
+    """
+    Compare the summary table with a full recomputation, of all trees or
+    of one (0 for the persons without a tree).
+
+    Returns:
+    --------
+    list
+        (tree, dimension, bucket, gender, stored count, expected count) for
+        every row that differs; empty when the table is consistent.
+    """
+    persons = None if tree is None else Person.objects.for_tree(tree)
+    expected = expected_counts(persons)
+    stored = {
+        tuple(key): count
+        for *key, count in _stored(tree).values_list(
+            "tree", "dimension", "bucket", "gender", "count"
+        )
+    }
+    return [
+        (*key, stored.get(key, 0), expected.get(key, 0))
+        for key in sorted(set(expected) | set(stored))
+        if stored.get(key, 0) != expected.get(key, 0)
+    ]
+
+
+@transaction.atomic
+def rebuild(tree=None):
+    """
+    Replace the summary table, or the rows of one family tree, with a full
+    recomputation.
+    """
+    counts = expected_counts(None if tree is None else Person.objects.for_tree(tree))
+    _stored(tree).delete()
+    PersonSummary.objects.bulk_create(
+        PersonSummary(
+            tree=key[0], dimension=key[1], bucket=key[2], gender=key[3], count=count
+        )
+        for key, count in counts.items()
+    )
+    return len(counts)
@@ -1,8 +1,46 @@
-from datetime import date
+import gzip
+import io
+import json
+import mmap
+import tempfile
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, timedelta
+from unittest import mock
 
+import brotli
+import msgpack
 from dateutil.relativedelta import relativedelta
-from django.test import TestCase
-from persons.models import Person
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from persons import ancestry, consistency, history, intervals, jobs, lineage, merge
+from persons import middleware as persons_middleware
+from persons import routers
+from persons import stats as person_stats
+from persons import upsert
+from persons.graph import read_snapshot, snapshot_path
+from persons.layout import X_SPACING, tree_layout
+from persons.models import (
+    ExternalId,
+    FamilyTree,
+    Job,
+    LifeSpanBucket,
+    Person,
+    PersonAncestry,
+    PersonChange,
+    PersonLineage,
+    PersonSummary,
+    Revision,
+    VersionConflict,
+    compute_ages,
+)
+from persons.serializers import PersonSerializer
 from rest_framework import status
 from rest_framework.test import APIClient
 
@@ -248,6 +286,2252 @@ class PersonAPITestCase(TestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
+class PersonAgeTestCase(TestCase):
+    """Test cases for database-side age and lifespan computation."""
+
+    def setUp(self):
+        """Set up living, deceased and undated persons."""
+        self.client = APIClient()
+        self.today = date(2024, 6, 15)
+        self.young = Person.objects.create(
+            first_name="Young", gender="F", date_of_birth=date(2000, 6, 16)
+        )
+        self.old = Person.objects.create(
+            first_name="Old", gender="M", date_of_birth=date(1950, 6, 15)
+        )
+        self.deceased = Person.objects.create(
+            first_name="Deceased",
+            gender="F",
+            date_of_birth=date(1900, 3, 10),
+            date_of_death=date(1980, 3, 9),
+        )
+        self.undated = Person.objects.create(first_name="Undated", gender="U")
+
+    def test_with_ages_matches_python(self):
+        """Test SQL annotations agree with compute_ages()."""
+        persons = list(Person.objects.with_ages(self.today).order_by("id"))
+        expected = compute_ages(
+            [p.date_of_birth for p in persons],
+            [p.date_of_death for p in persons],
+            today=self.today,
+        )
+        self.assertEqual([p.age for p in persons], expected["age"])
+        self.assertEqual([p.age_at_death for p in persons], expected["age_at_death"])
+        self.assertEqual(
+            [p.lifespan.days if p.lifespan else None for p in persons],
+            expected["lifespan_days"],
+        )
+        self.assertEqual(expected["age"], [23, 74, None, None])
+        self.assertEqual(expected["age_at_death"], [None, None, 79, None])
+
+    def test_list_orders_by_age(self):
+        """Test the list can be ordered by age, unknown ages last."""
+        response = self.client.get("/api/person/?ordering=-age")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [p["id"] for p in response.data][:2], [self.old.id, self.young.id]
+        )
+        self.assertIsNone(response.data[-1]["age"])
+
+    def test_list_filters_by_age(self):
+        """Test the age and lifespan filters of the list."""
+        response = self.client.get("/api/person/?min_age=50")
+        self.assertEqual([p["id"] for p in response.data], [self.old.id])
+        response = self.client.get("/api/person/?min_lifespan_days=10000")
+        self.assertEqual([p["id"] for p in response.data], [self.deceased.id])
+        self.assertEqual(response.data[0]["age_at_death"], 79)
+
+    def test_list_rejects_unknown_ordering(self):
+        """Test ordering by a field outside the allow-list is rejected."""
+        response = self.client.get("/api/person/?ordering=cause_of_death")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PersonListFilterTestCase(TestCase):
+    """Test cases for the filter and sort syntax of the person list."""
+
+    def setUp(self):
+        """Set up two generations of the Schmidt family and a stranger."""
+        self.client = APIClient()
+        self.anna = Person.objects.create(
+            first_name="Anna",
+            last_name="Schmidt",
+            gender="F",
+            date_of_birth=date(1900, 5, 1),
+        )
+        self.berta = Person.objects.create(
+            first_name="Berta",
+            last_name="Schneider",
+            gender="F",
+            date_of_birth=date(1931, 2, 3),
+            mother=self.anna,
+        )
+        self.carl = Person.objects.create(
+            first_name="Carl",
+            last_name="Schmidt",
+            gender="M",
+            date_of_birth=date(1928, 7, 9),
+            mother=self.anna,
+        )
+        self.dora = Person.objects.create(
+            first_name="Dora",
+            last_name="Meyer",
+            gender="F",
+            date_of_birth=date(1935, 1, 1),
+            mother=self.berta,
+        )
+
+    def _ids(self, query):
+        response = self.client.get(f"/api/person/?{query}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return [p["id"] for p in response.data]
+
+    def test_combined_filters(self):
+        """Test the filters are combined and compile to the indexed lookups."""
+        self.assertEqual(
+            self._ids(
+                "gender=F&born_after=1900&last_name__prefix=sch"
+                "&has_children=true&ordering=-date_of_birth"
+            ),
+            [self.berta.id],
+        )
+        self.assertEqual(
+            self._ids("has_children=false&ordering=first_name"),
+            [self.carl.id, self.dora.id],
+        )
+        self.assertEqual(
+            self._ids("mother__in=%d,%d" % (self.anna.id, self.berta.id)),
+            [self.berta.id, self.carl.id, self.dora.id],
+        )
+        self.assertEqual(self._ids("mother__isnull=true"), [self.anna.id])
+
+    def test_years_compare_as_all_their_days(self):
+        """Test a year stands for all its days, whatever the operator."""
+        self.assertEqual(self._ids("date_of_birth=1900"), [self.anna.id])
+        self.assertEqual(self._ids("born_before=1931"), [self.anna.id, self.carl.id])
+        self.assertEqual(
+            self._ids("date_of_birth__lte=1931"),
+            [self.anna.id, self.berta.id, self.carl.id],
+        )
+        self.assertEqual(self._ids("date_of_birth=1931-02-03"), [self.berta.id])
+
+    def test_ordering_by_several_fields(self):
+        """Test comma-separated orderings, including the lineage counts."""
+        self.assertEqual(
+            self._ids("ordering=last_name,-first_name"),
+            [self.dora.id, self.carl.id, self.anna.id, self.berta.id],
+        )
+        self.assertEqual(
+            self._ids("ordering=-descendants")[:2], [self.anna.id, self.berta.id]
+        )
+        self.assertEqual(self._ids("descendants__gte=1"), [self.anna.id, self.berta.id])
+
+    def test_invalid_filters_are_rejected(self):
+        """Test unknown fields, operators and values answer 400."""
+        for query, error in (
+            ("nickname=x", "Unknown filter 'nickname'"),
+            ("cause_of_death=x", "Unknown filter 'cause_of_death'"),
+            ("gender__prefix=F", "'gender' cannot be filtered with 'prefix'"),
+            ("gender=X", "'gender' must be one of M, F, N, U"),
+            ("born_after=soon", "'born_after' must be a date (YYYY-MM-DD) or a year"),
+            ("has_children=maybe", "'has_children' must be true or false"),
+            ("lifespan_days__gt=1000000000", "'lifespan_days__gt' is out of range"),
+            ("ordering=-gender", "Cannot order by 'gender'"),
+        ):
+            response = self.client.get(f"/api/person/?{query}")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data["error"], error)
+
+    def test_explain_is_staff_only(self):
+        """Test staff get the query plan instead of the list."""
+        query = "/api/person/?gender=F&born_after=1900&explain=1"
+        response = self.client.get(query)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(
+            User.objects.create_user(username="admin", is_staff=True)
+        )
+        response = self.client.get(query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("date_of_birth", response.data["query"])
+        self.assertTrue(response.data["plan"])
+
+
+class PersonStatsTestCase(TestCase):
+    """Test cases for the incrementally maintained statistics."""
+
+    def setUp(self):
+        """Set up a few persons with places and dates."""
+        self.client = APIClient()
+        self.anna = Person.objects.create(
+            first_name="Anna",
+            gender="F",
+            date_of_birth=date(1901, 2, 1),
+            date_of_death=date(1975, 1, 1),
+            place_of_birth="Leipzig",
+            cause_of_death="Influenza",
+        )
+        self.bert = Person.objects.create(
+            first_name="Bert",
+            gender="M",
+            date_of_birth=date(1905, 5, 5),
+            place_of_birth="Leipzig",
+        )
+        self.carl = Person.objects.create(
+            first_name="Carl", gender="M", place_of_birth="Dresden"
+        )
+
+    def test_stats_endpoint(self):
+        """Test GET /api/person/stats/ returns the aggregated numbers."""
+        response = self.client.get("/api/person/stats/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["persons"], {"F": 1, "M": 2})
+        self.assertEqual(response.data["birth_decades"], {"1900": {"F": 1, "M": 1}})
+        self.assertEqual(response.data["lifespan"], {"F": {"70-79": 1}})
+        self.assertEqual(
+            response.data["top_places_of_birth"],
+            [{"name": "Leipzig", "count": 2}, {"name": "Dresden", "count": 1}],
+        )
+        self.assertEqual(
+            response.data["top_causes_of_death"], [{"name": "Influenza", "count": 1}]
+        )
+
+    def test_summaries_follow_updates_and_deletes(self):
+        """Test saves and deletes keep the summaries consistent."""
+        self.client.patch(
+            f"/api/person/{self.bert.id}/",
+            {"place_of_birth": "Dresden", "date_of_death": "1990-01-01"},
+            format="json",
+        )
+        self.carl.delete()
+        self.assertEqual(person_stats.check(), [])
+        summary = person_stats.summary()
+        self.assertEqual(summary["persons"], {"F": 1, "M": 1})
+        self.assertEqual(summary["lifespan"]["M"], {"80-89": 1})
+
+    def test_summaries_follow_saves_after_refresh(self):
+        """Test a refreshed copy compares against the reloaded values."""
+        other = Person.objects.get(pk=self.carl.id)
+        other.gender = "F"
+        other.save()
+        self.carl.refresh_from_db()
+        self.carl.gender = "M"
+        self.carl.save()
+        self.assertEqual(person_stats.check(), [])
+        self.assertFalse(self.carl.has_changed("gender"))
+
+    def test_rebuild_and_check_commands(self):
+        """Test the rebuild command repairs an inconsistent table."""
+        PersonSummary.objects.filter(dimension=PersonSummary.TOTAL).delete()
+        with self.assertRaises(CommandError):
+            call_command("rebuild_person_stats", "--check", stdout=io.StringIO())
+        call_command("rebuild_person_stats", stdout=io.StringIO())
+        self.assertEqual(person_stats.check(), [])
+
+
+class PersonLifespanIntervalTestCase(TestCase):
+    """Test cases for alive-on-date and contemporaries queries."""
+
+    def setUp(self):
+        """Set up persons with known, estimated and unknown lifespans."""
+        self.client = APIClient()
+        self.known = Person.objects.create(
+            first_name="Known",
+            gender="F",
+            date_of_birth=date(1820, 5, 1),
+            date_of_death=date(1850, 1, 1),
+        )
+        self.estimated = Person.objects.create(
+            first_name="Estimated", gender="M", date_of_birth=date(1790, 1, 1)
+        )
+        self.later = Person.objects.create(
+            first_name="Later", gender="M", date_of_birth=date(1860, 1, 1)
+        )
+        self.undated = Person.objects.create(first_name="Undated", gender="U")
+
+    def test_alive_on(self):
+        """Test who was alive on a date, including estimated lifespans."""
+        response = self.client.get("/api/person/alive/?on=1848-06-01")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [p["id"] for p in response.data["persons"]]
+        self.assertEqual(ids, [self.known.id, self.estimated.id])
+        self.assertEqual(response.data["estimated"], [self.estimated.id])
+
+    def test_alive_on_follows_updates(self):
+        """Test the index is updated when dates change."""
+        self.estimated.date_of_death = date(1840, 1, 1)
+        self.estimated.save()
+        self.assertEqual(
+            dict(
+                intervals.alive_on(date(1848, 6, 1)).values_list(
+                    "pk", "lifespan_estimated"
+                )
+            ),
+            {self.known.id: False},
+        )
+        self.assertEqual(intervals.rebuild(), LifeSpanBucket.objects.count())
+
+    def test_estimates_are_clamped(self):
+        """Test lifespans estimated past the representable dates are cut off."""
+        early = Person.objects.create(first_name="Early", date_of_death=date(50, 1, 1))
+        late = Person.objects.create(first_name="Late", date_of_birth=date(9950, 1, 1))
+        self.assertEqual(
+            intervals.lifespan(None, early.date_of_death),
+            (date.min, date(50, 1, 1), True),
+        )
+        self.assertEqual(
+            intervals.lifespan(late.date_of_birth, None),
+            (date(9950, 1, 1), date.max, True),
+        )
+
+    def test_alive_on_pages_within_tree(self):
+        """Test the matches are scoped to the tree and paginated by id."""
+        owner = User.objects.create_user(username="owner")
+        self.client.force_login(owner)
+        tree = FamilyTree.objects.create(name="Tree", owner=owner)
+        in_tree = [
+            Person.objects.create(date_of_birth=date(1840, 1, 1), tree=tree)
+            for _ in range(3)
+        ]
+        url = f"/api/person/alive/?on=1848-06-01&tree={tree.pk}&limit=2"
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        scans = [q["sql"] for q in queries if "persons_person" in q["sql"]]
+        self.assertEqual(len(scans), 1)
+        self.assertIn("persons_lifespanbucket", scans[0])
+        self.assertEqual(
+            [p["id"] for p in response.data["persons"]],
+            [p.pk for p in in_tree[:2]],
+        )
+        self.assertEqual(response.data["next"], in_tree[1].pk)
+        response = self.client.get(f"{url}&after={response.data['next']}")
+        self.assertEqual([p["id"] for p in response.data["persons"]], [in_tree[2].pk])
+        self.assertIsNone(response.data["next"])
+        response = self.client.get(f"{url}&after=x")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_contemporaries(self):
+        """Test contemporaries are persons with overlapping lifespans."""
+        response = self.client.get(f"/api/person/{self.known.id}/contemporaries/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [p["id"] for p in response.data["persons"]], [self.estimated.id]
+        )
+
+    def test_invalid_requests(self):
+        """Test missing dates are rejected."""
+        response = self.client.get("/api/person/alive/?on=yesterday")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(f"/api/person/{self.undated.id}/contemporaries/")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PlaceTestCase(TestCase):
+    """Test cases for place normalization and spatial queries."""
+
+    def setUp(self):
+        """Set up persons born in and around Leipzig."""
+        self.client = APIClient()
+        self.leipzig = Person.objects.create(
+            first_name="Leipziger", gender="F", place_of_birth="Leipzig, Sachsen"
+        )
+        self.halle = Person.objects.create(
+            first_name="Hallenser", gender="M", place_of_birth="Halle (Saale)"
+        )
+        self.berlin = Person.objects.create(
+            first_name="Berliner",
+            gender="M",
+            place_of_birth="Berlin",
+            place_of_death=" leipzig ",
+        )
+
+    def test_places_are_resolved_and_deduplicated(self):
+        """Test spellings of one gazetteer entry share a Place."""
+        self.assertEqual(self.leipzig.birth_place, self.berlin.death_place)
+        self.assertEqual(self.leipzig.birth_place.name, "Leipzig")
+        self.assertAlmostEqual(self.leipzig.birth_place.latitude, 51.3397)
+        unknown = Person.objects.create(first_name="X", place_of_birth="Nowhere Town")
+        self.assertIsNone(unknown.birth_place.latitude)
+
+    def test_places_follow_partial_updates(self):
+        """Test a PATCH of the free text updates the normalized place."""
+        self.client.patch(
+            f"/api/person/{self.halle.id}/",
+            {"place_of_birth": "Dresden"},
+            format="json",
+        )
+        self.halle.refresh_from_db()
+        self.assertEqual(self.halle.birth_place.name, "Dresden")
+
+    def test_persons_near_place(self):
+        """Test the radius query around Leipzig."""
+        response = self.client.get("/api/person/near/?place=Leipzig&km=50&event=birth")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [p["id"] for p in response.data["persons"]],
+            [self.leipzig.id, self.halle.id],
+        )
+        distances = {p["name"]: p["distance_km"] for p in response.data["places"]}
+        self.assertAlmostEqual(distances["Halle (Saale), DE"], 32, delta=3)
+
+        response = self.client.get("/api/person/near/?lat=51.34&lon=12.37&km=5")
+        self.assertEqual(
+            [p["id"] for p in response.data["persons"]],
+            [self.leipzig.id, self.berlin.id],
+        )
+
+    def test_persons_in_bounding_box(self):
+        """Test the bounding box query."""
+        response = self.client.get("/api/person/near/?bbox=52,13,53,14")
+        self.assertEqual([p["id"] for p in response.data["persons"]], [self.berlin.id])
+
+    def test_normalize_places_command(self):
+        """Test the batch command resolves rows written without save()."""
+        Person.objects.filter(pk=self.halle.pk).update(birth_place=None)
+        call_command("normalize_places", "--chunk-size", "1", stdout=io.StringIO())
+        self.halle.refresh_from_db()
+        self.assertEqual(self.halle.birth_place.name, "Halle (Saale)")
+
+
+class PersonPartialUpdateTestCase(TestCase):
+    """Test cases for PATCH and the field-level write path."""
+
+    def setUp(self):
+        """Set up a person with a linked user account."""
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username="linked", email="linked@example.com", password="secret-pass"
+        )
+        self.person = Person.objects.create(
+            first_name="Linked",
+            last_name="Person",
+            gender="F",
+            user_account=self.user,
+        )
+
+    def _updates(self, queries):
+        """Return the UPDATE statements on the person and user tables."""
+        return [
+            q["sql"]
+            for q in queries
+            if q["sql"].startswith(('UPDATE "persons_person"', 'UPDATE "auth_user"'))
+        ]
+
+    def test_patch_updates_single_field(self):
+        """Test PATCH writes only the changed column."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                f"/api/person/{self.person.id}/",
+                {"last_name": "Patched"},
+                format="json",
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["first_name"], "Linked")
+        updates = self._updates(queries.captured_queries)
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"last_name"', updates[0])
+        self.assertNotIn('"first_name"', updates[0])
+        self.person.refresh_from_db()
+        self.assertEqual(self.person.last_name, "Patched")
+
+    def test_unchanged_update_writes_nothing(self):
+        """Test a PUT with unchanged data, including the user, issues no UPDATE."""
+        data = {
+            "first_name": "Linked",
+            "last_name": "Person",
+            "gender": "F",
+            "user_account": {"username": "linked", "email": "linked@example.com"},
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(
+                f"/api/person/{self.person.id}/", data, format="json"
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._updates(queries.captured_queries), [])
+
+    def test_user_change_does_not_rehash_password(self):
+        """Test changing the e-mail keeps the stored password hash."""
+        password = self.user.password
+        response = self.client.patch(
+            f"/api/person/{self.person.id}/",
+            {"user_account": {"email": "new@example.com"}},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.email, "new@example.com")
+        self.assertEqual(self.user.password, password)
+
+    def test_patch_not_found(self):
+        """Test PATCH request for non-existent person."""
+        response = self.client.patch("/api/person/9999/", {}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PersonNeighborhoodAPITestCase(TestCase):
+    """Test cases for the neighborhood endpoint."""
+
+    def setUp(self):
+        """Set up a three-generation family around a focal person."""
+        self.client = APIClient()
+        self.grandmother = Person.objects.create(first_name="Grandmother", gender="F")
+        self.grandfather = Person.objects.create(first_name="Grandfather", gender="M")
+        self.mother = Person.objects.create(
+            first_name="Mother",
+            gender="F",
+            mother=self.grandmother,
+            father=self.grandfather,
+        )
+        self.father = Person.objects.create(first_name="Father", gender="M")
+        self.focal = Person.objects.create(
+            first_name="Focal", gender="F", mother=self.mother, father=self.father
+        )
+        self.half_sibling = Person.objects.create(
+            first_name="HalfSibling", gender="M", mother=self.mother
+        )
+        self.spouse = Person.objects.create(first_name="Spouse", gender="M")
+        self.child = Person.objects.create(
+            first_name="Child", gender="U", mother=self.focal, father=self.spouse
+        )
+        self.grandchild = Person.objects.create(
+            first_name="Grandchild", gender="U", mother=self.child
+        )
+        self.unrelated = Person.objects.create(first_name="Unrelated", gender="U")
+
+    def test_neighborhood_collects_window(self):
+        """Test the window contains ancestors, descendants, siblings and spouses."""
+        response = self.client.get(f"/api/person/{self.focal.id}/neighborhood/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            set(response.data["ancestors"]),
+            {self.mother.id, self.father.id, self.grandmother.id, self.grandfather.id},
+        )
+        self.assertEqual(
+            set(response.data["descendants"]), {self.child.id, self.grandchild.id}
+        )
+        self.assertEqual(response.data["siblings"], [self.half_sibling.id])
+        self.assertEqual(response.data["spouses"], [self.spouse.id])
+        ids = [person["id"] for person in response.data["persons"]]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertNotIn(self.unrelated.id, ids)
+        self.assertEqual(response.data["generation"][self.grandmother.id], -2)
+
+    def test_neighborhood_respects_bounds(self):
+        """Test up/down/siblings parameters limit the window."""
+        response = self.client.get(
+            f"/api/person/{self.focal.id}/neighborhood/?up=1&down=1&siblings=false"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            set(response.data["ancestors"]), {self.mother.id, self.father.id}
+        )
+        self.assertEqual(response.data["descendants"], [self.child.id])
+        self.assertEqual(response.data["siblings"], [])
+
+    def test_neighborhood_query_count_is_bounded(self):
+        """Test the number of queries depends on the depth only."""
+        from persons.traversal import neighborhood
+
+        with self.assertNumQueries(6):
+            neighborhood(self.focal, up=3, down=2, siblings=True)
+
+    def test_neighborhood_invalid_parameter(self):
+        """Test an invalid depth is rejected."""
+        response = self.client.get(f"/api/person/{self.focal.id}/neighborhood/?up=x")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_neighborhood_not_found(self):
+        """Test the neighborhood of a non-existent person."""
+        response = self.client.get("/api/person/9999/neighborhood/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PersonLayoutTestCase(TestCase):
+    """Test cases for the server-side tree layout."""
+
+    def setUp(self):
+        """Set up parents with two children and clear cached layouts."""
+        cache.clear()
+        self.client = APIClient()
+        self.mother = Person.objects.create(first_name="Mother", gender="F")
+        self.father = Person.objects.create(first_name="Father", gender="M")
+        self.older = Person.objects.create(
+            first_name="Older",
+            gender="F",
+            date_of_birth=date(1990, 1, 1),
+            mother=self.mother,
+            father=self.father,
+        )
+        self.younger = Person.objects.create(
+            first_name="Younger",
+            gender="M",
+            date_of_birth=date(1995, 1, 1),
+            mother=self.mother,
+            father=self.father,
+        )
+
+    def test_layout_places_generations_and_edges(self):
+        """Test parents are drawn above children and cards do not overlap."""
+        response = self.client.get(f"/api/person/{self.older.id}/layout/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        nodes = {node["id"]: node for node in response.data["nodes"]}
+        self.assertEqual(len(nodes), 4)
+        self.assertLess(nodes[self.mother.id]["y"], nodes[self.older.id]["y"])
+        self.assertEqual(nodes[self.older.id]["y"], nodes[self.younger.id]["y"])
+        self.assertGreaterEqual(
+            nodes[self.younger.id]["x"] - nodes[self.older.id]["x"], X_SPACING
+        )
+        self.assertEqual(len(response.data["edges"]), 4)
+
+    def test_layout_is_cached_until_parents_change(self):
+        """Test cached layouts are reused and invalidated by parent changes."""
+        first = tree_layout(self.older)
+        with self.assertNumQueries(1):
+            self.assertEqual(tree_layout(self.older), first)
+
+        self.younger.father = None
+        self.younger.save()
+        second = tree_layout(self.older)
+        self.assertGreater(second["version"], first["version"])
+        self.assertEqual(len(second["edges"]), 3)
+
+    def test_layout_ignores_unrelated_changes(self):
+        """Test edits that do not touch the graph keep the cached layout."""
+        version = tree_layout(self.older)["version"]
+        self.younger.first_name = "Renamed"
+        self.younger.save()
+        self.assertEqual(tree_layout(self.older)["version"], version)
+
+    def test_layout_ignores_other_trees(self):
+        """Test graph edits in another family tree keep the cached layout."""
+        tree = FamilyTree.objects.create(name="Other")
+        first = tree_layout(self.older)
+        parent = Person.objects.create(first_name="Parent", tree=tree)
+        Person.objects.create(first_name="Child", mother=parent, tree=tree)
+        with self.assertNumQueries(1):
+            self.assertEqual(tree_layout(self.older), first)
+        self.assertEqual(Revision.objects.get(name=f"graph:{tree.pk}").value, 2)
+
+
+class PersonGraphSnapshotTestCase(TestCase):
+    """Test cases for the binary graph snapshot."""
+
+    def setUp(self):
+        """Set up a small family and a temporary snapshot directory."""
+        self.client = APIClient()
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(
+            GRAPH_SNAPSHOT_DIR=self.directory.name
+        )
+        self.settings_override.enable()
+        self.mother = Person.objects.create(
+            first_name="Mother", gender="F", date_of_birth=date(1960, 3, 1)
+        )
+        self.father = Person.objects.create(first_name="Father", gender="M")
+        self.child = Person.objects.create(
+            first_name="Child", gender="U", mother=self.mother, father=self.father
+        )
+
+    def tearDown(self):
+        """Remove the temporary snapshot directory."""
+        self.settings_override.disable()
+        self.directory.cleanup()
+
+    def test_snapshot_round_trip(self):
+        """Test the snapshot encodes ids and parents in CSR form."""
+        from persons.graph import HAS_FATHER, HAS_MOTHER, NO_YEAR, build_snapshot
+
+        snapshot = read_snapshot(build_snapshot(birth_years=True))
+        ids = list(snapshot["ids"])
+        self.assertEqual(ids, [self.mother.id, self.father.id, self.child.id])
+        self.assertEqual(list(snapshot["indptr"]), [0, 0, 0, 2])
+        self.assertEqual(
+            [ids[i] for i in snapshot["indices"]], [self.mother.id, self.father.id]
+        )
+        self.assertEqual(snapshot["parents"][2], HAS_MOTHER | HAS_FATHER)
+        self.assertEqual(list(snapshot["birth_year"]), [1960, NO_YEAR, NO_YEAR])
+
+    def test_snapshot_file_rebuilt_only_on_graph_change(self):
+        """Test the cached file is reused until the graph revision changes."""
+        first = snapshot_path()
+        self.assertEqual(snapshot_path(), first)
+        self.child.father = None
+        self.child.save()
+        second = snapshot_path()
+        self.assertNotEqual(second, first)
+        self.assertFalse(first.exists())
+        with open(second, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as m:
+            snapshot = read_snapshot(m)
+            self.assertEqual(list(snapshot["indptr"]), [0, 0, 0, 1])
+            del snapshot
+
+    def test_older_builder_keeps_newer_snapshot(self):
+        """Test a build of an older revision does not remove newer files."""
+        newer = snapshot_path()
+        revision = read_snapshot(newer.read_bytes())["revision"]
+        with mock.patch("persons.graph.revisions.current", return_value=revision - 1):
+            older = snapshot_path()
+        self.assertTrue(newer.exists())
+        self.assertEqual(read_snapshot(older.read_bytes())["revision"], revision - 1)
+
+    def test_graph_endpoint(self):
+        """Test GET /api/person/graph/ serves the snapshot with an ETag."""
+        response = self.client.get("/api/person/graph/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/octet-stream")
+        body = b"".join(response.streaming_content)
+        self.assertEqual(list(read_snapshot(body)["ids"])[-1], self.child.id)
+
+        response = self.client.get(
+            "/api/person/graph/", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_graph_endpoint_retries_vanished_snapshot(self):
+        """Test a snapshot removed before it is opened is looked up again."""
+        path = snapshot_path()
+        gone = path.with_name("graph-r0.bin")
+        with mock.patch("persons.views.snapshot_path", side_effect=[gone, path]):
+            response = self.client.get("/api/person/graph/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["ETag"], f'"{path.name}"')
+
+        with mock.patch("persons.views.snapshot_path", return_value=gone):
+            response = self.client.get("/api/person/graph/")
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+class ContentNegotiationTestCase(TestCase):
+    """Test cases for MessagePack and compressed responses."""
+
+    def setUp(self):
+        """Set up enough persons for the list to be worth compressing."""
+        cache.clear()
+        self.client = APIClient()
+        for i in range(30):
+            Person.objects.create(first_name=f"Person{i}", last_name="Test", gender="U")
+
+    def test_list_as_msgpack(self):
+        """Test the list can be requested as MessagePack."""
+        response = self.client.get("/api/person/", HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        self.assertEqual(len(msgpack.unpackb(response.content)), 30)
+
+    def test_create_from_msgpack(self):
+        """Test a person can be created from a MessagePack body."""
+        response = self.client.post(
+            "/api/person/",
+            msgpack.packb({"first_name": "Packed", "gender": "F"}),
+            content_type="application/msgpack",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(Person.objects.filter(first_name="Packed").exists())
+
+    def test_list_is_compressed_once(self):
+        """Test the compressed list body is cached until the data changes."""
+        with mock.patch(
+            "persons.middleware.compress", wraps=persons_middleware.compress
+        ) as compress:
+            first = self.client.get("/api/person/", HTTP_ACCEPT_ENCODING="gzip")
+            second = self.client.get("/api/person/", HTTP_ACCEPT_ENCODING="gzip")
+            self.assertEqual(compress.call_count, 1)
+            Person.objects.create(first_name="New", gender="U")
+            self.client.get("/api/person/", HTTP_ACCEPT_ENCODING="gzip")
+            self.assertEqual(compress.call_count, 2)
+
+        self.assertEqual(first["Content-Encoding"], "gzip")
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(len(json.loads(gzip.decompress(first.content))), 30)
+
+    def test_small_responses_are_not_compressed(self):
+        """Test responses below the size threshold are sent as they are."""
+        person = Person.objects.first()
+        response = self.client.get(
+            f"/api/person/{person.id}/", HTTP_ACCEPT_ENCODING="br, gzip"
+        )
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_graph_snapshot_is_precompressed(self):
+        """Test the graph snapshot is served from a precompressed file."""
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(GRAPH_SNAPSHOT_DIR=directory):
+                response = self.client.get(
+                    "/api/person/graph/", HTTP_ACCEPT_ENCODING="br"
+                )
+                body = brotli.decompress(b"".join(response.streaming_content))
+                response.close()
+                self.assertEqual(response["Content-Encoding"], "br")
+                self.assertEqual(len(read_snapshot(body)["ids"]), 30)
+
+    def test_benchmark_keeps_shared_cache(self):
+        """Test benchmark_responses neither clears nor fills the shared cache."""
+        cache.set("session-like", "kept")
+        call_command("benchmark_responses", persons=5, requests=1, stdout=io.StringIO())
+        self.assertEqual(cache.get("session-like"), "kept")
+        response = self.client.get("/api/person/")
+        self.assertEqual(len(response.data), 30)
+
+
+# ==================== Ancestry Tests ====================
+class AncestryTestCase(TestCase):
+    """Test cases for the ancestry index and cycle prevention."""
+
+    def setUp(self):
+        """Set up a family where both parents descend from one grandmother."""
+        self.client = APIClient()
+        self.grandma = Person.objects.create(first_name="Grandma", gender="F")
+        self.mother = Person.objects.create(first_name="Mother", mother=self.grandma)
+        self.father = Person.objects.create(first_name="Father", mother=self.grandma)
+        self.child = Person.objects.create(
+            first_name="Child", mother=self.mother, father=self.father
+        )
+
+    def _index(self):
+        return set(
+            PersonAncestry.objects.values_list("ancestor_id", "descendant_id", "paths")
+        )
+
+    def assertIndexIsRebuildable(self):
+        stored = self._index()
+        ancestry.rebuild(chunk_size=2)
+        self.assertEqual(stored, self._index())
+
+    def test_index_counts_paths(self):
+        """Test the grandmother is reached over both parents."""
+        self.assertIn((self.grandma.id, self.child.id, 2), self._index())
+        self.assertIndexIsRebuildable()
+
+    def test_removing_one_line_keeps_the_other(self):
+        """Test pedigree collapse survives removing one parent link."""
+        self.child.father = None
+        self.child.save()
+        self.assertIn((self.grandma.id, self.child.id, 1), self._index())
+        self.assertIndexIsRebuildable()
+
+    def test_delete_person(self):
+        """Test deleting a person removes the paths running through it."""
+        self.mother.delete()
+        self.assertIn((self.grandma.id, self.child.id, 1), self._index())
+        self.assertIndexIsRebuildable()
+
+    def test_cycle_is_rejected_with_one_lookup(self):
+        """Test a descendant cannot become a parent."""
+        from persons.serializers import PersonSerializer
+
+        serializer = PersonSerializer(
+            self.grandma, data={"mother": self.child.id}, partial=True
+        )
+        with CaptureQueriesContext(connection) as queries:
+            self.assertFalse(serializer.is_valid())
+        self.assertIn("mother", serializer.errors)
+        lookups = [q for q in queries if "persons_personancestry" in q["sql"]]
+        self.assertEqual(len(lookups), 1)
+
+        response = self.client.patch(
+            f"/api/person/{self.mother.id}/", {"father": self.mother.id}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("father", response.data)
+
+        response = self.client.patch(
+            f"/api/person/{self.child.id}/", {"father": self.grandma.id}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_cyclic_assignments(self):
+        """Test batch assignments are checked against each other."""
+        other = Person.objects.create(first_name="Other")
+        self.assertEqual(
+            ancestry.cyclic_assignments(
+                {other.id: [self.child.id], self.grandma.id: [other.id]}
+            ),
+            {other.id, self.grandma.id},
+        )
+        self.assertEqual(
+            ancestry.cyclic_assignments({other.id: [self.child.id]}), set()
+        )
+
+    @override_settings(ANCESTRY_SYNC_LIMIT=1)
+    def test_large_relink_is_left_to_a_job(self):
+        """Test large changes queue one refresh and cycles are still caught."""
+        child = self.child.id
+        other = Person.objects.create(first_name="Other")
+        self.mother.father = other
+        self.mother.save()
+        self.assertNotIn((other.id, self.mother.id, 1), self._index())
+        kept = {row for row in self._index() if child not in row[:2]}
+        self.child.delete()
+        self.assertEqual(self._index(), kept)
+        self.assertEqual(
+            Job.objects.filter(kind=ancestry.REFRESH_JOB, status=Job.QUEUED).count(), 1
+        )
+
+        serializer = PersonSerializer(
+            other, data={"mother": self.mother.id}, partial=True
+        )
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(
+            ancestry.cyclic_assignments({other.id: [self.mother.id]}), {other.id}
+        )
+
+        jobs.run(jobs.claim())
+        self.assertIn((other.id, self.mother.id, 1), self._index())
+        self.assertEqual(PersonLineage.objects.get(person=other).descendants, 1)
+        self.assertFalse(ancestry.stale())
+        self.assertIndexIsRebuildable()
+
+
+class LineageTestCase(TestCase):
+    """Test cases for the denormalized ancestor and descendant counts."""
+
+    def setUp(self):
+        """Set up a family where both parents descend from one grandmother."""
+        self.grandma = Person.objects.create(first_name="Grandma", gender="F")
+        self.mother = Person.objects.create(first_name="Mother", mother=self.grandma)
+        self.father = Person.objects.create(first_name="Father", mother=self.grandma)
+        self.child = Person.objects.create(
+            first_name="Child", mother=self.mother, father=self.father
+        )
+
+    def _values(self, person):
+        """(ancestors, descendants, ancestor generations, descendant generations)"""
+        row = PersonLineage.objects.get(person=person)
+        return tuple(getattr(row, field) for field in lineage.FIELDS)
+
+    def assertMatchesRebuild(self):
+        stored = set(PersonLineage.objects.values_list("person", *lineage.FIELDS))
+        self.assertEqual(lineage.rebuild(chunk_size=2), Person.objects.count())
+        self.assertEqual(
+            stored, set(PersonLineage.objects.values_list("person", *lineage.FIELDS))
+        )
+
+    def test_counts_with_pedigree_collapse(self):
+        """Test the grandmother is counted once, whatever the number of paths."""
+        self.assertEqual(self._values(self.grandma), (0, 3, 0, 2))
+        self.assertEqual(self._values(self.mother), (1, 1, 1, 1))
+        self.assertEqual(self._values(self.child), (3, 0, 2, 0))
+        self.assertMatchesRebuild()
+
+    def test_relinking_updates_both_sides(self):
+        """Test a changed parent updates the old and new ancestor paths."""
+        self.child.father = None
+        self.child.save()
+        self.assertEqual(self._values(self.child), (2, 0, 2, 0))
+        self.assertEqual(self._values(self.father), (1, 0, 1, 0))
+        self.assertEqual(self._values(self.grandma), (0, 3, 0, 2))
+
+        great = Person.objects.create(first_name="Great")
+        self.grandma.mother = great
+        self.grandma.save()
+        self.assertEqual(self._values(great), (0, 4, 0, 3))
+        self.assertEqual(self._values(self.child), (3, 0, 3, 0))
+        self.assertMatchesRebuild()
+
+    def test_delete_person(self):
+        """Test deleting a person updates its ancestors and descendants."""
+        self.mother.delete()
+        self.assertEqual(self._values(self.child), (2, 0, 2, 0))
+        self.assertEqual(self._values(self.grandma), (0, 2, 0, 2))
+        self.assertMatchesRebuild()
+
+    def test_upsert(self):
+        """Test bulk upserts keep the counts up to date."""
+        upsert.upsert(
+            "archive",
+            [
+                {"external_id": "a", "first_name": "A", "mother": None},
+                {"external_id": "b", "first_name": "B", "mother": "a"},
+                {"external_id": "c", "first_name": "C", "mother": "b"},
+            ],
+        )
+        a = ExternalId.objects.get(external_id="a").person
+        self.assertEqual(self._values(a), (0, 2, 0, 2))
+        upsert.upsert("archive", [{"external_id": "c", "mother": "a"}])
+        self.assertEqual(self._values(a), (0, 2, 0, 1))
+        self.assertMatchesRebuild()
+
+    def test_neighborhood_includes_counts(self):
+        """Test the tree cards get the counts with the neighborhood."""
+        response = APIClient().get(f"/api/person/{self.mother.id}/neighborhood/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data["lineage"][self.grandma.id],
+            {
+                "ancestors": 0,
+                "descendants": 3,
+                "ancestor_generations": 0,
+                "descendant_generations": 2,
+            },
+        )
+
+
+class ConsistencyTestCase(TestCase):
+    """Test cases for the graph consistency checker."""
+
+    def setUp(self):
+        """Set up a small family with one bad record of each kind."""
+        cache.clear()
+        self.mother = Person.objects.create(
+            first_name="Mother", gender="M", date_of_birth=date(1960, 1, 1)
+        )
+        self.father = Person.objects.create(
+            first_name="Father", gender="M", date_of_birth=date(1990, 1, 1)
+        )
+        self.child = Person.objects.create(
+            first_name="Child",
+            date_of_birth=date(1985, 1, 1),
+            date_of_death=date(1984, 1, 1),
+            mother=self.mother,
+            father=self.father,
+        )
+
+    def _issues(self):
+        from persons.consistency import check
+
+        return [
+            (issue["kind"], issue["person"], issue["related"])
+            for issue in check(chunk_size=2)
+        ]
+
+    def test_dates_and_genders(self):
+        """Test date and gender violations are reported once each."""
+        self.assertEqual(
+            self._issues(),
+            [
+                ("death_before_birth", self.child.id, None),
+                ("mother_is_male", self.child.id, self.mother.id),
+                ("child_born_before_parent", self.child.id, self.father.id),
+            ],
+        )
+
+    def test_cycles(self):
+        """Test only persons on the cycle are reported, not their ancestors."""
+        Person.objects.update(gender="U", date_of_birth=None, date_of_death=None)
+        grandma = Person.objects.create(first_name="Grandma", gender="F")
+        Person.objects.filter(pk=self.mother.pk).update(mother=grandma)
+        # mother -> child -> mother
+        Person.objects.filter(pk=self.mother.pk).update(father=self.child)
+        self.assertEqual(
+            self._issues(),
+            [
+                ("ancestry_cycle", self.mother.id, None),
+                ("ancestry_cycle", self.child.id, None),
+            ],
+        )
+
+    def test_api_and_command(self):
+        """Test the endpoint is staff only and the command fails on issues."""
+        client = APIClient()
+        self.assertEqual(
+            client.get("/api/person/consistency/").status_code,
+            status.HTTP_403_FORBIDDEN,
+        )
+        client.force_authenticate(
+            User.objects.create_user(username="admin", is_staff=True)
+        )
+        url = "/api/person/consistency/?kind=mother_is_male"
+        with mock.patch("persons.consistency.check", wraps=consistency.check) as check:
+            response = client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            self.assertEqual(client.get(url).data["job"], response.data["job"])
+            self.assertFalse(check.called)
+            jobs.run(jobs.claim())
+        response = client.get(url)
+        self.assertEqual(response.data["count"], 1)
+        self.assertFalse(response.data["stale"])
+        self.assertIsNone(response.data["job"])
+        self.assertEqual(response.data["issues"][0]["related"], self.mother.id)
+
+        self.mother.gender = "F"
+        self.mother.save()
+        response = client.get(url)
+        self.assertTrue(response.data["stale"])
+        self.assertEqual(response.data["count"], 1)
+        jobs.run(jobs.claim())
+        self.assertEqual(client.get(url).data["count"], 0)
+
+        with self.assertRaises(CommandError):
+            call_command("check_consistency", stdout=io.StringIO())
+        Person.objects.filter(pk=self.child.pk).update(
+            mother=None, father=None, date_of_death=None
+        )
+        call_command("check_consistency", stdout=io.StringIO())
+
+
+# ==================== Authentication Tests ====================
+@override_settings(ACCOUNT_CACHE="default")
+class AuthCacheTestCase(TestCase):
+    """Test cases for the cached session engine and account lookup."""
+
+    def setUp(self):
+        """Set up a user with a linked person."""
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="alice", password="secret")
+        self.person = Person.objects.create(first_name="Alice", user_account=self.user)
+        self.client.login(username="alice", password="secret")
+
+    def test_warm_auth_check_runs_no_queries(self):
+        """Test check_auth and /me are served from memory once warm."""
+        for path in ("/api/auth/check/", "/api/person/me/"):
+            self.client.get(path)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(path)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(queries), 0, path)
+        self.assertEqual(response.data["first_name"], "Alice")
+
+    def test_saves_invalidate_the_cache(self):
+        """Test changes to the person and the user are visible at once."""
+        self.client.get("/api/person/me/")
+        self.client.patch(
+            f"/api/person/{self.person.id}/", {"first_name": "Alicia"}, format="json"
+        )
+        self.assertEqual(
+            self.client.get("/api/person/me/").data["first_name"], "Alicia"
+        )
+
+        self.user.email = "alice@example.com"
+        self.user.save()
+        response = self.client.get("/api/auth/check/")
+        self.assertEqual(response.data["user"]["email"], "alice@example.com")
+
+        self.person.refresh_from_db()
+        self.person.user_account = None
+        self.person.save()
+        response = self.client.get("/api/person/me/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_account_cache_must_be_shared(self):
+        """Test accounts are uncached by default and per-process caches fail."""
+        from persons import accounts
+
+        self.assertEqual(len(accounts.check_cache()), 1)
+        with override_settings(ACCOUNT_CACHE=None):
+            self.assertEqual(accounts.check_cache(), [])
+            self.client.get("/api/auth/check/")
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get("/api/auth/check/")
+            self.assertTrue(any("auth_user" in q["sql"] for q in queries))
+
+    def test_model_backend_sessions_survive(self):
+        """Test sessions logged in with the plain ModelBackend stay valid."""
+        self.client.logout()
+        self.client.force_login(
+            self.user, backend="django.contrib.auth.backends.ModelBackend"
+        )
+        response = self.client.get("/api/auth/check/")
+        self.assertTrue(response.data["authenticated"])
+
+    def test_logout_ends_the_session(self):
+        """Test a logged out session is not served from the LRU."""
+        self.client.get("/api/auth/check/")
+        self.client.post("/api/auth/logout/")
+        response = self.client.get("/api/auth/check/")
+        self.assertFalse(response.data["authenticated"])
+
+    def test_lru_cache(self):
+        """Test the LRU evicts the least recently used and expired entries."""
+        from persons.sessions import LRUCache
+
+        lru = LRUCache(2)
+        lru.set("a", 1, 60)
+        lru.set("b", 2, 60)
+        lru.get("a")
+        lru.set("c", 3, 60)
+        self.assertEqual((lru.get("a"), lru.get("b"), lru.get("c")), (1, None, 3))
+        lru.set("d", 4, -1)
+        self.assertIsNone(lru.get("d"))
+
+
+@override_settings(
+    PASSWORD_PBKDF2_ITERATIONS=1000,
+    PASSWORD_HASHERS=["persons.hashers.TunablePBKDF2PasswordHasher"],
+)
+class LoginTestCase(TestCase):
+    """Test cases for the async login view, re-hashing and throttling."""
+
+    def setUp(self):
+        """Set up a user."""
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="bob", password="secret")
+
+    def _login(self, username="bob", password="secret"):
+        return self.client.post(
+            "/api/auth/login/",
+            {"username": username, "password": password},
+            format="json",
+        )
+
+    def test_login(self):
+        """Test a correct login starts a session."""
+        response = self._login()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()["user"]["username"], "bob")
+        self.assertTrue(self.client.get("/api/auth/check/").data["authenticated"])
+        self.assertEqual(self._login(password="wrong").status_code, 401)
+        self.assertEqual(self.client.get("/api/auth/login/").status_code, 405)
+
+    def test_password_is_rehashed_with_new_settings(self):
+        """Test raising the iteration count upgrades the hash at login."""
+        self.assertIn("$1000$", self.user.password)
+        with self.settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.assertEqual(self._login().status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$2000$"))
+
+    @override_settings(LOGIN_THROTTLE_USER=(2, 300))
+    def test_user_throttle(self):
+        """Test repeated failures lock the username, even with the right
+        password."""
+        self._login(password="wrong")
+        self._login(password="wrong")
+        response = self._login()
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response["Retry-After"], "300")
+
+    @override_settings(LOGIN_THROTTLE_USER=(2, 300))
+    def test_success_resets_user_throttle(self):
+        """Test a successful login clears the failures of the username."""
+        self._login(password="wrong")
+        self._login()
+        self._login(password="wrong")
+        self.assertEqual(self._login().status_code, status.HTTP_200_OK)
+
+    @override_settings(LOGIN_THROTTLE_IP=(2, 60))
+    def test_ip_throttle(self):
+        """Test failures across usernames are counted per client IP."""
+        self._login(username="eve", password="x")
+        self._login(username="mallory", password="x")
+        self.assertEqual(self._login().status_code, 429)
+
+    @override_settings(LOGIN_THROTTLE_USER=(2, 300))
+    def test_concurrent_attempts_are_counted(self):
+        """Test attempts running at once cannot pass the limit together."""
+        import asyncio
+
+        from asgiref.sync import async_to_sync, sync_to_async
+        from django.test import RequestFactory
+        from persons import throttling
+
+        request = RequestFactory().post("/api/auth/login/")
+        attempt = sync_to_async(throttling.attempt, thread_sensitive=False)
+
+        async def attempts():
+            return await asyncio.gather(*(attempt(request, "bob") for _ in range(5)))
+
+        self.assertEqual(sorted(async_to_sync(attempts)()), [0, 0, 300, 300, 300])
+
+
+# ==================== Admin Tests ====================
+class PersonAdminTestCase(TestCase):
+    """Test cases for the admin on large person tables."""
+
+    def setUp(self):
+        """Set up a superuser and a few persons."""
+        cache.clear()
+        self.admin = User.objects.create_superuser(username="root", password="x")
+        self.client.force_login(self.admin)
+        self.anna = Person.objects.create(first_name="Anna", last_name="Smith")
+        self.annika = Person.objects.create(first_name="Annika", last_name="Jones")
+        self.hanna = Person.objects.create(first_name="Hanna", birth_name="Annberg")
+
+    def test_prefix_search(self):
+        """Test every word must prefix one of the indexed names."""
+        self.assertEqual(
+            set(Person.objects.search("ANN")), {self.anna, self.annika, self.hanna}
+        )
+        self.assertEqual(list(Person.objects.search("ann sm")), [self.anna])
+        self.assertEqual(list(Person.objects.search("nna")), [])
+        self.assertEqual(list(Person.objects.search("\U0010ffff")), [])
+
+    def test_prefix_search_uses_binary_name_index(self):
+        """Test the range is compared by code point, on the name index."""
+        sql, params = Person.objects.prefix("last_name", "Sm").query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plan = " ".join(str(row) for row in cursor.fetchall())
+        self.assertIn("COLLATE BINARY", sql)
+        self.assertIn("person_last_name_lower", plan)
+        self.assertEqual(list(Person.objects.prefix("last_name", "Sm")), [self.anna])
+
+    def test_changelist_and_autocomplete(self):
+        """Test the changelist and the parent autocomplete use the search."""
+        response = self.client.get("/admin/persons/person/?q=annik")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context["cl"].result_list), [self.annika])
+
+        response = self.client.get(
+            "/admin/autocomplete/",
+            {
+                "app_label": "persons",
+                "model_name": "person",
+                "field_name": "mother",
+                "term": "hann",
+            },
+        )
+        self.assertEqual(
+            [r["id"] for r in response.json()["results"]], [str(self.hanna.id)]
+        )
+
+    @override_settings(ADMIN_COUNT_LIMIT=2)
+    def test_estimated_count(self):
+        """Test large unfiltered lists are estimated, filtered ones capped."""
+        from persons.admin import EstimatedCountPaginator
+
+        Person.objects.filter(pk=self.anna.pk).delete()
+        paginator = EstimatedCountPaginator(Person.objects.order_by("pk"), 10)
+        self.assertEqual(paginator.count, self.hanna.id)
+        paginator = EstimatedCountPaginator(Person.objects.search("a"), 10)
+        self.assertEqual(paginator.count, 2)
+
+    @override_settings(ADMIN_BATCH_SIZE=2)
+    def test_bulk_delete_in_batches(self):
+        """Test the delete action removes the selection batch by batch."""
+        child = Person.objects.create(first_name="Child", mother=self.anna)
+        response = self.client.post(
+            "/admin/persons/person/",
+            {
+                "action": "delete_selected",
+                "_selected_action": [self.anna.id, self.annika.id, child.id],
+            },
+        )
+        self.assertContains(response, "Anna Smith")
+        self.client.post(
+            "/admin/persons/person/",
+            {
+                "action": "delete_selected",
+                "_selected_action": [self.anna.id, self.annika.id, child.id],
+                "post": "yes",
+            },
+        )
+        self.assertEqual(list(Person.objects.all()), [self.hanna])
+        self.assertFalse(PersonAncestry.objects.exists())
+
+
+# ==================== Job Tests ====================
+class JobTestCase(TestCase):
+    """Test cases for the background job queue."""
+
+    def setUp(self):
+        """Set up a staff user and a person without a normalized place."""
+        self.client = APIClient()
+        self.staff = User.objects.create_user(
+            username="admin", password="secret", is_staff=True
+        )
+        self.person = Person.objects.create(first_name="A", place_of_birth="Leipzig")
+        Person.objects.filter(pk=self.person.pk).update(birth_place=None)
+
+    def test_submit_requires_staff(self):
+        """Test anonymous users cannot submit jobs."""
+        response = self.client.post(
+            "/api/jobs/", {"kind": "rebuild_stats"}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_submit_and_run(self):
+        """Test a job submitted over the API runs to completion."""
+        self.client.force_authenticate(self.staff)
+        response = self.client.post(
+            "/api/jobs/",
+            {"kind": "normalize_places", "payload": {"chunk_size": 1}},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data["status"], Job.QUEUED)
+
+        pk = jobs.claim()
+        self.assertEqual(pk, response.data["id"])
+        self.assertIsNone(jobs.claim())
+        jobs.run(pk)
+
+        response = self.client.get(f"/api/jobs/{pk}/")
+        self.assertEqual(response.data["status"], Job.SUCCEEDED)
+        self.assertEqual(response.data["progress"], 1.0)
+        self.assertEqual(response.data["result"], {"persons": 1})
+        self.person.refresh_from_db()
+        self.assertEqual(self.person.birth_place.name, "Leipzig")
+
+    def test_unknown_kind(self):
+        """Test unknown job kinds are rejected."""
+        self.client.force_authenticate(self.staff)
+        response = self.client.post("/api/jobs/", {"kind": "nope"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_failed_jobs_are_retried(self):
+        """Test a failing job is requeued until its attempts are used up."""
+        failing = mock.Mock(side_effect=RuntimeError("boom"))
+        with mock.patch.dict(jobs.HANDLERS, {"boom": failing}):
+            job = jobs.submit("boom", max_attempts=2)
+            jobs.run(jobs.claim())
+            job.refresh_from_db()
+            self.assertEqual(job.status, Job.QUEUED)
+            self.assertGreater(job.run_after, job.created_on)
+
+            Job.objects.filter(pk=job.pk).update(run_after=job.created_on)
+            jobs.run(jobs.claim())
+            job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertIn("RuntimeError: boom", job.error)
+
+    def test_cancel(self):
+        """Test queued jobs are cancelled at once and running ones at the
+        next progress report."""
+        self.client.force_authenticate(self.staff)
+        job = jobs.submit("rebuild_stats")
+        response = self.client.post(f"/api/jobs/{job.pk}/cancel/")
+        self.assertEqual(response.data["status"], Job.CANCELLED)
+        self.assertIsNone(jobs.claim())
+        response = self.client.post(f"/api/jobs/{job.pk}/cancel/")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        def _slow(context):
+            jobs.cancel(context.job)
+            context.progress(0.5)
+
+        with mock.patch.dict(jobs.HANDLERS, {"slow": _slow}):
+            job = jobs.submit("slow")
+            jobs.run(jobs.claim())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.CANCELLED)
+
+    @override_settings(
+        DATABASE_ROUTERS=["persons.routers.FamilyTreeRouter"], TREE_DATABASES=["b"]
+    )
+    def test_jobs_run_in_the_database_they_were_queued_for(self):
+        """Test a job queued for a tree database runs routed there."""
+        seen = []
+
+        def _where(context):
+            seen.append(routers.current())
+
+        with mock.patch.dict(jobs.HANDLERS, {"where": _where}):
+            with routers.use_tree(1):
+                job = jobs.submit_once(ancestry.REFRESH_JOB)
+                self.assertTrue(ancestry.stale())
+                jobs.submit("where")
+            self.assertEqual(job.database, "b")
+            self.assertFalse(ancestry.stale())
+            Job.objects.filter(pk=job.pk).update(status=Job.CANCELLED)
+            jobs.run(jobs.claim())
+        self.assertEqual(seen, ["b"])
+
+    def test_payload_is_validated_on_submit(self):
+        """Test payloads the handler does not accept are rejected at once."""
+        self.client.force_authenticate(self.staff)
+        for payload in ({"chunk": 10}, [1, 2]):
+            response = self.client.post(
+                "/api/jobs/",
+                {"kind": "rebuild_ancestry", "payload": payload},
+                format="json",
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Job.objects.exists())
+        jobs.submit("rebuild_ancestry", {"chunk_size": 10})
+
+    def test_rebuilds_report_progress_between_transactions(self):
+        """Test the long rebuilds commit per chunk and report in between."""
+        parent = Person.objects.create(first_name="P")
+        for i in range(3):
+            Person.objects.create(first_name=f"C{i}", mother=parent)
+        depth = len(connection.atomic_blocks)
+        for rebuild in (intervals.rebuild, ancestry.rebuild, lineage.rebuild):
+            seen = []
+            rebuild(
+                chunk_size=1,
+                progress=lambda f: seen.append(len(connection.atomic_blocks)),
+            )
+            self.assertTrue(seen)
+            self.assertEqual(set(seen), {depth})
+
+    def test_consistency_check_can_be_cancelled(self):
+        """Test the consistency job reports progress and stops when cancelled."""
+        for i in range(3):
+            Person.objects.create(first_name=f"P{i}")
+        job = jobs.submit("check_consistency", {"chunk_size": 1})
+        progress = jobs.JobContext.progress
+        fractions = []
+
+        def _cancel_then_report(context, fraction, message=""):
+            fractions.append(fraction)
+            jobs.cancel(context.job)
+            progress(context, fraction, message)
+
+        with mock.patch.object(jobs.JobContext, "progress", _cancel_then_report):
+            jobs.run(jobs.claim())
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.CANCELLED)
+        self.assertEqual(len(fractions), 1)
+
+    @override_settings(JOB_RETRY_DELAY=0)
+    def test_stale_jobs_are_requeued(self):
+        """Test a running job without heartbeats is handed out again."""
+        job = jobs.submit("rebuild_stats", max_attempts=2)
+        self.assertEqual(jobs.claim(), job.pk)
+        jobs.heartbeat([job.pk])
+        self.assertIsNone(jobs.claim())
+
+        old = timezone.now() - timedelta(seconds=settings.JOB_LEASE_TIMEOUT + 1)
+        Job.objects.filter(pk=job.pk).update(heartbeat_on=old)
+        self.assertEqual(jobs.claim(), job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 2)
+        self.assertIn("stopped responding", job.error)
+
+        Job.objects.filter(pk=job.pk).update(heartbeat_on=old)
+        self.assertEqual(jobs.requeue_stale(), [job.pk])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+    @override_settings(JOB_RETRY_DELAY=0)
+    def test_worker_replaces_broken_pool(self):
+        """Test a dying pool process releases its job and the pool is rebuilt."""
+
+        class _Pool:
+            def __init__(self, broken):
+                self.broken = broken
+
+            def submit(self, func, pk):
+                future = Future()
+                if self.broken:
+                    future.set_exception(BrokenProcessPool())
+                else:
+                    future.set_result(func(pk))
+                return future
+
+            def shutdown(self, **kwargs):
+                pass
+
+        job = jobs.submit("rebuild_stats")
+        with mock.patch("persons.jobs._pool", side_effect=[_Pool(True), _Pool(False)]):
+            jobs.run_worker(processes=1, poll_interval=0, once=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.attempts, 2)
+
+
+# ==================== Family Tree Tests ====================
+class FamilyTreeTestCase(TestCase):
+    """Test cases for persons partitioned into family trees."""
+
+    def setUp(self):
+        """Set up two trees with a family each."""
+        cache.clear()
+        self.client = APIClient()
+        self.owner = User.objects.create_user(username="owner")
+        self.client.force_login(self.owner)
+        self.smiths = FamilyTree.objects.create(name="Smith", owner=self.owner)
+        self.jones = FamilyTree.objects.create(name="Jones", owner=self.owner)
+        self.mother = Person.objects.create(
+            first_name="Anna", gender="F", tree=self.smiths
+        )
+        self.child = Person.objects.create(
+            first_name="Ben", mother=self.mother, tree=self.smiths
+        )
+        self.other = Person.objects.create(first_name="Carl", tree=self.jones)
+
+    def test_list_is_scoped_to_tree(self):
+        """Test the list only returns the persons of the requested tree."""
+        response = self.client.get(f"/api/person/?tree={self.smiths.pk}")
+        names = {person["first_name"] for person in response.data}
+        self.assertEqual(names, {"Anna", "Ben"})
+        # Without ?tree= only the persons outside every tree are listed.
+        Person.objects.create(first_name="Dora")
+        response = self.client.get("/api/person/")
+        self.assertEqual([p["first_name"] for p in response.data], ["Dora"])
+        self.client.force_login(
+            User.objects.create_user(username="root", is_staff=True)
+        )
+        response = self.client.get("/api/person/")
+        self.assertEqual(len(response.data), 4)
+
+    def test_trees_of_other_users_are_not_found(self):
+        """Test a tree is only reachable by its owner and staff."""
+        self.client.force_login(User.objects.create_user(username="mallory"))
+        for url in (
+            f"/api/person/?tree={self.smiths.pk}",
+            f"/api/person/{self.mother.pk}/?tree={self.smiths.pk}",
+            f"/api/person/{self.mother.pk}/",
+            f"/api/person/{self.mother.pk}/history/?tree={self.jones.pk}",
+            f"/api/person/stats/?tree={self.smiths.pk}",
+        ):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, url)
+        self.client.logout()
+        response = self.client.get(f"/api/person/?tree={self.smiths.pk}")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_upsert_stays_in_tree(self):
+        """Test an upsert without ?tree= cannot update persons of a tree."""
+        ExternalId.objects.create(source="archive", external_id="a", person=self.mother)
+        batch = {
+            "source": "archive",
+            "persons": [{"external_id": "a", "first_name": "Eve"}],
+        }
+        self.client.force_login(User.objects.create_user(username="mallory"))
+        response = self.client.post("/api/person/upsert/", batch, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Person.objects.get(pk=self.mother.pk).first_name, "Anna")
+
+        self.client.force_login(self.owner)
+        response = self.client.post(
+            f"/api/person/upsert/?tree={self.smiths.pk}", batch, format="json"
+        )
+        self.assertEqual(response.data["updated"], 1)
+
+    def test_traversal_stays_in_tree(self):
+        """Test links leaving the tree are not followed by the neighborhood."""
+        Person.objects.filter(pk=self.other.pk).update(mother=self.mother)
+        response = self.client.get(
+            f"/api/person/{self.mother.pk}/neighborhood/?tree={self.smiths.pk}"
+        )
+        self.assertEqual(response.data["descendants"], [self.child.pk])
+
+    def test_moving_tree_refuses_writes(self):
+        """Test a tree being moved is read-only."""
+        FamilyTree.objects.filter(pk=self.smiths.pk).update(moving_to="other")
+        url = f"/api/person/{self.child.pk}/?tree={self.smiths.pk}"
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        response = self.client.patch(url, {"first_name": "Bo"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        response = self.client.post(
+            f"/api/person/?tree={self.smiths.pk}", {"first_name": "Eve"}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_detail_outside_tree_is_not_found(self):
+        """Test a person of another tree is not found."""
+        response = self.client.get(
+            f"/api/person/{self.other.pk}/?tree={self.smiths.pk}"
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(f"/api/person/{self.other.pk}/?tree=x")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_in_tree(self):
+        """Test persons created with ?tree= belong to that tree."""
+        response = self.client.post(
+            f"/api/person/?tree={self.smiths.pk}",
+            {"first_name": "Dora", "mother": self.mother.pk},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["tree"], self.smiths.pk)
+
+        response = self.client.post(
+            "/api/person/?tree=999", {"first_name": "Eve"}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_parents_must_share_the_tree(self):
+        """Test a parent from another tree is rejected."""
+        response = self.client.post(
+            f"/api/person/?tree={self.jones.pk}",
+            {"first_name": "Dora", "mother": self.mother.pk},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(
+            f"/api/person/{self.other.pk}/?tree={self.jones.pk}",
+            {"father": self.child.pk},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_tree_stats(self):
+        """Test statistics can be computed for one tree."""
+        response = self.client.get(f"/api/person/stats/?tree={self.jones.pk}")
+        self.assertEqual(sum(response.data["persons"].values()), 1)
+        self.assertEqual(
+            set(PersonSummary.objects.values_list("tree", flat=True)),
+            {self.smiths.pk, self.jones.pk},
+        )
+        response = self.client.get("/api/person/stats/")
+        self.assertEqual(response.data["persons"], {})
+        self.client.force_login(
+            User.objects.create_user(username="root", is_staff=True)
+        )
+        response = self.client.get("/api/person/stats/")
+        self.assertEqual(sum(response.data["persons"].values()), 3)
+        self.assertEqual(person_stats.check(), [])
+
+    def test_database_for(self):
+        """Test trees are spread over the tree databases by id."""
+        self.assertEqual(routers.database_for(3), "default")
+        with override_settings(
+            DATABASE_ROUTERS=["persons.routers.FamilyTreeRouter"],
+            TREE_DATABASES=["a", "b"],
+        ):
+            self.assertEqual(routers.database_for(3), "b")
+            self.assertEqual(routers.database_for(4), "a")
+            self.assertEqual(routers.database_for(None), "default")
+            with routers.use_tree(3):
+                self.assertEqual(routers.current(), "b")
+            self.assertEqual(routers.current(), "default")
+
+
+# ==================== Versioning Tests ====================
+class PersonVersionTestCase(TestCase):
+    """Test cases for optimistic concurrency control on persons."""
+
+    def setUp(self):
+        """Set up a person."""
+        self.client = APIClient()
+        self.person = Person.objects.create(first_name="Anna", last_name="Smith")
+
+    def test_save_bumps_version(self):
+        """Test every save increments the version."""
+        self.assertEqual(self.person.version, 1)
+        self.person.first_name = "Anne"
+        self.person.save()
+        self.person.save(update_fields=["first_name"])
+        self.person.refresh_from_db()
+        self.assertEqual(self.person.version, 3)
+
+    def test_stale_copy_is_rejected(self):
+        """Test saving a copy read before another save raises a conflict."""
+        first = Person.objects.get(pk=self.person.pk)
+        second = Person.objects.get(pk=self.person.pk)
+        first.first_name = "Anne"
+        first.save()
+        second.last_name = "Jones"
+        with self.assertRaises(VersionConflict), transaction.atomic():
+            second.save()
+        self.assertEqual(second.version, 1)
+        self.person.refresh_from_db()
+        self.assertEqual(
+            (self.person.first_name, self.person.last_name), ("Anne", "Smith")
+        )
+
+    def test_etag(self):
+        """Test the detail carries the version as ETag."""
+        url = f"/api/person/{self.person.pk}/"
+        response = self.client.get(url)
+        self.assertEqual(response.data["version"], 1)
+        self.assertEqual(response["ETag"], f'"{self.person.pk}.1"')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_if_match(self):
+        """Test updates with a stale If-Match get 409 and the current state."""
+        url = f"/api/person/{self.person.pk}/"
+        etag = self.client.get(url)["ETag"]
+        response = self.client.patch(
+            url, {"first_name": "Anne"}, format="json", HTTP_IF_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["version"], 2)
+
+        response = self.client.patch(
+            url, {"last_name": "Jones"}, format="json", HTTP_IF_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data["current"]["first_name"], "Anne")
+        self.assertEqual(response["ETag"], f'"{self.person.pk}.2"')
+
+        response = self.client.delete(url, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        response = self.client.patch(
+            url, {"last_name": "Jones"}, format="json", HTTP_IF_MATCH="nope"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_version_in_body(self):
+        """Test the version can also be sent with the data."""
+        url = f"/api/person/{self.person.pk}/"
+        response = self.client.patch(
+            url, {"first_name": "Anne", "version": 1}, format="json"
+        )
+        self.assertEqual(response.data["version"], 2)
+        response = self.client.patch(
+            url, {"first_name": "Ann", "version": 1}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_conflicting_write_between_read_and_save(self):
+        """Test an edit racing with the request is caught by the UPDATE."""
+        url = f"/api/person/{self.person.pk}/"
+        original = PersonSerializer.is_valid
+
+        def _racing_is_valid(serializer, **kwargs):
+            Person.objects.get(pk=serializer.instance.pk).save()
+            return original(serializer, **kwargs)
+
+        with mock.patch.object(PersonSerializer, "is_valid", _racing_is_valid):
+            response = self.client.patch(url, {"first_name": "Anne"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data["current"]["version"], 2)
+
+
+# ==================== Upsert Tests ====================
+class PersonUpsertTestCase(TestCase):
+    """Test cases for the bulk upsert keyed by external ids."""
+
+    def setUp(self):
+        """Set up a batch of three generations."""
+        cache.clear()
+        self.client = APIClient()
+        self.batch = {
+            "source": "archive",
+            "persons": [
+                {"external_id": "c", "first_name": "Carl", "mother": "m"},
+                {
+                    "external_id": "m",
+                    "first_name": "Maria",
+                    "gender": "F",
+                    "date_of_birth": "1900-01-01",
+                    "place_of_birth": "Leipzig",
+                    "mother": "g",
+                },
+                {"external_id": "g", "first_name": "Greta", "gender": "F"},
+            ],
+        }
+
+    def _post(self, batch):
+        return self.client.post("/api/person/upsert/", batch, format="json")
+
+    def test_creates_persons_and_links(self):
+        """Test new records are created with parents resolved by external id."""
+        response = self._post(self.batch)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["created"], 3)
+        ids = response.data["ids"]
+        carl = Person.objects.get(pk=ids["c"])
+        self.assertEqual(carl.mother_id, ids["m"])
+        self.assertEqual(carl.mother.mother_id, ids["g"])
+        self.assertEqual(carl.mother.birth_place.name, "Leipzig")
+        self.assertEqual(ExternalId.objects.filter(source="archive").count(), 3)
+        self.assertTrue(
+            PersonAncestry.objects.filter(
+                ancestor_id=ids["g"], descendant_id=ids["c"]
+            ).exists()
+        )
+        self.assertEqual(person_stats.check(), [])
+        self.assertEqual(
+            list(intervals.alive_on(date(1950, 1, 1)).values_list("pk", flat=True)),
+            [ids["m"]],
+        )
+
+    def test_replay_changes_nothing(self):
+        """Test replaying a batch only costs the lookups."""
+        ids = self._post(self.batch).data["ids"]
+        with CaptureQueriesContext(connection) as queries:
+            result = upsert.upsert("archive", self._records())
+        self.assertEqual(result["unchanged"], 3)
+        self.assertEqual(result["ids"], ids)
+        writes = [
+            q["sql"] for q in queries if not q["sql"].lstrip().startswith("SELECT")
+        ]
+        self.assertEqual([sql for sql in writes if "SAVEPOINT" not in sql], [], writes)
+        self.assertEqual(Person.objects.get(pk=ids["m"]).version, 1)
+
+    def _records(self):
+        from persons.serializers import PersonUpsertSerializer
+
+        serializer = PersonUpsertSerializer(data=self.batch)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data["persons"]
+
+    def test_updates_changed_records(self):
+        """Test only changed records are updated, keeping omitted fields."""
+        ids = self._post(self.batch).data["ids"]
+        response = self._post(
+            {
+                "source": "archive",
+                "persons": [
+                    {"external_id": "m", "date_of_death": "1970-01-01"},
+                    {"external_id": "c", "mother": None},
+                ],
+            }
+        )
+        self.assertEqual(response.data["updated"], 2)
+        self.assertEqual(response.data["unchanged"], 0)
+        maria = Person.objects.get(pk=ids["m"])
+        self.assertEqual(maria.first_name, "Maria")
+        self.assertEqual(maria.version, 2)
+        self.assertIsNone(Person.objects.get(pk=ids["c"]).mother_id)
+        self.assertFalse(PersonAncestry.objects.filter(descendant_id=ids["c"]).exists())
+        self.assertEqual(person_stats.check(), [])
+
+    def test_rejects_unknown_parents_and_cycles(self):
+        """Test invalid batches are rejected without writing anything."""
+        response = self._post(
+            {"source": "archive", "persons": [{"external_id": "a", "father": "x"}]}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self._post(self.batch)
+        response = self._post(
+            {"source": "archive", "persons": [{"external_id": "g", "mother": "c"}]}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("own ancestor", response.data["error"])
+        self.assertEqual(Person.objects.count(), 3)
+
+    def test_sources_are_separate(self):
+        """Test the same external id of another source is another person."""
+        first = self._post(self.batch).data["ids"]
+        self.batch["source"] = "other"
+        second = self._post(self.batch).data["ids"]
+        self.assertNotEqual(first["c"], second["c"])
+        self.assertEqual(Person.objects.count(), 6)
+
+    def test_concurrent_creation_is_retried(self):
+        """Test ids created by a concurrent upsert are updated, not a 500."""
+        first = self._post(self.batch).data["ids"]
+        self.batch["persons"][2]["first_name"] = "Gretel"
+        lookup = upsert._lookup
+        # The first lookup misses the ids, as if they were being created.
+        stale = [{}]
+
+        def _lookup(*args):
+            return stale.pop() if stale else lookup(*args)
+
+        with mock.patch("persons.upsert._lookup", side_effect=_lookup):
+            response = self._post(self.batch)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["ids"], first)
+        self.assertEqual(response.data["updated"], 1)
+        self.assertEqual(Person.objects.count(), 3)
+        self.assertEqual(Person.objects.get(pk=first["g"]).first_name, "Gretel")
+
+
+# ==================== History Tests ====================
+class PersonHistoryTestCase(TestCase):
+    """Test cases for the change history and point-in-time requests."""
+
+    def setUp(self):
+        """Set up a mother, recorded on 2020-01-01."""
+        self.client = APIClient()
+        self.mother = Person.objects.create(first_name="Anna", gender="F")
+        self._date_last_change(self.mother, "2020-01-01T12:00:00Z")
+
+    def _date_last_change(self, person, moment):
+        change = PersonChange.objects.filter(person_id=person.pk).latest("version")
+        change.changed_on = moment
+        change.save()
+
+    def test_records_diffs(self):
+        """Test saves record the changed fields only."""
+        self.mother.last_name = "Smith"
+        self.mother.save()
+        self.mother.save()
+        response = self.client.get(f"/api/person/{self.mother.pk}/history/")
+        self.assertEqual(response.data["count"], 2)
+        latest, created = response.data["changes"]
+        self.assertEqual(latest["kind"], PersonChange.UPDATED)
+        self.assertEqual(latest["changes"], {"last_name": "Smith"})
+        self.assertFalse(latest["snapshot"])
+        self.assertEqual(created["kind"], PersonChange.CREATED)
+        self.assertTrue(created["snapshot"])
+
+    def test_history_outlives_the_person(self):
+        """Test the history of a deleted person is kept."""
+        pk = self.mother.pk
+        self.mother.delete()
+        response = self.client.get(f"/api/person/{pk}/history/")
+        self.assertEqual(response.data["changes"][0]["kind"], PersonChange.DELETED)
+        self.assertEqual(
+            self.client.get("/api/person/999/history/").status_code,
+            status.HTTP_404_NOT_FOUND,
+        )
+
+    @override_settings(HISTORY_SNAPSHOT_INTERVAL=3)
+    def test_rebuilds_from_nearest_snapshot(self):
+        """Test past states are rebuilt from a snapshot and later diffs."""
+        for year in range(2021, 2029):
+            self.mother.first_name = f"Anna {year}"
+            self.mother.save()
+            self._date_last_change(self.mother, f"{year}-01-01T12:00:00Z")
+        self.assertEqual(PersonChange.objects.filter(snapshot__isnull=False).count(), 3)
+        for year in range(2021, 2029):
+            as_of = history.parse_as_of(f"{year}-06-01")
+            state = history.states_at(as_of, [self.mother.pk])[self.mother.pk]
+            self.assertEqual(state["first_name"], f"Anna {year}")
+        self.assertEqual(
+            history.states_at(history.parse_as_of("2020-06-01"))[self.mother.pk][
+                "first_name"
+            ],
+            "Anna",
+        )
+        self.assertEqual(history.states_at(history.parse_as_of("2019-01-01")), {})
+
+    def test_as_of_endpoints(self):
+        """Test the detail, list and neighborhood at a past date."""
+        child = Person.objects.create(first_name="Ben")
+        self._date_last_change(child, "2021-01-01T12:00:00Z")
+        child.mother = self.mother
+        child.save()
+        self.mother.first_name = "Anne"
+        self.mother.save()
+
+        url = f"/api/person/{self.mother.pk}/"
+        response = self.client.get(url, {"as_of": "2021-06-01"})
+        self.assertEqual(response.data["first_name"], "Anna")
+        response = self.client.get(url, {"as_of": "2019-06-01"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.get("/api/person/", {"as_of": "2020-06-01"})
+        self.assertEqual([p["first_name"] for p in response.data], ["Anna"])
+        response = self.client.get(
+            "/api/person/", {"as_of": "2020-06-01", "ordering": "age"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(
+            f"{url}neighborhood/", {"as_of": "2021-06-01", "down": 1}
+        )
+        self.assertEqual(response.data["descendants"], [])
+        response = self.client.get(f"{url}neighborhood/", {"down": 1})
+        self.assertEqual(response.data["descendants"], [child.pk])
+        response = self.client.get(f"{url}layout/", {"as_of": "2021-06-01"})
+        self.assertEqual(len(response.data["nodes"]), 1)
+
+    def test_baseline(self):
+        """Test persons without history get a snapshot."""
+        PersonChange.objects.all().delete()
+        call_command("snapshot_history", stdout=io.StringIO())
+        call_command("snapshot_history", stdout=io.StringIO())
+        change = PersonChange.objects.get()
+        self.assertEqual(change.snapshot["first_name"], "Anna")
+
+    def test_upsert_records_history(self):
+        """Test bulk upserts are recorded like saves."""
+        records = [{"external_id": "a", "first_name": "Ada"}]
+        pk = upsert.upsert("archive", records)["ids"]["a"]
+        upsert.upsert("archive", [{"external_id": "a", "first_name": "Ida"}])
+        upsert.upsert("archive", [{"external_id": "a", "first_name": "Ida"}])
+        changes = PersonChange.objects.filter(person_id=pk).order_by("version")
+        self.assertEqual(
+            [(c.version, c.diff.get("first_name")) for c in changes],
+            [(1, "Ada"), (2, "Ida")],
+        )
+
+
+# ==================== Merge Tests ====================
+class PersonMergeTestCase(TestCase):
+    """Test cases for comparing and merging two overlapping branches."""
+
+    def setUp(self):
+        """Set up the same family entered twice, each copy knowing more."""
+        self.client = APIClient()
+        self.maria = Person.objects.create(
+            first_name="Maria",
+            last_name="Weber",
+            gender="F",
+            date_of_birth=date(1825, 3, 1),
+        )
+        self.johann = Person.objects.create(
+            first_name="Johann",
+            last_name="Weber",
+            gender="M",
+            date_of_birth=date(1850, 5, 2),
+            mother=self.maria,
+        )
+        self.karl = Person.objects.create(
+            first_name="Karl",
+            last_name="Weber",
+            gender="M",
+            date_of_birth=date(1880, 1, 1),
+            father=self.johann,
+        )
+        # The second copy.
+        self.maria2 = Person.objects.create(
+            first_name="Maria",
+            last_name="Weber",
+            gender="F",
+            date_of_birth=date(1826, 3, 1),
+            date_of_death=date(1890, 1, 1),
+        )
+        self.friedrich = Person.objects.create(
+            first_name="Friedrich", last_name="Weber", gender="M"
+        )
+        self.johann2 = Person.objects.create(
+            first_name="Johan",
+            last_name="Weber",
+            gender="M",
+            date_of_birth=date(1850, 5, 2),
+            date_of_death=date(1920, 4, 4),
+            place_of_birth="Leipzig",
+            mother=self.maria2,
+            father=self.friedrich,
+        )
+        self.karl2 = Person.objects.create(
+            first_name="Karl",
+            last_name="Weber",
+            gender="M",
+            date_of_birth=date(1880, 2, 2),
+            father=self.johann2,
+        )
+        self.emma = Person.objects.create(
+            first_name="Emma",
+            last_name="Weber",
+            gender="F",
+            date_of_birth=date(1885, 6, 6),
+            father=self.johann2,
+        )
+        self.otto = Person.objects.create(first_name="Otto", father=self.karl2)
+        ExternalId.objects.create(
+            source="archive", external_id="J", person=self.johann2
+        )
+
+    def test_diff(self):
+        """Test the branches are aligned by position and similarity."""
+        with CaptureQueriesContext(connection) as queries:
+            result = merge.diff(self.johann, self.johann2, up=2, down=2)
+        # One query per generation and direction, whatever the branch size.
+        self.assertLessEqual(len(queries), 5)
+        self.assertEqual(
+            {(m["target"], m["source"]) for m in result["matched"]},
+            {
+                (self.johann.id, self.johann2.id),
+                (self.maria.id, self.maria2.id),
+                (self.karl.id, self.karl2.id),
+            },
+        )
+        changed = {c["target"]: c["fields"] for c in result["changed"]}
+        self.assertEqual(
+            changed[self.johann.id],
+            {
+                "date_of_death": date(1920, 4, 4),
+                "place_of_birth": "Leipzig",
+                "father": self.friedrich.id,
+            },
+        )
+        self.assertEqual(changed[self.maria.id], {"date_of_death": date(1890, 1, 1)})
+        conflicting = {c["target"]: c["fields"] for c in result["conflicting"]}
+        self.assertEqual(
+            conflicting,
+            {
+                self.johann.id: {"first_name": {"target": "Johann", "source": "Johan"}},
+                self.maria.id: {
+                    "date_of_birth": {
+                        "target": date(1825, 3, 1),
+                        "source": date(1826, 3, 1),
+                    }
+                },
+                self.karl.id: {
+                    "date_of_birth": {
+                        "target": date(1880, 1, 1),
+                        "source": date(1880, 2, 2),
+                    }
+                },
+            },
+        )
+        self.assertCountEqual(
+            result["added"],
+            [
+                {
+                    "person": self.friedrich.id,
+                    "relation": "father",
+                    "of": self.johann.id,
+                },
+                {"person": self.emma.id, "relation": "child", "of": self.johann.id},
+                {"person": self.otto.id, "relation": "child", "of": self.karl.id},
+            ],
+        )
+
+    def test_merge(self):
+        """Test a merge re-points the links and removes the duplicates."""
+        result = merge.merge(
+            self.johann, self.johann2, prefer={self.karl.id: ["date_of_birth"]}
+        )
+        self.assertEqual(result, {"merged": 3, "updated": 5, "relinked": 3})
+        self.assertFalse(
+            Person.objects.filter(
+                pk__in=[self.johann2.id, self.maria2.id, self.karl2.id]
+            ).exists()
+        )
+        johann = Person.objects.get(pk=self.johann.id)
+        self.assertEqual(johann.first_name, "Johann")
+        self.assertEqual(johann.date_of_death, date(1920, 4, 4))
+        self.assertEqual(johann.birth_place.name, "Leipzig")
+        self.assertEqual(johann.father_id, self.friedrich.id)
+        self.assertEqual(johann.version, 2)
+        karl = Person.objects.get(pk=self.karl.id)
+        self.assertEqual(karl.date_of_birth, date(1880, 2, 2))
+        self.assertEqual(Person.objects.get(pk=self.emma.id).father_id, johann.id)
+        self.assertEqual(Person.objects.get(pk=self.otto.id).father_id, karl.id)
+        self.assertEqual(ExternalId.objects.get(external_id="J").person_id, johann.id)
+        self.assertEqual(PersonChange.objects.filter(person_id=johann.id).count(), 2)
+
+        stored = set(
+            PersonAncestry.objects.values_list("ancestor_id", "descendant_id", "paths")
+        )
+        ancestry.rebuild()
+        self.assertEqual(
+            stored,
+            set(
+                PersonAncestry.objects.values_list(
+                    "ancestor_id", "descendant_id", "paths"
+                )
+            ),
+        )
+        self.assertEqual(
+            PersonLineage.objects.get(person=self.friedrich).descendants, 4
+        )
+
+    def test_merge_accounts(self):
+        """Test accounts move, and both sides linked need a preference."""
+        anna, bert, carl = (
+            User.objects.create_user(username=name) for name in ("anna", "bert", "carl")
+        )
+        for person, user in (
+            (self.johann2, anna),
+            (self.karl, bert),
+            (self.karl2, carl),
+        ):
+            person.user_account = user
+            person.save()
+        with self.assertRaises(ValueError):
+            merge.merge(self.johann, self.johann2)
+        self.assertEqual(Person.objects.get(pk=self.karl.id).user_account, bert)
+
+        with mock.patch("persons.merge.accounts.forget") as forget:
+            merge.merge(
+                self.johann, self.johann2, prefer={self.karl.id: ["user_account_id"]}
+            )
+        self.assertEqual(Person.objects.get(pk=self.johann.id).user_account, anna)
+        self.assertEqual(Person.objects.get(pk=self.karl.id).user_account, carl)
+        self.assertFalse(Person.objects.filter(user_account=bert).exists())
+        forgotten = {pk for call in forget.call_args_list for pk in call.args}
+        self.assertLessEqual({anna.pk, bert.pk, carl.pk}, forgotten)
+        # The duplicates gave up their accounts in a recorded change.
+        unlinked = PersonChange.objects.get(
+            person_id=self.johann2.id, diff={"user_account_id": None}
+        )
+        self.assertEqual(unlinked.version, 3)
+        self.assertIsInstance(self.johann.version, int)
+
+    def test_api(self):
+        """Test the diff and merge endpoints."""
+        url = f"/api/person/{self.johann.id}/merge/{self.johann2.id}/"
+        response = self.client.get(url, {"down": 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["matched"]), 3)
+
+        response = self.client.get(
+            f"/api/person/{self.johann.id}/merge/{self.karl.id}/"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(
+            url, {"prefer": {str(self.karl.id): ["tree"]}}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(Person.objects.filter(pk=self.johann2.id).exists())
+
+        response = self.client.post(url, {}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["merged"], 3)
+        self.assertEqual(
+            Person.objects.get(pk=self.karl.id).date_of_birth, date(1880, 1, 1)
+        )
+
+
 # ==================== Serializer Tests ====================
 class PersonSerializerTestCase(TestCase):
     """Test cases for PersonSerializer."""
@@ -287,6 +2571,8 @@ class PersonSerializerTestCase(TestCase):
             "father",
             "gender",
             "user_account",
+            "tree",
+            "version",
         ]
         self.assertEqual(set(data.keys()), set(expected_fields))
 
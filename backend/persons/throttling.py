@@ -0,0 +1,58 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _scopes(request, username):
+    """
+    Returns (cache key, attempts allowed, window in seconds) for the client
+    IP and the username of a login attempt.
+    """
+    ip = request.META.get("REMOTE_ADDR", "")
+    user = hashlib.sha256(username.lower().encode()).hexdigest()[:32]
+    return [
+        (f"persons:login:ip:{ip}", *settings.LOGIN_THROTTLE_IP),
+        (f"persons:login:user:{user}", *settings.LOGIN_THROTTLE_USER),
+    ]
+
+
+def attempt(request, username):
+    """
+    Count a login attempt against the client IP and the username, before the
+    password is checked. Returns the number of seconds the client has to wait
+    if it went over a limit, or 0 if it may go on.
+
+    Each count is a single add or incr, which the cache backends apply
+    atomically, so concurrent attempts cannot slip past a limit between
+    reading and updating it. (The async cache methods of Django 4.2 emulate
+    incr with a get and a set; call this through sync_to_async instead.)
+    """
+    wait = 0
+    for key, limit, window in _scopes(request, username):
+        # The first attempt opens a fixed window that expires on its own.
+        if cache.add(key, 1, window):
+            count = 1
+        else:
+            try:
+                count = cache.incr(key)
+            except ValueError:
+                # Expired in between.
+                cache.set(key, 1, window)
+                count = 1
+        if count > limit:
+            wait = max(wait, window)
+    return wait
+
+
+def reset(request, username):
+    """
+    After a successful login, forget the attempts on the username and take
+    the successful one back from the client IP.
+    """
+    (ip_key, _, _), (user_key, _, _) = _scopes(request, username)
+    cache.delete(user_key)
+    try:
+        cache.decr(ip_key)
+    except ValueError:
+        pass
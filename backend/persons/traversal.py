@@ -0,0 +1,138 @@
+from django.db.models import Q
+
+from . import history
+from .models import Person
+
+# Upper bound for the `up` and `down` parameters of a neighborhood request.
+MAX_DEPTH = 10
+
+
+def _fetch(tree, query):
+    """
+    Returns the persons of family tree `tree` (0 for none) matching `query`
+    with everything the serializer needs.
+    """
+    persons = Person.objects.for_tree(tree).filter(query)
+    return list(persons.select_related("user_account"))
+
+
+def _persons(tree, pks, as_of):
+    if as_of is not None:
+        return history.persons_at(as_of, pks, tree=tree)
+    return _fetch(tree, Q(pk__in=pks))
+
+
+def _children(tree, pks, as_of):
+    if as_of is not None:
+        found = history.children_at(as_of, pks)
+        return [child for child in found if (child.tree_id or 0) == tree]
+    return _fetch(tree, Q(mother_id__in=pks) | Q(father_id__in=pks))
+
+
+def neighborhood(person, up=3, down=2, siblings=True, as_of=None):
+    """
+    Collect the persons around a focal person.
+
+    The window is walked generation by generation, so the number of SQL
+    queries depends on `up` and `down` only, never on the size of the tree:
+    one query per ancestor generation, one per descendant generation, one for
+    the siblings and one for the spouses.
+
+    Parameters:
+    -----------
+    person : Person
+        The focal person.
+    up : int
+        Number of ancestor generations to include.
+    down : int
+        Number of descendant generations to include.
+    siblings : bool
+        Whether to include full and half siblings of the focal person.
+    as_of : datetime, optional
+        Walk the tree as it was at that moment, rebuilt from the history
+        (`person` should be the focal person as of then, too).
+
+    Returns:
+    --------
+    dict
+        A dictionary containing:
+        - persons: every person in the window, de-duplicated
+        - generation: person id -> generation relative to the focal person
+        - ancestors, descendants, siblings, spouses: lists of person ids
+
+    A person reachable over several paths (pedigree collapse) is reported
+    once, at the generation where it was reached first. Spouses are the
+    other parents of children inside the window. Links leaving the family
+    tree of the focal person are not followed.
+    """
+    tree = person.tree_id or 0
+    persons = {person.pk: person}
+    generation = {person.pk: 0}
+    relations = {"ancestors": [], "descendants": [], "siblings": [], "spouses": []}
+
+    # --- Ancestors ---
+    frontier = [person]
+    for level in range(1, up + 1):
+        parent_ids = {
+            parent_id
+            for p in frontier
+            for parent_id in (p.mother_id, p.father_id)
+            if parent_id and parent_id not in persons
+        }
+        if not parent_ids:
+            break
+        frontier = _persons(tree, parent_ids, as_of)
+        for parent in frontier:
+            persons[parent.pk] = parent
+            generation[parent.pk] = -level
+            relations["ancestors"].append(parent.pk)
+
+    # --- Descendants ---
+    frontier_ids = [person.pk]
+    spouse_generation = {}
+    for level in range(1, down + 1):
+        children = _children(tree, frontier_ids, as_of)
+        frontier_ids = []
+        for child in children:
+            for parent_id in (child.mother_id, child.father_id):
+                if parent_id and parent_id not in persons:
+                    spouse_generation.setdefault(parent_id, level - 1)
+            if child.pk in persons:
+                continue
+            persons[child.pk] = child
+            generation[child.pk] = level
+            relations["descendants"].append(child.pk)
+            frontier_ids.append(child.pk)
+        if not frontier_ids:
+            break
+
+    # --- Siblings ---
+    if siblings and (person.mother_id or person.father_id):
+        if as_of is not None:
+            found = _children(
+                tree, [pk for pk in (person.mother_id, person.father_id) if pk], as_of
+            )
+        else:
+            query = Q()
+            if person.mother_id:
+                query |= Q(mother_id=person.mother_id)
+            if person.father_id:
+                query |= Q(father_id=person.father_id)
+            found = _fetch(tree, query & ~Q(pk=person.pk))
+        for sibling in found:
+            if sibling.pk in persons:
+                continue
+            persons[sibling.pk] = sibling
+            generation[sibling.pk] = 0
+            relations["siblings"].append(sibling.pk)
+
+    # --- Spouses ---
+    spouse_ids = [pk for pk in spouse_generation if pk not in persons]
+    if spouse_ids:
+        for spouse in _persons(tree, spouse_ids, as_of):
+            persons[spouse.pk] = spouse
+            generation[spouse.pk] = spouse_generation[spouse.pk]
+            relations["spouses"].append(spouse.pk)
+
+    ordered = sorted(persons.values(), key=lambda p: (generation[p.pk], p.pk))
+    return {"persons": ordered, "generation": generation, **relations}
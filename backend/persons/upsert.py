@@ -0,0 +1,318 @@
+from datetime import date
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from . import accounts, ancestry, history, intervals, jobs, lineage, revisions, stats
+from .models import ExternalId, Person, PersonChange, Place
+from .signals import GRAPH_FIELDS
+
+# Person fields a record can set, besides the parents.
+FIELDS = (
+    "first_name",
+    "middle_name",
+    "last_name",
+    "birth_name",
+    "artist_name",
+    "date_of_birth",
+    "place_of_birth",
+    "date_of_death",
+    "place_of_death",
+    "cause_of_death",
+    "gender",
+)
+# Parent fields of a record, given as external ids of the same source.
+PARENTS = (("mother", "mother_id"), ("father", "father_id"))
+# Free-text place fields and the normalized places resolved from them.
+PLACES = (("place_of_birth", "birth_place"), ("place_of_death", "death_place"))
+# Values kept from before a bulk write to update the derived tables.
+TRACKED = tuple(
+    {
+        *stats.FIELDS,
+        *intervals.FIELDS,
+        *ancestry.FIELDS,
+        *GRAPH_FIELDS,
+        *history.FIELDS,
+        "version",
+    }
+)
+# Attempts of an upsert racing others that create the same external ids.
+ATTEMPTS = 3
+
+
+class _Taken(Exception):
+    """An external id was created by a concurrent upsert since the lookup."""
+
+
+def _chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        end = start + size
+        yield items[start:end]
+
+
+def _lookup(source, external_ids, batch_size):
+    """Returns {external id: person id} for the known ids, in batches."""
+    mapped = {}
+    for chunk in _chunks(external_ids, batch_size):
+        mapped.update(
+            ExternalId.objects.filter(source=source, external_id__in=chunk).values_list(
+                "external_id", "person_id"
+            )
+        )
+    return mapped
+
+
+def _load(pks, batch_size):
+    """
+    Returns {id: person}, locked until the upsert commits: a PATCH in
+    between would be overwritten, and replayed from stale values into the
+    derived tables. Concurrent PATCHes wait and then fail on the version.
+    """
+    persons = {}
+    rows = Person.objects.select_for_update()
+    for chunk in _chunks(pks, batch_size):
+        persons.update((p.pk, p) for p in rows.filter(pk__in=chunk))
+    return persons
+
+
+class _PlaceResolver:
+    """Resolves each place name of a batch once."""
+
+    def __init__(self):
+        self._places = {}
+
+    def __call__(self, person, fields):
+        for text_field, place_field in PLACES:
+            if text_field in fields:
+                text = getattr(person, text_field)
+                if text not in self._places:
+                    self._places[text] = Place.objects.resolve(text)
+                setattr(person, place_field, self._places[text])
+                fields.add(place_field)
+
+
+def upsert(source, records, tree=0, batch_size=None):
+    """
+    Create or update the persons of an external `source` from `records`.
+
+    Each record is a dict of person fields with an "external_id" and, as
+    external ids of the same source, an optional "mother" and "father".
+    Fields missing from a record are left as they are. The records belong
+    to family tree `tree`, 0 for the persons without a tree; None lets
+    them update persons of any tree (for staff), new ones going to none.
+
+    Existing persons are found with batched lookups on ExternalId and
+    written with bulk_create / bulk_update, so only new or changed records
+    cost writes: replaying a batch issues the lookups and nothing else. As
+    bulk writes send no signals, the summaries, the lifespan and ancestry
+    indexes, the lineage counts, the places, the history and the revision
+    counters are updated here.
+
+    Returns {"created", "updated", "unchanged", "ids"}, `ids` mapping the
+    external ids of the records to person ids. Raises ValueError (and
+    writes nothing) for duplicate records, unknown parents, persons or
+    parents of another family tree and parent links forming a cycle.
+
+    When a concurrent upsert creates some of the same external ids first,
+    the batch is rolled back and run again, updating those persons instead.
+    """
+    for attempt in range(1, ATTEMPTS + 1):
+        try:
+            return _upsert(source, records, tree, batch_size)
+        except _Taken as e:
+            if attempt == ATTEMPTS:
+                raise e.__cause__
+
+
+@transaction.atomic
+def _upsert(source, records, tree, batch_size):
+    batch_size = batch_size or settings.UPSERT_BATCH_SIZE
+    by_id = {}
+    for record in records:
+        key = record["external_id"]
+        if key in by_id:
+            raise ValueError(f"Duplicate external id '{key}'")
+        by_id[key] = record
+    referenced = {
+        record[field] for record in records for field, _ in PARENTS if record.get(field)
+    }
+    ids = _lookup(source, set(by_id) | referenced, batch_size)
+    unknown = referenced - set(by_id) - set(ids)
+    if unknown:
+        raise ValueError(f"Unknown parent external ids: {', '.join(sorted(unknown))}")
+    persons = _load(ids.values(), batch_size)
+    for key in by_id.keys() & ids.keys():
+        if tree is not None and (persons[ids[key]].tree_id or 0) != tree:
+            raise ValueError(f"Person '{key}' belongs to another family tree")
+
+    # Insert the new persons without parents first, as those may be new too.
+    resolve_places = _PlaceResolver()
+    new_keys = [key for key in by_id if key not in ids]
+    created = []
+    for key in new_keys:
+        fields = {f: v for f, v in by_id[key].items() if f in FIELDS}
+        person = Person(tree_id=tree or None, **fields)
+        resolve_places(person, set(fields))
+        created.append(person)
+    Person.objects.bulk_create(created, batch_size=batch_size)
+    try:
+        ExternalId.objects.bulk_create(
+            [
+                ExternalId(source=source, external_id=key, person_id=person.pk)
+                for key, person in zip(new_keys, created)
+            ],
+            batch_size=batch_size,
+        )
+    except IntegrityError as e:
+        raise _Taken() from e
+    ids.update((key, person.pk) for key, person in zip(new_keys, created))
+    persons.update((person.pk, person) for person in created)
+    created_pks = {person.pk for person in created}
+
+    written, written_fields, before = [], set(), {}
+    for key, record in by_id.items():
+        person = persons[ids[key]]
+        values = {f: getattr(person, f) for f in TRACKED}
+        fields = set()
+        if person.pk not in created_pks:
+            for field, value in record.items():
+                if field in FIELDS and getattr(person, field) != value:
+                    setattr(person, field, value)
+                    fields.add(field)
+            resolve_places(person, fields)
+        for field, attname in PARENTS:
+            if field in record:
+                parent = ids[record[field]] if record[field] else None
+                if getattr(person, attname) != parent:
+                    setattr(person, attname, parent)
+                    fields.add(attname)
+        if fields:
+            written.append(person)
+            written_fields |= fields
+        if fields or person.pk in created_pks:
+            before[person.pk] = values
+
+    relinked = {}
+    for pk, values in before.items():
+        parents = [getattr(persons[pk], attname) for _, attname in PARENTS]
+        if parents != [values[attname] for _, attname in PARENTS]:
+            relinked[pk] = parents
+    _check_parents(ids, persons, relinked)
+
+    updated = [person for person in written if person.pk not in created_pks]
+    if updated:
+        written_fields |= {"modified_on", "version"}
+    for person in updated:
+        person.modified_on = date.today()
+        person.version = F("version") + 1
+    if written:
+        Person.objects.bulk_update(written, written_fields, batch_size=batch_size)
+
+    refresh_derived(created_pks, [persons[pk] for pk in before], before)
+    return {
+        "created": len(created),
+        "updated": len(updated),
+        "unchanged": len(by_id) - len(created) - len(updated),
+        "ids": {key: ids[key] for key in by_id},
+    }
+
+
+def _check_parents(ids, persons, relinked):
+    """
+    Reject parents from another family tree, and parent links closing a
+    cycle with the existing tree or within the batch. `relinked` maps the
+    persons whose parents change to their new parent ids.
+    """
+    keys = {pk: key for key, pk in ids.items()}
+    for pk, parents in relinked.items():
+        if any(p and persons[p].tree_id != persons[pk].tree_id for p in parents):
+            raise ValueError(
+                f"Parents of '{keys[pk]}' must belong to the same family tree"
+            )
+    cyclic = ancestry.cyclic_assignments(relinked)
+    if cyclic:
+        names = ", ".join(sorted(keys[pk] for pk in cyclic))
+        raise ValueError(f"A person cannot be their own ancestor: {names}")
+
+
+def _refresh_ancestry(created, relinked):
+    """
+    Update the ancestry index and the lineage counts for the `created`
+    persons and the `relinked` ones (mapped to their old parent ids), or
+    queue a refresh job if relinking them is too large to do in place.
+    """
+    cost = sum(ancestry.relink_cost(p, old) for p, old in relinked.items())
+    if ancestry.defer(cost):
+        jobs.submit_once(ancestry.REFRESH_JOB)
+        return
+    # New persons have no descendants in the index yet, so they are added in
+    # one pass; relinking existing ones then also reaches the new ones below.
+    ancestry.add_persons(created)
+    for person, old_parents in relinked.items():
+        ancestry.update_person(person, old_parents)
+    lineage.update_links(
+        [person.pk for person in [*created, *relinked]],
+        [
+            parent
+            for person in [*created, *relinked]
+            for parent in (
+                *relinked.get(person, ()),
+                person.mother_id,
+                person.father_id,
+            )
+        ],
+    )
+
+
+def refresh_derived(created_pks, changed, before):
+    """
+    Do for a whole batch what the Person signals do on save.
+
+    `changed` are the persons written with bulk_create / bulk_update (those
+    in `created_pks` new), `before` maps their ids to their TRACKED values
+    from before the write.
+    """
+    if not changed:
+        return
+
+    def _differs(person, fields):
+        return person.pk in created_pks or any(
+            before[person.pk][f] != getattr(person, f) for f in fields
+        )
+
+    trees = {person.tree_id for person in changed}
+    revisions.bump(revisions.PERSONS, *trees)
+    accounts.forget(*(person.user_account_id for person in changed))
+    stats.record_changes(
+        (
+            None if person.pk in created_pks else before[person.pk],
+            {f: getattr(person, f) for f in stats.FIELDS},
+        )
+        for person in changed
+        if _differs(person, stats.FIELDS)
+    )
+    intervals.update_persons(
+        [person for person in changed if _differs(person, intervals.FIELDS)]
+    )
+    _refresh_ancestry(
+        [person for person in changed if person.pk in created_pks],
+        {
+            person: [before[person.pk][f] for f in ancestry.FIELDS]
+            for person in changed
+            if person.pk not in created_pks and _differs(person, ancestry.FIELDS)
+        },
+    )
+    if any(_differs(person, GRAPH_FIELDS) for person in changed):
+        revisions.bump(revisions.GRAPH, *trees)
+    PersonChange.objects.bulk_create(
+        history.changes(
+            (
+                (person, 1, None)
+                if person.pk in created_pks
+                else (person, before[person.pk]["version"] + 1, before[person.pk])
+            )
+            for person in changed
+        )
+    )
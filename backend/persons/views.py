@@ -1,66 +1,811 @@
-from django.http import JsonResponse
+from datetime import date, timedelta
+
+from django.db import transaction
+from django.http import FileResponse, HttpResponseNotModified, JsonResponse
 from django.middleware.csrf import get_token
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_date
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import Person
-from .serializers import PersonSerializer
+from . import (
+    accounts,
+    consistency,
+    filters,
+    gazetteer,
+    history,
+    intervals,
+    jobs,
+    lineage,
+    merge,
+    places,
+    revisions,
+    stats,
+    upsert,
+)
+from .compression import choose_encoding
+from .graph import compressed_snapshot_path, snapshot_path
+from .layout import tree_layout
+from .models import (
+    FamilyTree,
+    Job,
+    Person,
+    PersonChange,
+    PersonLineage,
+    Place,
+    TreeMoving,
+    VersionConflict,
+    compute_ages,
+)
+from .serializers import (
+    JobSerializer,
+    PersonListSerializer,
+    PersonMergeSerializer,
+    PersonSerializer,
+    PersonUpsertSerializer,
+)
+from .traversal import MAX_DEPTH, neighborhood
+
+# Times the graph view looks for a snapshot removed by a concurrent rebuild.
+GRAPH_SNAPSHOT_ATTEMPTS = 3
+
+
+def _int_param(request, name, default, minimum=0, maximum=None):
+    """
+    Read an integer query parameter, raising ValueError when it is invalid.
+    """
+    raw = request.query_params.get(name)
+    if raw in (None, ""):
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        raise ValueError(f"'{name}' must be an integer")
+    if value < minimum or (maximum is not None and value > maximum):
+        if maximum is None:
+            raise ValueError(f"'{name}' must be at least {minimum}")
+        raise ValueError(f"'{name}' must be between {minimum} and {maximum}")
+    return value
+
+
+def _float_param(request, name, default=None):
+    """
+    Read a float query parameter, raising ValueError when it is invalid.
+    """
+    raw = request.query_params.get(name)
+    if raw in (None, ""):
+        return default
+    try:
+        return float(raw)
+    except ValueError:
+        raise ValueError(f"'{name}' must be a number")
+
+
+def _bool_param(request, name, default):
+    """
+    Read a boolean query parameter such as `?siblings=false`.
+    """
+    raw = request.query_params.get(name)
+    if raw in (None, ""):
+        return default
+    return raw.lower() not in ("0", "false", "no", "off")
+
+
+def _tree(request):
+    """
+    Returns the family tree a request works on: the id given as `?tree=`,
+    which must be a tree the user owns (staff may use any). Without it,
+    requests work on the persons outside every tree (0), or for staff on
+    all persons (None).
+
+    Raises ValueError when the parameter is invalid and FamilyTree.DoesNotExist
+    when the tree does not exist or is not the user's.
+    """
+    tree = _int_param(request, "tree", None, minimum=1)
+    user = request.user
+    if tree is None:
+        return None if user.is_staff else 0
+    trees = FamilyTree.objects.filter(pk=tree)
+    if not user.is_staff:
+        if not user.is_authenticated:
+            raise FamilyTree.DoesNotExist
+        trees = trees.filter(owner_id=user.pk)
+    if not trees.exists():
+        raise FamilyTree.DoesNotExist
+    return tree
+
+
+def _persons(request):
+    """
+    Returns the persons a request works on, see `_tree`. Raises like it.
+    """
+    tree = _tree(request)
+    return Person.objects.all() if tree is None else Person.objects.for_tree(tree)
+
+
+def _writable(*trees):
+    """
+    Raise TreeMoving if one of the family tree ids is being moved to another
+    database (see `move_tree`); writes there would be lost.
+    """
+    moving = FamilyTree.objects.filter(pk__in=[t for t in trees if t]).exclude(
+        moving_to=""
+    )
+    tree = moving.values_list("pk", flat=True).first()
+    if tree is not None:
+        raise TreeMoving(tree)
+
+
+def _not_found():
+    return Response({"error": "Person not found"}, status=status.HTTP_404_NOT_FOUND)
+
+
+def _tree_not_found():
+    return Response(
+        {"error": "Family tree not found"}, status=status.HTTP_404_NOT_FOUND
+    )
+
+
+def _tree_moving(error):
+    return Response({"error": str(error)}, status=status.HTTP_409_CONFLICT)
+
+
+def _as_of(request):
+    """Read the `as_of` parameter, raising ValueError when it is invalid."""
+    return history.parse_as_of(request.query_params.get("as_of"))
+
+
+def _person_as_of(request, pk, as_of):
+    """
+    Returns person `pk` as it was at `as_of`, within the `?tree=` scope.
+    Raises Person.DoesNotExist if it did not exist then.
+    """
+    tree = _tree(request)
+    found = history.persons_at(as_of, [pk], tree=tree)
+    if not found:
+        raise Person.DoesNotExist
+    return found[0]
+
+
+def _etag(person):
+    return f'"{person.pk}.{person.version}"'
+
+
+def _if_match(request, person):
+    """
+    Returns the version required by the `If-Match` header, or None when the
+    header is missing or "*". Raises ValueError for tags of another format.
+    """
+    raw = request.headers.get("If-Match", "").strip()
+    if not raw or raw == "*":
+        return None
+    for tag in raw.split(","):
+        pk, _, version = tag.strip().removeprefix("W/").strip('"').partition(".")
+        if not (pk.isdigit() and version.isdigit()):
+            raise ValueError("'If-Match' must be an ETag returned for this person")
+        if int(pk) == person.pk:
+            return int(version)
+    return 0
+
+
+def _person_response(person, **kwargs):
+    response = Response(PersonSerializer(person).data, **kwargs)
+    response["ETag"] = _etag(person)
+    return response
+
+
+def _conflict(person):
+    """
+    Answer a stale update with 409 and the current state of the person.
+    """
+    person = Person.objects.select_related("user_account").get(pk=person.pk)
+    response = Response(
+        {
+            "error": "Person was modified by someone else",
+            "current": PersonSerializer(person).data,
+        },
+        status=status.HTTP_409_CONFLICT,
+    )
+    response["ETag"] = _etag(person)
+    return response
 
 
 class PersonCreateView(APIView):
     @csrf_exempt
     def post(self, request, format=None):
-        serializer = PersonSerializer(data=request.data)
+        try:
+            tree = _tree(request) or None
+            _writable(tree)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FamilyTree.DoesNotExist:
+            return _tree_not_found()
+        except TreeMoving as e:
+            return _tree_moving(e)
+        serializer = PersonSerializer(data=request.data, context={"tree": tree})
         if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=201)
+            serializer.save(tree_id=tree)
+            return _person_response(serializer.instance, status=201)
         return Response(serializer.errors, status=400)
 
     def get(self, request, format=None):
-        persons = Person.objects.all()
-        serializer = PersonSerializer(persons, many=True)
-        return Response(serializer.data)
+        """
+        The person list, filtered and ordered with the syntax of
+        `persons.filters` (`?gender=F&born_after=1900&ordering=-date_of_birth`).
+        Staff can add `?explain=1` to get the SQL and the query plan instead.
+        """
+        today = date.today()
+        try:
+            tree = _tree(request)
+            revision = revisions.current(revisions.PERSONS, tree=tree)
+            as_of = _as_of(request)
+            if as_of is not None:
+                persons = self._persons_as_of(request, as_of)
+            else:
+                persons = filters.filter_persons(
+                    _persons(request).with_ages(today), request.query_params
+                ).select_related("user_account")
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FamilyTree.DoesNotExist:
+            return _tree_not_found()
+        if _bool_param(request, "explain", False):
+            if not request.user.is_staff:
+                return Response(
+                    {"error": "Query plans are only available to staff"},
+                    status=status.HTTP_403_FORBIDDEN,
+                )
+            if as_of is not None:
+                return Response(
+                    {"error": "'explain' cannot be combined with 'as_of'"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            return Response({"query": str(persons.query), "plan": persons.explain()})
+        serializer = PersonListSerializer(persons, many=True)
+        response = Response(serializer.data)
+        response.compression_cache_key = (
+            f"person-list:{revision}:{today}:{request.get_full_path()}"
+        )
+        return response
+
+    def _persons_as_of(self, request, as_of):
+        """
+        The person list as it was at `as_of`, rebuilt from the history, with
+        the ages as of that day. The filters and orderings of the live list
+        run in the database and are not available here.
+        """
+        if filters.is_filtered(request.query_params):
+            raise ValueError("Filters and 'ordering' cannot be combined with 'as_of'")
+        tree = _tree(request)
+        persons = history.persons_at(as_of, tree=tree)
+        ages = compute_ages(
+            [p.date_of_birth for p in persons],
+            [p.date_of_death for p in persons],
+            today=as_of.date(),
+        )
+        for i, person in enumerate(persons):
+            person.age = ages["age"][i]
+            person.age_at_death = ages["age_at_death"][i]
+            days = ages["lifespan_days"][i]
+            person.lifespan = timedelta(days=days) if days is not None else None
+        return persons
+
+
+class PersonUpsertView(APIView):
+    @csrf_exempt
+    def post(self, request, format=None):
+        """
+        Create or update persons by their ids in an external source, given
+        as {"source": ..., "persons": [{"external_id": ..., ...}]}.
+        """
+        try:
+            tree = _tree(request)
+            _writable(tree)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FamilyTree.DoesNotExist:
+            return _tree_not_found()
+        except TreeMoving as e:
+            return _tree_moving(e)
+        serializer = PersonUpsertSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            result = upsert.upsert(
+                serializer.validated_data["source"],
+                serializer.validated_data["persons"],
+                tree=tree,
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FamilyTree.DoesNotExist:
+            return _tree_not_found()
+        return Response(result)
 
 
 class PersonDetailView(APIView):
     @csrf_exempt
     def get(self, request, pk, format=None):
         try:
-            person = Person.objects.get(pk=pk)
-            serializer = PersonSerializer(person)
-            return Response(serializer.data)
+            as_of = _as_of(request)
+            if as_of is not None:
+                person = _person_as_of(request, pk, as_of)
+                return Response(PersonSerializer(person).data)
+            person = _persons(request).select_related("user_account").get(pk=pk)
+            etag = _etag(person)
+            if etag in request.headers.get("If-None-Match", "").replace("W/", ""):
+                return HttpResponseNotModified(headers={"ETag": etag})
+            return _person_response(person)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FamilyTree.DoesNotExist:
+            return _tree_not_found()
         except Person.DoesNotExist:
-            return Response(
-                {"error": "Person not found"}, status=status.HTTP_404_NOT_FOUND
-            )
+            return _not_found()
 
     @csrf_exempt
     def put(self, request, pk, format=None):
+        return self._update(request, pk, partial=False)
+
+    @csrf_exempt
+    def patch(self, request, pk, format=None):
+        return self._update(request, pk, partial=True)
+
+    def _update(self, request, pk, partial):
+        """
+        Update a person without locking it: the write only applies to the
+        version the client read (the `If-Match` ETag or the "version" field,
+        by default the version loaded here), and 409 returns the current
+        state when someone else saved the person in between.
+        """
         try:
-            person = Person.objects.get(pk=pk)
-            serializer = PersonSerializer(person, data=request.data)
+            person = _persons(request).select_related("user_account").get(pk=pk)
+            _writable(person.tree_id)
+            serializer = PersonSerializer(
+                person,
+                data=request.data,
+                partial=partial,
+                context={"version": _if_match(request, person)},
+            )
             if serializer.is_valid():
-                serializer.save()
-                return Response(serializer.data)
+                with transaction.atomic():
+                    serializer.save()
+                return _person_response(serializer.instance)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FamilyTree.DoesNotExist:
+            return _tree_not_found()
         except Person.DoesNotExist:
-            return Response(
-                {"error": "Person not found"}, status=status.HTTP_404_NOT_FOUND
-            )
+            return _not_found()
+        except VersionConflict as e:
+            return _conflict(e.person)
+        except TreeMoving as e:
+            return _tree_moving(e)
 
     @csrf_exempt
     def delete(self, request, pk, format=None):
         try:
-            person = Person.objects.get(pk=pk)
+            person = _persons(request).get(pk=pk)
+            _writable(person.tree_id)
+            expected = _if_match(request, person)
+            if expected is not None and expected != person.version:
+                return _conflict(person)
             person.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FamilyTree.DoesNotExist:
+            return _tree_not_found()
         except Person.DoesNotExist:
+            return _not_found()
+        except TreeMoving as e:
+            return _tree_moving(e)
+
+
+class PersonNeighborhoodView(APIView):
+    def get(self, request, pk, format=None):
+        try:
+            up = _int_param(request, "up", 3, maximum=MAX_DEPTH)
+            down = _int_param(request, "down", 2, maximum=MAX_DEPTH)
+            persons = _persons(request)
+            as_of = _as_of(request)
+            if as_of is not None:
+                person = _person_as_of(request, pk, as_of)
+            else:
+                person = persons.select_related("user_account").get(pk=pk)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FamilyTree.DoesNotExist:
+            return _tree_not_found()
+        except Person.DoesNotExist:
+            return _not_found()
+        siblings = _bool_param(request, "siblings", True)
+
+        window = neighborhood(person, up=up, down=down, siblings=siblings, as_of=as_of)
+        # The counts of the cards are kept for the current tree only.
+        counts = {}
+        if as_of is None:
+            counts = {
+                row.pop("person"): row
+                for row in PersonLineage.objects.filter(
+                    person__in=[p.pk for p in window["persons"]]
+                ).values("person", *lineage.FIELDS)
+            }
+        return Response(
+            {
+                "focal": person.pk,
+                "up": up,
+                "down": down,
+                "persons": PersonSerializer(window["persons"], many=True).data,
+                "generation": window["generation"],
+                "ancestors": window["ancestors"],
+                "descendants": window["descendants"],
+                "siblings": window["siblings"],
+                "spouses": window["spouses"],
+                "lineage": counts,
+            }
+        )
+
+
+class PersonLayoutView(APIView):
+    def get(self, request, pk, format=None):
+        try:
+            up = _int_param(request, "up", 3, maximum=MAX_DEPTH)
+            down = _int_param(request, "down", 2, maximum=MAX_DEPTH)
+            persons = _persons(request)
+            as_of = _as_of(request)
+            if as_of is not None:
+                person = _person_as_of(request, pk, as_of)
+            else:
+                person = persons.get(pk=pk)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FamilyTree.DoesNotExist:
+            return _tree_not_found()
+        except Person.DoesNotExist:
+            return _not_found()
+        siblings = _bool_param(request, "siblings", True)
+
+        return Response(
+            tree_layout(person, up=up, down=down, siblings=siblings, as_of=as_of)
+        )
+
+
+class PersonHistoryView(APIView):
+    def get(self, request, pk, format=None):
+        """
+        The recorded changes of a person, newest first; kept after the
+        person is deleted, within the family tree it was last in.
+        """
+        try:
+            limit = _int_param(request, "limit", 100, minimum=1, maximum=1000)
+            tree = _tree(request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FamilyTree.DoesNotExist:
+            return _tree_not_found()
+        current = list(Person.objects.filter(pk=pk).values_list("tree_id", flat=True))
+        if tree is not None:
+            last_tree = (current[0] or 0) if current else history.tree_of(pk)
+            if last_tree != tree:
+                return _not_found()
+        changes = PersonChange.objects.filter(person_id=pk).order_by("-version")
+        entries = [
+            {
+                "version": change.version,
+                "kind": change.kind,
+                "changed_on": change.changed_on,
+                "changes": change.diff,
+                "snapshot": change.snapshot is not None,
+            }
+            for change in changes[:limit]
+        ]
+        if not entries and not current:
+            return _not_found()
+        return Response({"person": pk, "count": changes.count(), "changes": entries})
+
+
+class PersonMergeView(APIView):
+    """
+    Compare (GET) or merge (POST) the subgraph around the person `source`
+    into the one around the person `pk`; see `persons.merge`.
+    """
+
+    def _options(self, request):
+        min_similarity = _float_param(request, "min_similarity", merge.MIN_SIMILARITY)
+        if not 0 < min_similarity <= 1:
+            raise ValueError("'min_similarity' must be between 0 and 1")
+        return {
+            "up": _int_param(request, "up", 3, maximum=MAX_DEPTH),
+            "down": _int_param(request, "down", 3, maximum=MAX_DEPTH),
+            "min_similarity": min_similarity,
+        }
+
+    def get(self, request, pk, source, format=None):
+        try:
+            options = self._options(request)
+            persons = _persons(request)
+            target, other = persons.get(pk=pk), persons.get(pk=source)
+            return Response(merge.diff(target, other, **options))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FamilyTree.DoesNotExist:
+            return _tree_not_found()
+        except Person.DoesNotExist:
+            return _not_found()
+
+    @csrf_exempt
+    def post(self, request, pk, source, format=None):
+        serializer = PersonMergeSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            options = self._options(request)
+            persons = _persons(request)
+            target, other = persons.get(pk=pk), persons.get(pk=source)
+            _writable(target.tree_id, other.tree_id)
+            result = merge.merge(
+                target, other, prefer=serializer.validated_data["prefer"], **options
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FamilyTree.DoesNotExist:
+            return _tree_not_found()
+        except Person.DoesNotExist:
+            return _not_found()
+        except TreeMoving as e:
+            return _tree_moving(e)
+        return Response(result)
+
+
+class PersonStatsView(APIView):
+    def get(self, request, format=None):
+        try:
+            top = _int_param(request, "top", 10, minimum=1, maximum=100)
+            tree = _tree(request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FamilyTree.DoesNotExist:
+            return _tree_not_found()
+        return Response(stats.summary(top=top, tree=tree))
+
+
+class PersonConsistencyView(APIView):
+    """
+    The issues found by the latest finished `check_consistency` job of the
+    `?tree=` scope. The scan itself runs in the job queue: when no check
+    has finished since the last change, one is queued (one at a time per
+    scope) and the previous result is served meanwhile, marked `stale`.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, format=None):
+        try:
+            limit = _int_param(
+                request, "limit", 100, minimum=1, maximum=consistency.MAX_STORED_ISSUES
+            )
+            tree = _tree(request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FamilyTree.DoesNotExist:
+            return _tree_not_found()
+        revision = revisions.current(revisions.PERSONS, tree=tree)
+        checks = Job.objects.filter(kind="check_consistency", payload__tree=tree)
+        done = (
+            checks.filter(status=Job.SUCCEEDED).order_by("-finished_on", "-pk").first()
+        )
+        pending = (
+            checks.filter(status__in=[Job.QUEUED, Job.RUNNING]).order_by("pk").first()
+        )
+        stale = done is None or done.result["revision"] != revision
+        if stale and pending is None:
+            pending = jobs.submit(
+                "check_consistency", {"tree": tree}, user=request.user
+            )
+        if done is None:
             return Response(
-                {"error": "Person not found"}, status=status.HTTP_404_NOT_FOUND
+                {"revision": None, "job": pending.pk}, status=status.HTTP_202_ACCEPTED
             )
 
+        issues = done.result["issues"]
+        count = done.result["count"]
+        kind = request.query_params.get("kind")
+        if kind:
+            issues = [issue for issue in issues if issue["kind"] == kind]
+            count = done.result["kinds"].get(kind, 0)
+        return Response(
+            {
+                "revision": done.result["revision"],
+                "checked_on": done.finished_on,
+                "stale": stale,
+                "job": pending.pk if pending else None,
+                "count": count,
+                "issues": issues[:limit],
+            }
+        )
+
+
+def _persons_page(request, persons, **extra):
+    """
+    Serialize one page of `persons`, annotated by `intervals` with
+    `lifespan_estimated`, in id order: `?limit=` persons after the id
+    `?after=`. `next` is the `after` of the following page, None on the
+    last one. Raises ValueError for invalid parameters.
+    """
+    limit = _int_param(request, "limit", 100, minimum=1, maximum=1000)
+    after = _int_param(request, "after", 0)
+    page = list(
+        persons.filter(pk__gt=after)
+        .select_related("user_account")
+        .order_by("pk")[: limit + 1]
+    )
+    more = len(page) > limit
+    page = page[:limit]
+    return Response(
+        {
+            **extra,
+            "persons": PersonSerializer(page, many=True).data,
+            "estimated": [person.pk for person in page if person.lifespan_estimated],
+            "next": page[-1].pk if more else None,
+        }
+    )
+
+
+class PersonAliveView(APIView):
+    def get(self, request, format=None):
+        try:
+            day = parse_date(request.query_params.get("on", ""))
+        except ValueError:
+            day = None
+        if day is None:
+            return Response(
+                {"error": "'on' must be a date (YYYY-MM-DD)"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            persons = intervals.alive_on(day, _persons(request))
+            return _persons_page(request, persons, on=day)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FamilyTree.DoesNotExist:
+            return _tree_not_found()
+
+
+class PersonContemporariesView(APIView):
+    def get(self, request, pk, format=None):
+        try:
+            persons = _persons(request)
+            person = persons.get(pk=pk)
+            matches = intervals.contemporaries(person, persons)
+            if matches is None:
+                return Response(
+                    {"error": "Person has neither a date of birth nor of death"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            return _persons_page(request, matches, person=person.pk)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FamilyTree.DoesNotExist:
+            return _tree_not_found()
+        except Person.DoesNotExist:
+            return _not_found()
+
+
+class PersonNearView(APIView):
+    """
+    Persons born or deceased near a place: `?place=Leipzig&km=50`,
+    `?lat=51.34&lon=12.37&km=50` or `?bbox=south,west,north,east`, each
+    optionally with `event=birth|death|any`.
+    """
+
+    def get(self, request, format=None):
+        event = request.query_params.get("event", "any")
+        if event not in ("birth", "death", "any"):
+            return Response(
+                {"error": "'event' must be birth, death or any"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            scope = _persons(request)
+            if "bbox" in request.query_params:
+                south, west, north, east = (
+                    float(v) for v in request.query_params["bbox"].split(",")
+                )
+                matches = {
+                    pk: None
+                    for pk in places.in_box(south, west, north, east).values_list(
+                        "pk", flat=True
+                    )
+                }
+                center = None
+            else:
+                km = _float_param(request, "km", 50)
+                if "place" in request.query_params:
+                    entry = gazetteer.lookup(request.query_params["place"])
+                    if entry is None:
+                        return Response(
+                            {"error": "Unknown place"},
+                            status=status.HTTP_404_NOT_FOUND,
+                        )
+                    center = [entry.latitude, entry.longitude]
+                else:
+                    center = [
+                        _float_param(request, "lat"),
+                        _float_param(request, "lon"),
+                    ]
+                    if None in center:
+                        raise ValueError("Give 'place', 'lat' and 'lon', or 'bbox'")
+                matches = places.within(*center, km)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FamilyTree.DoesNotExist:
+            return _tree_not_found()
+
+        persons = places.persons_at(list(matches), event=event) & scope
+        return Response(
+            {
+                "center": center,
+                "places": [
+                    {
+                        "id": place.pk,
+                        "name": str(place),
+                        "latitude": place.latitude,
+                        "longitude": place.longitude,
+                        "distance_km": matches[place.pk],
+                    }
+                    for place in Place.objects.filter(pk__in=matches).order_by("pk")
+                ],
+                "persons": PersonSerializer(
+                    persons.select_related("user_account").order_by("pk"), many=True
+                ).data,
+            }
+        )
+
+
+class PersonGraphView(APIView):
+    def get(self, request, format=None):
+        try:
+            tree = _tree(request)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FamilyTree.DoesNotExist:
+            return _tree_not_found()
+        birth_years = _bool_param(request, "birth_years", False)
+        encoding = choose_encoding(request)
+        # A concurrent rebuild may remove the file between finding and
+        # opening it; the next path is the newer snapshot.
+        for _ in range(GRAPH_SNAPSHOT_ATTEMPTS):
+            path = snapshot_path(birth_years=birth_years, tree=tree)
+            try:
+                if encoding is not None:
+                    path = compressed_snapshot_path(path, encoding)
+                etag = f'"{path.name}"'
+                if request.headers.get("If-None-Match") == etag:
+                    response = HttpResponseNotModified(headers={"ETag": etag})
+                else:
+                    response = FileResponse(
+                        open(path, "rb"), content_type="application/octet-stream"
+                    )
+                    response["ETag"] = etag
+                    if encoding is not None:
+                        response["Content-Encoding"] = encoding
+                break
+            except FileNotFoundError:
+                continue
+        else:
+            response = Response(
+                {"error": "The graph is changing too fast, try again"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": "1"},
+            )
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return response
+
 
 class CurrentUserPersonView(APIView):
     def get(self, request, format=None):
@@ -69,15 +814,75 @@ class CurrentUserPersonView(APIView):
                 {"error": "Not authenticated"}, status=status.HTTP_401_UNAUTHORIZED
             )
 
-        try:
-            person = Person.objects.get(user_account=request.user)
-            serializer = PersonSerializer(person)
-            return Response(serializer.data)
-        except Person.DoesNotExist:
+        person = accounts.linked_person(request.user)
+        if person is None:
             return Response(
                 {"error": "No person associated with this user"},
                 status=status.HTTP_404_NOT_FOUND,
             )
+        return Response(person)
+
+
+class JobListView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, format=None):
+        queryset = Job.objects.order_by("-pk")
+        job_status = request.query_params.get("status")
+        if job_status:
+            queryset = queryset.filter(status=job_status)
+        try:
+            limit = _int_param(request, "limit", 50, minimum=1, maximum=500)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(JobSerializer(queryset[:limit], many=True).data)
+
+    @csrf_exempt
+    def post(self, request, format=None):
+        serializer = JobSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=400)
+        try:
+            job = jobs.submit(
+                serializer.validated_data["kind"],
+                serializer.validated_data.get("payload"),
+                user=request.user,
+            )
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(JobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+
+class JobDetailView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, pk, format=None):
+        try:
+            job = Job.objects.get(pk=pk)
+        except Job.DoesNotExist:
+            return Response(
+                {"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(JobSerializer(job).data)
+
+
+class JobCancelView(APIView):
+    permission_classes = [IsAdminUser]
+
+    @csrf_exempt
+    def post(self, request, pk, format=None):
+        try:
+            job = Job.objects.get(pk=pk)
+        except Job.DoesNotExist:
+            return Response(
+                {"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        if not jobs.cancel(job):
+            return Response(
+                {"error": "Job has already finished"}, status=status.HTTP_409_CONFLICT
+            )
+        job.refresh_from_db()
+        return Response(JobSerializer(job).data)
 
 
 def get_csrf_token(request):